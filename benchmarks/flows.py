@@ -0,0 +1,339 @@
+"""
+Нагрузочный тест сценариев бота: синтетические обновления подаются прямо
+в диспетчер из bot.py (dp.feed_update), запросы к Bot API не уходят в сеть
+(benchmarks.stub_session). База — временная схема в базе из DB_URL,
+заполненная пользователями и транзакциями (схема удаляется в конце).
+
+Для каждого сценария печатаются скорость и задержки p50/p95/p99 (время
+всего сценария, от первого обновления до ответа на последнее). Результаты
+можно сохранить как базовые (--save-baseline) и сравнивать с ними
+следующие запуски: ухудшение больше --tolerance отмечается, а код выхода
+становится 1. Без базовых результатов (или если они сняты с другими
+параметрами) сравнивать не с чем — запуск сразу завершается с ошибкой;
+базовые результаты для параметров по умолчанию лежат в
+benchmarks/baselines/flows.json.
+
+    python -m benchmarks.flows --users 500 --transactions 200000 --iterations 500
+    python -m benchmarks.flows --save-baseline
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from benchmarks.ingest import _with_search_path
+from benchmarks.webhook import make_update, percentile
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "flows.json")
+# Параметры, с которыми сняты базовые результаты: сравнивать можно только с ними
+BASELINE_PARAMS = (
+    "users",
+    "transactions",
+    "iterations",
+    "concurrency",
+    "api_latency",
+    "reminder_batch",
+    "reminder_batches",
+    "flows",
+)
+CATEGORIES = [f"cat{i}" for i in range(16)]
+
+# Сценарии: шаги ("text", текст сообщения) или ("callback", данные кнопки)
+FLOWS = {
+    "add_expense": lambda: [
+        ("text", "➕ Добавить расход"),
+        ("text", f"{random.randint(1, 5000)} {random.choice(CATEGORIES[:8])}"),
+    ],
+    "add_income": lambda: [
+        ("text", "💰 Добавить доход"),
+        ("text", f"{random.randint(1, 5000)} {random.choice(CATEGORIES)}"),
+    ],
+    "balance": lambda: [("text", "⚖️ Баланс")],
+    "history": lambda: [
+        ("text", "📜 История транзакций"),
+        ("text", f"/history расходы {random.choice(CATEGORIES[:8])}"),
+    ],
+    "report": lambda: [
+        ("text", "📊 Отчет"),
+        ("callback", "Expense"),
+        ("callback", f"Expense_{random.choice(CATEGORIES[:8])}"),
+        ("callback", random.choice(["week", "month"])),
+    ],
+    "overall_report": lambda: [
+        ("text", "💸 Статистика"),
+        ("callback", random.choice(["report_week", "report_month"])),
+    ],
+    "chart": lambda: [
+        ("text", "📈 График"),
+        ("callback", random.choice(["chart_expense", "chart_income"])),
+    ],
+    "trend": lambda: [
+        ("text", "📈 График"),
+        ("callback", random.choice(["trend:day", "trend:week", "trend:month"])),
+    ],
+}
+
+
+def make_callback(update_id: int, user_id: int, data: str) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": user,
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "stub",
+            },
+        },
+    }
+
+
+def seed_records(users: int, transactions: int):
+    """Транзакции для add_transactions_bulk: у каждого пользователя есть
+    расходы во всех категориях CATEGORIES[:8], остальное — случайно за 90 дней."""
+    now = datetime.now()
+    for i in range(transactions):
+        user_id = i % users + 1
+        if i < users * 8:
+            type_, category = "Expense", CATEGORIES[i // users]
+        else:
+            type_ = "Expense" if random.random() < 0.7 else "Income"
+            category = random.choice(CATEGORIES)
+        yield (
+            uuid.uuid4(),
+            user_id,
+            type_,
+            Decimal(random.randint(100, 500_000)) / 100,
+            category,
+            now - timedelta(seconds=random.randint(0, 90 * 86400)),
+        )
+
+
+def summarize(latencies: list, elapsed: float) -> dict:
+    return {
+        "count": len(latencies),
+        "throughput": len(latencies) / elapsed,
+        "p50": percentile(latencies, 50) * 1000,
+        "p95": percentile(latencies, 95) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+    }
+
+
+async def run_flow(app, name: str, args, next_update_id) -> dict:
+    from aiogram.types import Update
+
+    # Пользователь не участвует в двух сценариях сразу (иначе спутается FSM)
+    idle_users = asyncio.Queue()
+    for user_id in random.sample(range(1, args.users + 1), min(args.users, args.concurrency * 4)):
+        idle_users.put_nowait(user_id)
+    remaining = iter(range(args.iterations))
+    latencies = []
+
+    async def worker():
+        for _ in remaining:
+            user_id = await idle_users.get()
+            started = time.perf_counter()
+            for kind, payload in FLOWS[name]():
+                builder = make_update if kind == "text" else make_callback
+                raw = builder(next(next_update_id), user_id, payload)
+                await app.dp.feed_update(
+                    app.bot, Update.model_validate(raw, context={"bot": app.bot})
+                )
+            latencies.append(time.perf_counter() - started)
+            idle_users.put_nowait(user_id)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    return summarize(latencies, time.perf_counter() - started)
+
+
+async def run_reminders(args) -> dict:
+    """Пачки напоминаний: очередь делается «наступившей» по одной пачке
+    (по кругу среди пользователей), каждая пачка обрабатывается целиком."""
+    import database
+    import reminders
+
+    reminders.REMINDER_BATCH_SIZE = args.reminder_batch
+    await database.ensure_reminder_queue()
+    latencies = []
+    users = 0
+    started = time.perf_counter()
+    for batch in range(args.reminder_batches):
+        first = batch * args.reminder_batch % args.users + 1
+        async with database.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE reminder_queue
+                SET due_at = now() - INTERVAL '1 second', claimed_until = NULL, last_sent_on = NULL
+                WHERE user_id BETWEEN $1 AND $2
+                """,
+                first,
+                first + args.reminder_batch - 1,
+            )
+        batch_started = time.perf_counter()
+        stats = await reminders.process_due_reminders()
+        latencies.append(time.perf_counter() - batch_started)
+        users += stats["claimed"]
+    result = summarize(latencies, time.perf_counter() - started)
+    # Скорость — пользователей в секунду, а не пачек
+    result["throughput"] = users / (time.perf_counter() - started)
+    return result
+
+
+def baseline_params(args) -> dict:
+    return {key: getattr(args, key) for key in BASELINE_PARAMS}
+
+
+def load_baseline(path: str, args) -> dict:
+    """Базовые результаты для сравнения; ValueError, если сравнивать не с чем."""
+    if not os.path.exists(path):
+        raise ValueError(f"базовых результатов нет ({path}), сохраните их: --save-baseline")
+    with open(path, encoding="utf-8") as file:
+        baseline = json.load(file)
+    params = baseline_params(args)
+    saved = baseline.get("params", {})
+    different = [key for key in params if saved.get(key) != params[key]]
+    if different:
+        raise ValueError(
+            "базовые результаты сняты с другими параметрами: "
+            + ", ".join(f"{key}={saved.get(key)!r} (сейчас {params[key]!r})" for key in different)
+            + " (повторите их или сохраните новые: --save-baseline)"
+        )
+    return baseline
+
+
+def save_baseline(path: str, args, results: dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "params": baseline_params(args),
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(data, file, ensure_ascii=False, indent=2)
+    print(f"\nБазовые результаты сохранены: {path}")
+
+
+def print_results(results: dict, baseline, tolerance: float) -> bool:
+    """Печатает таблицу; возвращает True, если есть ухудшения против baseline."""
+    base = (baseline or {}).get("results", {})
+    regressed = False
+    print(f"\n{'сценарий':<16}{'в сек':>10}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+    for name, res in results.items():
+        line = (
+            f"{name:<16}{res['throughput']:>10.1f}{res['p50']:>10.2f}"
+            f"{res['p95']:>10.2f}{res['p99']:>10.2f}"
+        )
+        old = base.get(name)
+        if old:
+            slower = res["p95"] / old["p95"] - 1
+            fewer = 1 - res["throughput"] / old["throughput"]
+            mark = ""
+            if slower > tolerance or fewer > tolerance:
+                mark = "  ⚠️ хуже базовых"
+                regressed = True
+            line += f"   p95 {slower:+.0%}, скорость {-fewer:+.0%}{mark}"
+        print(line)
+    return regressed
+
+
+async def run(args, baseline):
+    schema = f"bench_flows_{os.getpid()}"
+    base_dsn = os.getenv("DB_URL")
+    os.environ["DB_URL"] = _with_search_path(base_dsn, schema)
+    os.environ.setdefault("DB_POOL_MAX_SIZE", str(max(10, args.concurrency)))
+    os.environ.setdefault("BOT_TOKEN", "123456:bench")
+    os.environ["INGEST_MODE"] = "direct"
+    os.environ.setdefault("FSM_STORAGE", "memory")
+    # Рассылка напоминаний без ограничения скорости: замеряем бота, а не лимиты Telegram
+    os.environ.setdefault("BROADCAST_RATE", "0")
+    os.environ.setdefault("SLOW_QUERY_MS", "5000")
+
+    import asyncpg
+    import bot as app
+    import database
+    import reminders
+    from benchmarks.stub_session import StubSession
+
+    app.bot.session = StubSession(latency=args.api_latency)
+    reminders.bot.session = StubSession(latency=args.api_latency)
+
+    admin = await asyncpg.connect(base_dsn)
+    await admin.execute(f"CREATE SCHEMA {schema}")
+    results = {}
+    try:
+        await app.on_startup(background=False, metrics_port=0)
+        print(f"Заполнение: {args.users} пользователей, {args.transactions} транзакций...")
+        started = time.perf_counter()
+        async with database.acquire() as conn:
+            await conn.execute(
+                "INSERT INTO users (user_id, first_name) "
+                "SELECT g, 'user' || g FROM generate_series(1, $1::int) g",
+                args.users,
+            )
+        await database.add_transactions_bulk(seed_records(args.users, args.transactions))
+        async with database.acquire() as conn:
+            await conn.execute("ANALYZE")
+        print(f"Готово за {time.perf_counter() - started:.1f} с")
+
+        next_update_id = iter(range(1, sys.maxsize))
+        for name in [name for name in args.flows or FLOWS if name in FLOWS]:
+            results[name] = await run_flow(app, name, args, next_update_id)
+            print(f"  {name}: {results[name]['count']} сценариев")
+        if not args.flows or "reminders" in args.flows:
+            results["reminders"] = await run_reminders(args)
+    finally:
+        await app.on_shutdown()
+        await admin.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        await admin.close()
+
+    regressed = print_results(results, baseline, args.tolerance)
+    print("\nreminders: задержка — на пачку, скорость — пользователей в секунду")
+    if args.save_baseline:
+        save_baseline(args.baseline, args, results)
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--transactions", type=int, default=200_000)
+    parser.add_argument("--iterations", type=int, default=500, help="сценариев каждого вида")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа Bot API, сек")
+    parser.add_argument("--reminder-batch", type=int, default=100)
+    parser.add_argument("--reminder-batches", type=int, default=50)
+    parser.add_argument(
+        "--flows", nargs="+", choices=[*FLOWS, "reminders"], help="только эти сценарии"
+    )
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение, доля")
+    args = parser.parse_args()
+    baseline = None
+    if not args.save_baseline:
+        # Проверяем до заполнения базы, а не после долгого прогона
+        try:
+            baseline = load_baseline(args.baseline, args)
+        except ValueError as e:
+            parser.error(str(e))
+    regressed = asyncio.run(run(args, baseline))
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Устойчивая скорость записи транзакций: по одной (add_income) против
+отложенной пакетной записи через журнал и COPY (ingest.WriteBehindBuffer).
+
+Работает во временной схеме базы из DB_URL (схема удаляется в конце).
+
+    python -m benchmarks.ingest --writes 20000 --concurrency 32
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from urllib.parse import urlencode
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _with_search_path(dsn: str, schema: str) -> str:
+    # asyncpg передаёт лишние параметры DSN серверу как настройки сессии
+    sep = "&" if "?" in dsn else "?"
+    return dsn + sep + urlencode({"search_path": schema})
+
+
+async def run_concurrently(total: int, concurrency: int, write):
+    remaining = iter(range(total))
+
+    async def worker():
+        for _ in remaining:
+            await write(random.randint(1, USERS), random.randint(1, 5000), f"cat{random.randint(0, 15)}")
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+USERS = 1000
+
+
+async def run(args):
+    global USERS
+    USERS = args.users
+    schema = f"bench_ingest_{os.getpid()}"
+    base_dsn = os.getenv("DB_URL")
+    os.environ["DB_URL"] = _with_search_path(base_dsn, schema)
+    os.environ.setdefault("DB_POOL_MAX_SIZE", str(args.concurrency))
+
+    import asyncpg
+    import database
+    from ingest import WriteBehindBuffer
+
+    admin = await asyncpg.connect(base_dsn)
+    await admin.execute(f"CREATE SCHEMA {schema}")
+    try:
+        await database.init_pool()
+        await database.create_tables()
+        async with database.acquire() as conn:
+            await conn.execute(
+                "INSERT INTO users (user_id) SELECT g FROM generate_series(1, $1::int) g",
+                args.users,
+            )
+
+        started = time.perf_counter()
+        await run_concurrently(args.writes, args.concurrency, database.add_income)
+        direct = args.writes / (time.perf_counter() - started)
+        print(f"по одной:         {direct:10.0f} вставок/с")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            buffer = WriteBehindBuffer(
+                journal_path=os.path.join(tmp, "ingest.journal"),
+                flush_size=args.batch,
+            )
+            await buffer.start()
+            started = time.perf_counter()
+
+            async def submit(user_id, amount, category):
+                await buffer.submit(user_id, "Income", amount, category)
+
+            await run_concurrently(args.writes, args.concurrency, submit)
+            acked = time.perf_counter() - started
+            await buffer.stop()
+            elapsed = time.perf_counter() - started
+        print(
+            f"пакетами:         {args.writes / elapsed:10.0f} вставок/с "
+            f"(подтверждение пользователю: {args.writes / acked:.0f}/с, "
+            f"пачек: {buffer.stats['batches']})"
+        )
+        print(f"\nПрирост: x{args.writes / elapsed / direct:.2f}")
+    finally:
+        await database.close_pool()
+        await admin.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        await admin.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--writes", type=int, default=20_000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--batch", type=int, default=500, help="размер пачки")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
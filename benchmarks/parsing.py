@@ -0,0 +1,65 @@
+"""
+Микробенчмарк разбора ввода «сумма категория» (parsing.py) против
+прежнего split() + float(). Базы и сети не нужно.
+
+    python -m benchmarks.parsing --lines 100000
+"""
+import argparse
+import random
+import time
+from parsing import parse_entries, parse_entry
+
+# Типичный ввод пользователей; прежний разбор понимал только первые два
+SAMPLES = [
+    "500 Продукты",
+    "1500.50 Кафе",
+    "1 500,50 Кафе и рестораны",
+    "1.5k Кофе",
+    "3 тыс Аренда",
+    "120+35 Такси",
+    "3*250 Обед",
+    "1000/3 Подарок на троих",
+]
+
+
+def old_parse(line: str):
+    args = line.split()
+    return float(args[0]), " ".join(args[1:])
+
+
+def measure(name: str, func, items: list) -> float:
+    started = time.perf_counter()
+    for item in items:
+        func(item)
+    elapsed = time.perf_counter() - started
+    print(f"{name:<34} {elapsed / len(items) * 1e6:8.2f} мкс/строка")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lines", type=int, default=100_000)
+    parser.add_argument("--per-message", type=int, default=10)
+    args = parser.parse_args()
+
+    simple = [random.choice(SAMPLES[:2]) for _ in range(args.lines)]
+    mixed = [random.choice(SAMPLES) for _ in range(args.lines)]
+    messages = [
+        "\n".join(mixed[i : i + args.per_message])
+        for i in range(0, len(mixed), args.per_message)
+    ]
+
+    print(f"Строк: {args.lines}, в многострочном сообщении: {args.per_message}\n")
+    base = measure("split + float (простой ввод)", old_parse, simple)
+    measure("parse_entry (простой ввод)", parse_entry, simple)
+    measure("parse_entry (все форматы)", parse_entry, mixed)
+    started = time.perf_counter()
+    for message in messages:
+        parse_entries(message)
+    elapsed = time.perf_counter() - started
+    print(f"{'parse_entries (многострочные)':<34} {elapsed / len(mixed) * 1e6:8.2f} мкс/строка")
+    print(f"\nЗамедление относительно float: x{elapsed / base:.1f}")
+
+
+if __name__ == "__main__":
+    main()
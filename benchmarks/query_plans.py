@@ -0,0 +1,184 @@
+"""
+Планы и задержки частых запросов к transactions до и после миграций.
+
+Создаёт временную схему в базе из DB_URL, заполняет её синтетическими
+данными, замеряет запросы на схеме без индексов (миграция 1), затем
+применяет остальные миграции и замеряет ещё раз. Схема удаляется в конце.
+
+    python -m benchmarks.query_plans --users 20000 --rows 3000000
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+import asyncpg
+from dotenv import load_dotenv
+from migrations import migrate
+
+load_dotenv()
+
+# Запросы из database.py, которые выполняются на каждое нажатие кнопки
+QUERIES = {
+    "get_last_transaction": (
+        """
+        SELECT id, type, amount, category_name, created_at FROM transactions
+        WHERE user_id = $1
+        ORDER BY created_at DESC
+        LIMIT 5
+        """,
+        lambda uid: (uid,),
+    ),
+    "get_report_data": (
+        """
+        SELECT type, category_name, SUM(amount) AS total_amount
+        FROM transactions
+        WHERE user_id = $1 AND type = $2 AND category_name = $3
+          AND created_at >= NOW() - $4 * INTERVAL '1 day'
+        GROUP BY type, category_name
+        """,
+        lambda uid: (uid, "Expense", f"cat{random.randint(0, 15)}", 30),
+    ),
+    "get_category_keyboard": (
+        "SELECT DISTINCT category_name FROM transactions WHERE user_id = $1 AND type = $2",
+        lambda uid: (uid, "Expense"),
+    ),
+    "generate_pie_chart": (
+        """
+        SELECT category_name, SUM(amount) AS total
+        FROM transactions
+        WHERE user_id = $1 AND type = $2
+        GROUP BY category_name
+        """,
+        lambda uid: (uid, "Expense"),
+    ),
+    "get_overall_report": (
+        """
+        SELECT type, SUM(amount) AS total_amount
+        FROM transactions
+        WHERE user_id = $1 AND created_at >= NOW() - ($2 * INTERVAL '1 day')
+        GROUP BY type
+        """,
+        lambda uid: (uid, 30),
+    ),
+    # Дальняя страница истории (get_transactions_page): курсор год назад
+    "history_page": (
+        """
+        SELECT id, type, amount, category_name, created_at FROM transactions
+        WHERE user_id = $1 AND (created_at, id) < ($2, $3)
+        ORDER BY created_at DESC, id DESC
+        LIMIT 11
+        """,
+        lambda uid: (uid, datetime.now() - timedelta(days=365), 2**31 - 1),
+    ),
+    "history_page_category": (
+        """
+        SELECT id, type, amount, category_name, created_at FROM transactions
+        WHERE user_id = $1 AND category_name = $2 AND (created_at, id) < ($3, $4)
+        ORDER BY created_at DESC, id DESC
+        LIMIT 11
+        """,
+        lambda uid: (
+            uid,
+            f"cat{random.randint(0, 15)}",
+            datetime.now() - timedelta(days=365),
+            2**31 - 1,
+        ),
+    ),
+}
+
+SEED_USERS_SQL = """
+INSERT INTO users (user_id)
+SELECT g FROM generate_series(1, $1::int) g
+"""
+
+SEED_TRANSACTIONS_SQL = """
+INSERT INTO transactions (user_id, type, amount, category_name, created_at)
+SELECT
+    1 + (random() * ($1::int - 1))::int,
+    CASE WHEN random() < 0.7 THEN 'Expense' ELSE 'Income' END,
+    round((random() * 5000)::numeric, 2),
+    'cat' || (random() * 15)::int,
+    NOW() - random() * INTERVAL '730 days'
+FROM generate_series(1, $2::int)
+"""
+
+
+async def measure(conn, users: int, repeat: int):
+    results = {}
+    for name, (sql, make_args) in QUERIES.items():
+        stmt = await conn.prepare(sql)
+        plan = await conn.fetch(
+            f"EXPLAIN (ANALYZE, BUFFERS) {sql}", *make_args(random.randint(1, users))
+        )
+        timings = []
+        for _ in range(repeat):
+            args = make_args(random.randint(1, users))
+            started = time.perf_counter()
+            await stmt.fetch(*args)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        results[name] = {
+            "plan": [row[0] for row in plan],
+            "p50": statistics.median(timings),
+            "p95": timings[int(len(timings) * 0.95) - 1],
+        }
+    return results
+
+
+def print_results(title: str, results: dict, verbose: bool):
+    print(f"\n=== {title} ===")
+    for name, res in results.items():
+        print(f"{name:<24} p50={res['p50']:9.3f} мс  p95={res['p95']:9.3f} мс")
+        lines = res["plan"] if verbose else res["plan"][:1]
+        for line in lines:
+            print(f"    {line}")
+
+
+async def run(args):
+    schema = f"bench_plans_{os.getpid()}"
+    conn = await asyncpg.connect(os.getenv("DB_URL"))
+    try:
+        await conn.execute(f"CREATE SCHEMA {schema}")
+        await conn.execute(f"SET search_path TO {schema}")
+        await migrate(conn, target=1)
+
+        print(f"Заполнение: {args.users} пользователей, {args.rows} транзакций...")
+        started = time.perf_counter()
+        await conn.execute(SEED_USERS_SQL, args.users)
+        await conn.execute(SEED_TRANSACTIONS_SQL, args.users, args.rows)
+        await conn.execute("ANALYZE")
+        print(f"Готово за {time.perf_counter() - started:.1f} с")
+
+        before = await measure(conn, args.users, args.repeat)
+        print_results("До миграций (только первичный ключ)", before, args.verbose)
+
+        started = time.perf_counter()
+        await migrate(conn)
+        await conn.execute("ANALYZE")
+        print(f"\nМиграции применены за {time.perf_counter() - started:.1f} с")
+
+        after = await measure(conn, args.users, args.repeat)
+        print_results("После миграций", after, args.verbose)
+
+        print("\n=== Ускорение p50 ===")
+        for name in QUERIES:
+            print(f"{name:<24} x{before[name]['p50'] / after[name]['p50']:.1f}")
+    finally:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        await conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--rows", type=int, default=3_000_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--verbose", action="store_true", help="печатать планы целиком")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Сессия бота без сети для бенчмарков: методы Bot API не уходят в Telegram,
+а сразу получают правдоподобный ответ (отправленное сообщение, True и т.п.).
+"""
+import asyncio
+from collections import Counter
+from datetime import datetime
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendPhoto
+from aiogram.types import Chat, Message, PhotoSize, User
+
+
+class StubSession(BaseSession):
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        # Имитация задержки ответа Telegram, сек
+        self.latency = latency
+        self.calls = Counter()
+        self._message_id = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        returning = method.__returning__
+        if returning is Message:
+            self._message_id += 1
+            extra = {}
+            if isinstance(method, SendPhoto):
+                extra["photo"] = [
+                    PhotoSize(
+                        file_id=f"stub-{self._message_id}",
+                        file_unique_id=f"stub-{self._message_id}",
+                        width=640,
+                        height=480,
+                    )
+                ]
+            return Message(
+                message_id=self._message_id,
+                date=datetime.now(),
+                chat=Chat(id=method.chat_id, type="private"),
+                text=getattr(method, "text", None),
+                **extra,
+            ).as_(bot)
+        if returning is User:
+            return User(id=bot.id, is_bot=True, first_name="stub")
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
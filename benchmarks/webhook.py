@@ -0,0 +1,139 @@
+"""
+Нагрузочный тест режима вебхука: синтетические обновления отправляются
+HTTP-запросами на локальный webhook.WebhookServer с настоящим диспетчером
+из bot.py. Запросы к Bot API не уходят в сеть (benchmarks.stub_session).
+
+Задержка считается от отправки обновления до завершения его обработчика.
+Работает во временной схеме базы из DB_URL (схема удаляется в конце).
+
+    python -m benchmarks.webhook --users 500 --serialize user
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from benchmarks.ingest import _with_search_path
+
+# Сценарий каждого пользователя; расход можно записать только в уже
+# существующую категорию, поэтому сначала доход
+SCRIPT = [
+    "/start",
+    "💰 Добавить доход",
+    "1000 Продукты",
+    "➕ Добавить расход",
+    "250 Продукты",
+    "⚖️ Баланс",
+    "📜 История транзакций",
+]
+
+
+def make_update(update_id: int, user_id: int, text: str) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": user,
+            "text": text,
+        },
+    }
+
+
+def percentile(values: list, q: float) -> float:
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+async def run(args):
+    schema = f"bench_webhook_{os.getpid()}"
+    base_dsn = os.getenv("DB_URL")
+    os.environ["DB_URL"] = _with_search_path(base_dsn, schema)
+    os.environ.setdefault("DB_POOL_MAX_SIZE", "20")
+    os.environ.setdefault("BOT_TOKEN", "123456:bench")
+    os.environ["INGEST_MODE"] = "direct"
+    os.environ.setdefault("FSM_STORAGE", "memory")
+
+    import asyncpg
+    from aiohttp import ClientSession
+    import database
+    from benchmarks.stub_session import StubSession
+    from bot import bot, dp
+    from webhook import WebhookServer
+
+    bot.session = StubSession(latency=args.api_latency)
+    sent_at = {}
+    latencies = []
+    done = asyncio.Event()
+    total = args.users * len(SCRIPT)
+
+    async def measure(handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            latencies.append(time.perf_counter() - sent_at[event.update_id])
+            if len(latencies) == total:
+                done.set()
+
+    dp.update.outer_middleware(measure)
+
+    admin = await asyncpg.connect(base_dsn)
+    await admin.execute(f"CREATE SCHEMA {schema}")
+    server = WebhookServer(dp, bot, serialize=args.serialize)
+    try:
+        await database.init_pool()
+        await database.create_tables()
+        await server.start("127.0.0.1", args.port)
+        url = f"http://127.0.0.1:{args.port}{server.path}"
+        next_id = iter(range(1, total + 1))
+
+        async with ClientSession() as http:
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def user_flow(user_id: int):
+                # Обновления одного пользователя уходят по порядку, как из Telegram
+                for text in SCRIPT:
+                    update_id = next(next_id)
+                    async with semaphore:
+                        sent_at[update_id] = time.perf_counter()
+                        async with http.post(url, json=make_update(update_id, user_id, text)) as resp:
+                            resp.raise_for_status()
+
+            started = time.perf_counter()
+            await asyncio.gather(*(user_flow(user_id) for user_id in range(1, args.users + 1)))
+            await asyncio.wait_for(done.wait(), timeout=300)
+            elapsed = time.perf_counter() - started
+
+        async with database.acquire() as conn:
+            stored = await conn.fetchval("SELECT COUNT(*) FROM transactions")
+    finally:
+        await server.stop()
+        await database.close_pool()
+        await admin.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        await admin.close()
+
+    print(f"обновлений:       {total} ({args.users} пользователей, очередь: {args.serialize})")
+    print(f"скорость:         {total / elapsed:10.0f} обновлений/с")
+    print(f"задержка p50:     {percentile(latencies, 50) * 1000:10.1f} мс")
+    print(f"задержка p99:     {percentile(latencies, 99) * 1000:10.1f} мс")
+    print(f"ошибок обработки: {server.stats['failed']}")
+    print(f"транзакций:       {stored} из {args.users * 2} ожидаемых")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=64, help="одновременных HTTP-запросов")
+    parser.add_argument("--serialize", choices=["user", "chat", "none"], default="user")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа Bot API, сек")
+    parser.add_argument("--port", type=int, default=8089)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Пропускная способность записи: старый путь (expenses/incomes + transactions)
+против нового (только transactions).
+
+Создаёт временную схему в базе из DB_URL со старыми таблицами
+(миграции до 3 включительно), прогоняет оба варианта записи
+с заданной параллельностью и печатает вставки/с и объём WAL.
+
+    python -m benchmarks.write_path --writes 20000 --concurrency 8
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+import asyncpg
+from dotenv import load_dotenv
+from migrations import migrate
+
+load_dotenv()
+
+BALANCE_SQL = """
+    INSERT INTO user_balances (user_id, total_expense)
+    VALUES ($1, $2)
+    ON CONFLICT (user_id) DO UPDATE
+    SET total_expense = user_balances.total_expense + EXCLUDED.total_expense
+"""
+
+TRANSACTION_SQL = """
+    INSERT INTO transactions (user_id, type, amount, category_name)
+    VALUES ($1, 'Expense', $2, $3)
+"""
+
+
+async def write_old(conn, user_id, amount, category):
+    async with conn.transaction():
+        await conn.execute(
+            "INSERT INTO expenses (user_id, amount, category_name) VALUES ($1, $2, $3)",
+            user_id,
+            amount,
+            category,
+        )
+        await conn.execute(TRANSACTION_SQL, user_id, amount, category)
+        await conn.execute(BALANCE_SQL, user_id, amount)
+
+
+async def write_new(conn, user_id, amount, category):
+    async with conn.transaction():
+        await conn.execute(TRANSACTION_SQL, user_id, amount, category)
+        await conn.execute(BALANCE_SQL, user_id, amount)
+
+
+async def run_path(pool, write, args):
+    remaining = iter(range(args.writes))
+
+    async def worker():
+        async with pool.acquire() as conn:
+            for _ in remaining:
+                await write(
+                    conn,
+                    random.randint(1, args.users),
+                    random.randint(1, 5000),
+                    f"cat{random.randint(0, 15)}",
+                )
+
+    async with pool.acquire() as conn:
+        wal_start = await conn.fetchval("SELECT pg_current_wal_lsn()")
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    async with pool.acquire() as conn:
+        wal_bytes = await conn.fetchval(
+            "SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), $1)", wal_start
+        )
+    return args.writes / elapsed, float(wal_bytes) / args.writes
+
+
+async def run(args):
+    schema = f"bench_writes_{os.getpid()}"
+    pool = await asyncpg.create_pool(
+        os.getenv("DB_URL"),
+        min_size=args.concurrency,
+        max_size=args.concurrency,
+        server_settings={"search_path": schema},
+    )
+    try:
+        async with pool.acquire() as conn:
+            await conn.execute(f"CREATE SCHEMA {schema}")
+            await migrate(conn, target=3)
+            await conn.execute(
+                "INSERT INTO users (user_id) SELECT g FROM generate_series(1, $1::int) g",
+                args.users,
+            )
+
+        results = {}
+        for name, write in (("старый путь", write_old), ("новый путь", write_new)):
+            results[name] = await run_path(pool, write, args)
+            rate, wal = results[name]
+            print(f"{name:<12} {rate:10.0f} вставок/с  WAL {wal:8.0f} байт/вставка")
+
+        old_rate, old_wal = results["старый путь"]
+        new_rate, new_wal = results["новый путь"]
+        print(f"\nПрирост: x{new_rate / old_rate:.2f} по скорости, WAL меньше в x{old_wal / new_wal:.2f}")
+    finally:
+        async with pool.acquire() as conn:
+            await conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        await pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--writes", type=int, default=20_000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,38 @@
+import asyncio
 import os
+import tempfile
+from datetime import datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from aiogram import Bot, Dispatcher, F, types
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
-from aiogram.types import Message, FSInputFile
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, BufferedInputFile
 from aiogram.fsm.state import StatesGroup, State
 from dotenv import load_dotenv
 from database import (
+    init_pool,
+    close_pool,
     create_tables,
     # generate_expense_pie_chart,
     generate_pie_chart,
+    generate_trend_chart,
+    TREND_BUCKETS,
     register_user,
-    add_expense,
-    add_income,
+    add_transactions,
     get_last_transaction,
+    get_transactions_page,
+    get_user_categories,
     get_user_balance,
     get_report_data,
     get_overall_report,
     get_category_keyboard,
+    get_pool_stats,
+    set_user_timezone,
+    set_reminder_time,
+    set_budget,
+    delete_budget,
+    get_budgets,
 )
 from waiting_confirmation import DeleteTransactionState, process_confirmation
 from keyboard import (
@@ -27,20 +43,103 @@ from keyboard import (
     get_report_keyboard,
     get_income_expense_keyboard,
     get_time_period_keyboard,
+    get_history_keyboard,
+    decode_history_callback,
+    category_tag,
 )
 from reminders import reminder_loop
+from budgets import BUDGET_ALERT_THRESHOLDS, budget_alerts, budget_rollover_loop
+from ingest import INGEST_MODE, WriteBehindBuffer
+from storage import count_states, create_storage, fsm_eviction_loop
+from importer import IMPORT_FORMATS, StatementFormatError, import_statement
+from parsing import ParseError, parse_amount, parse_entries
+from response_cache import RESPONSE_CACHE_TTL, response_cache
+from metrics import (
+    METRICS_PORT,
+    HandlerTimingMiddleware,
+    register_gauge,
+    start_metrics_server,
+)
+from export import (
+    EXPORT_FORMATS,
+    ExportAlreadyQueued,
+    ExportQueue,
+    ExportQueueFull,
+    xlsx_available,
+)
+from webhook import run_webhook
+from charts import (
+    ChartQueueFull,
+    get_chart_pool_stats,
+    remember_chart_file_id,
+    start_chart_pool,
+    stop_chart_pool,
+)
 
 
 load_dotenv()
 
+# polling — опрос Telegram (по умолчанию), webhook — приём обновлений на HTTP-сервер
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "10"))
+_TREND_BUCKETS = {"день": "day", "неделя": "week", "месяц": "month"}
+_TREND_TITLES = {"day": "по дням", "week": "по неделям", "month": "по месяцам"}
+
 bot = Bot(token=os.getenv("BOT_TOKEN"))
-dp = Dispatcher()
+dp = Dispatcher(storage=create_storage())
+dp.message.middleware(HandlerTimingMiddleware())
+dp.callback_query.middleware(HandlerTimingMiddleware())
+
+
+async def notify_write_failure(record, error):
+    """Сообщает пользователю, что отложенная запись транзакции не удалась."""
+    _, user_id, type_, amount, category_name, _ = record
+    kind = "Расход" if type_ == "Expense" else "Доход"
+    await bot.send_message(
+        user_id,
+        f"❌ {kind} не сохранён: {amount} руб. на {category_name} ({error}). "
+        f"Попробуйте добавить его ещё раз.",
+    )
+
+
+export_queue = ExportQueue(bot)
+
+# При INGEST_MODE=buffered транзакции пишутся в базу пачками (см. ingest.py)
+write_buffer = (
+    WriteBehindBuffer(on_failure=notify_write_failure)
+    if INGEST_MODE == "buffered"
+    else None
+)
+
+
+# Показатели для /metrics (metrics.py), снимаются при каждом запросе
+register_gauge(
+    "fsm_states",
+    "Диалоги в каждом состоянии FSM",
+    lambda: count_states(dp.storage),
+    label="state",
+)
+register_gauge("db_pool", "Пул соединений с базой", get_pool_stats, label="stat")
+register_gauge("chart_pool", "Пул отрисовки графиков", get_chart_pool_stats, label="stat")
+register_gauge("response_cache", "Кэш ответов", lambda: response_cache.stats, label="stat")
+register_gauge("export_queue_pending", "Выгрузки в очереди", lambda: export_queue.pending)
+register_gauge("export_jobs", "Выгрузки с момента запуска", lambda: export_queue.stats, label="stat")
+if write_buffer is not None:
+    register_gauge(
+        "ingest_buffer", "Буфер записи транзакций", lambda: write_buffer.stats, label="stat"
+    )
+
+_metrics_runner = None
 
 
 class AddTransactionState(StatesGroup):
     waiting_for_amount_and_category = State()
 
 
+class ImportState(StatesGroup):
+    waiting_for_file = State()
+
+
 @dp.message(Command("start"))
 async def cmd_start(message: Message):
     # Регистрация пользователя
@@ -58,11 +157,210 @@ async def cmd_start(message: Message):
     )
 
 
+@dp.message(Command("timezone"))
+async def cmd_timezone(message: Message):
+    """Устанавливает часовой пояс пользователя: /timezone Europe/Moscow"""
+    args = message.text.split(maxsplit=1)
+    if len(args) < 2:
+        await message.answer(
+            "Укажите часовой пояс, например: /timezone Europe/Moscow"
+        )
+        return
+
+    tz_name = args[1].strip()
+    try:
+        ZoneInfo(tz_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        await message.answer(f"Неизвестный часовой пояс: {tz_name}")
+        return
+
+    await set_user_timezone(message.from_user.id, tz_name)
+    await message.answer(f"✅ Часовой пояс установлен: {tz_name}")
+
+
+@dp.message(Command("remind"))
+async def cmd_remind(message: Message):
+    """Устанавливает время ежедневного напоминания: /remind 21:30"""
+    args = message.text.split(maxsplit=1)
+    try:
+        reminder_time = datetime.strptime(args[1].strip(), "%H:%M").time()
+    except (IndexError, ValueError):
+        await message.answer("Укажите время в формате ЧЧ:ММ, например: /remind 21:30")
+        return
+
+    await set_reminder_time(message.from_user.id, reminder_time)
+    await message.answer(
+        f"✅ Напоминание будет приходить в {reminder_time.strftime('%H:%M')}"
+    )
+
+
+@dp.message(Command("export"))
+async def cmd_export(message: Message):
+    """Выгружает всю историю в файл: /export или /export xlsx"""
+    args = message.text.split(maxsplit=1)
+    fmt = args[1].strip().lower() if len(args) > 1 else "csv"
+    if fmt not in EXPORT_FORMATS:
+        await message.answer("Укажите формат: /export csv или /export xlsx")
+        return
+    if fmt == "xlsx" and not xlsx_available():
+        await message.answer("Выгрузка в XLSX недоступна, используйте /export csv")
+        return
+
+    try:
+        export_queue.submit(message.from_user.id, message.chat.id, fmt)
+    except ExportAlreadyQueued:
+        await message.answer("Выгрузка уже готовится, файл скоро придёт.")
+        return
+    except ExportQueueFull:
+        await message.answer("Сейчас много выгрузок, попробуйте через пару минут.")
+        return
+    await message.answer("⏳ Готовлю файл с историей, пришлю его сюда.")
+
+
+_BUDGET_USAGE = (
+    "Использование:\n"
+    "/budget — бюджеты на этот месяц\n"
+    "/budget 15000 Продукты — лимит расходов категории на месяц\n"
+    "/budget удалить Продукты — убрать бюджет"
+)
+
+
+@dp.message(Command("budget"))
+async def cmd_budget(message: Message):
+    """Месячные бюджеты категорий: /budget [сумма категория | удалить категория]"""
+    args = message.text.split(maxsplit=1)
+    user_id = message.from_user.id
+    if len(args) < 2:
+        budgets = await get_budgets(user_id)
+        if not budgets:
+            await message.answer("Бюджетов пока нет.\n\n" + _BUDGET_USAGE)
+            return
+        lines = []
+        for row in budgets:
+            percent = row["spent"] / row["monthly_limit"] * 100
+            if percent >= 100:
+                mark = "🚨"
+            elif percent >= BUDGET_ALERT_THRESHOLDS[0]:
+                mark = "⚠️"
+            else:
+                mark = "✅"
+            lines.append(
+                f"{mark} {row['category_name']}: {row['spent']} из "
+                f"{row['monthly_limit']} руб. ({percent:.0f}%)"
+            )
+        await message.answer("💼 Бюджеты на этот месяц:\n" + "\n".join(lines))
+        return
+
+    command, _, category_name = args[1].strip().partition(" ")
+    if command.lower() == "удалить":
+        category_name = " ".join(category_name.split())
+        if not category_name:
+            await message.answer(_BUDGET_USAGE)
+            return
+        if await delete_budget(user_id, category_name):
+            await message.answer(f"✅ Бюджет «{category_name}» удалён")
+        else:
+            await message.answer(f"Бюджета «{category_name}» нет")
+        return
+
+    try:
+        limit, rest = parse_amount(args[1])
+        category_name = " ".join(rest.split())
+        if not category_name:
+            raise ParseError("Укажите категорию")
+        row = await set_budget(user_id, category_name, limit)
+    except ValueError as e:
+        await message.answer(f"Ошибка: {e}.\n\n{_BUDGET_USAGE}")
+        return
+    await message.answer(
+        f"✅ Бюджет «{category_name}»: {row['monthly_limit']} руб. в месяц, "
+        f"потрачено {row['spent']} руб."
+    )
+
+
+# Telegram не отдаёт ботам файлы больше 20 МБ
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024
+
+
+@dp.message(Command("import"))
+async def cmd_import(message: Message, state: FSMContext):
+    """Ждёт файл банковской выписки (CSV или OFX)."""
+    await message.answer(
+        "📥 Пришлите выписку из банка файлом .csv или .ofx.\n"
+        "В CSV нужны колонки с датой и суммой (расходы — со знаком минус "
+        "или с типом «Расход»), по желанию — категория и описание.",
+        reply_markup=get_back_keyboard(),
+    )
+    await state.set_state(ImportState.waiting_for_file)
+
+
+@dp.message(ImportState.waiting_for_file, F.document)
+async def process_import_file(message: Message, state: FSMContext):
+    document = message.document
+    fmt = os.path.splitext(document.file_name or "")[1].lstrip(".").lower()
+    if fmt == "qfx":
+        fmt = "ofx"
+    if fmt not in IMPORT_FORMATS:
+        await message.answer("Нужен файл .csv или .ofx. Попробуйте ещё раз.")
+        return
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        await message.answer("Файл больше 20 МБ — разбейте выписку на части.")
+        return
+    await state.clear()
+
+    status = await message.answer("⏳ Загружаю выписку...")
+
+    async def progress(parsed: int):
+        try:
+            await status.edit_text(f"⏳ Обработано строк: {parsed}...")
+        except TelegramBadRequest:
+            pass
+
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}", prefix="import_")
+    os.close(fd)
+    try:
+        await bot.download(document, destination=path)
+        result = await import_statement(message.from_user.id, path, fmt, progress)
+    except StatementFormatError as e:
+        await status.edit_text(f"❌ Не удалось прочитать выписку: {e}")
+        return
+    except Exception as e:
+        # Файл не скачался, не в той кодировке, ошибка базы и т.п.
+        print(f"[Импорт] user_id={message.from_user.id}: {e!r}")
+        await status.edit_text(
+            "❌ Не удалось импортировать выписку. Проверьте файл и попробуйте позже."
+        )
+        return
+    finally:
+        os.remove(path)
+
+    report = (
+        f"Добавлено транзакций: {result['inserted']}\n"
+        f"Пропущено повторов: {result['duplicates']}"
+    )
+    if result["rejected"]:
+        report += "\nСначала отправьте /start, затем повторите импорт."
+    if result["failed"]:
+        report += f"\nСтрок с ошибками: {result['failed']}"
+        report += "".join(
+            f"\n  • {line}: {error}" for line, error in result["errors"]
+        )
+    await status.edit_text("✅ Импорт завершён.")
+    await message.answer(report, reply_markup=get_main_menu_keyboard())
+
+
+@dp.message(ImportState.waiting_for_file)
+async def process_import_cancel(message: Message, state: FSMContext):
+    await state.clear()
+    await message.answer("Импорт отменён.", reply_markup=get_main_menu_keyboard())
+
+
 @dp.message(F.text == "➕ Добавить расход")
 async def start_add_expense(message: Message, state: FSMContext):
     """Переводит бота в режим ожидания суммы и категории расхода."""
     await message.answer(
-        "Введите сумму и категорию расхода через пробел (например: 500 Продукты)",
+        "Введите сумму и категорию расхода через пробел (например: 500 Продукты).\n"
+        "Можно несколько строк — по записи на строку.",
         reply_markup=get_back_keyboard(),
     )
     await state.update_data(
@@ -75,7 +373,8 @@ async def start_add_expense(message: Message, state: FSMContext):
 async def start_add_income(message: Message, state: FSMContext):
     """Переводит бота в режим ожидания суммы и категории дохода."""
     await message.answer(
-        "Введите сумму и категорию дохода через пробел (например: 500 Зарплата)",
+        "Введите сумму и категорию дохода через пробел (например: 500 Зарплата).\n"
+        "Можно несколько строк — по записи на строку.",
         reply_markup=get_back_keyboard(),
     )
     await state.update_data(
@@ -84,20 +383,23 @@ async def start_add_income(message: Message, state: FSMContext):
     await state.set_state(AddTransactionState.waiting_for_amount_and_category)
 
 
-@dp.message(lambda message: message.text == "⚖️ Баланс")
-async def cmd_summary(message: Message):
-    user_id = message.from_user.id
-
-    # Вызываем функцию из database.py и получаем данные о балансе
+async def render_balance(user_id: int) -> str:
     total_income, total_expense, balance = await get_user_balance(user_id)
-
-    # Формируем и отправляем сообщение с балансом
-    balance_message = (
+    return (
         f"⚖️ *Ваш текущий баланс:*\n\n"
         f"💰 *Доходы*: {total_income} руб.\n"
         f"💸 *Расходы*: {total_expense} руб.\n"
         f"🧾 *Баланс*: {balance} руб."
     )
+
+
+@dp.message(lambda message: message.text == "⚖️ Баланс")
+async def cmd_summary(message: Message):
+    user_id = message.from_user.id
+    # Пока пользователь ничего не записал, ответ берётся из кэша без запроса к базе
+    balance_message = await response_cache.get_or_set(
+        user_id, "balance", lambda: render_balance(user_id)
+    )
     await message.answer(
         balance_message, parse_mode="Markdown", reply_markup=get_main_menu_keyboard()
     )
@@ -111,48 +413,58 @@ async def process_transaction_input(message: Message, state: FSMContext):
         await state.clear()
         return
 
-    args = message.text.split()
-    if len(args) < 2:
+    try:
+        entries = parse_entries(message.text or "")
+    except ParseError as e:
+        where = f" в строке {e.line}" if e.line and len(message.text.splitlines()) > 1 else ""
         await message.answer(
-            "Ошибка! Введите сумму и категорию через пробел (например: 500 Продукты или 500 Зарплата)"
+            f"Ошибка{where}: {e}. Например: 500 Продукты, 1 500,50 Кафе, 1.5k Аренда "
+            f"или 120+35 Такси"
         )
         return
 
-    try:
-        amount = float(args[0])
-        if amount <= 0:
-            await message.answer("Сумма должна быть положительной. Попробуйте снова.")
-            return
-        category_name = " ".join(args[1:])
-        if not category_name.strip():
-            await message.answer("Категория не может быть пустой.")
-            return
-        if category_name.isdigit():
-            await message.answer("Категория не может быть числом.")
-            return
-
-        transaction_type = (await state.get_data()).get("transaction_type")
-
-        if transaction_type == "expense":
-            # Добавляем расход
-            await add_expense(message.from_user.id, amount, category_name)
-            await message.answer(
-                f"✅ Расход добавлен: {amount} руб. на {category_name}",
-                reply_markup=get_main_menu_keyboard(),
-            )
-        elif transaction_type == "income":
-            # Добавляем доход
-            await add_income(message.from_user.id, amount, category_name)
-            await message.answer(
-                f"✅ Доход добавлен: {amount} руб. на {category_name}",
-                reply_markup=get_main_menu_keyboard(),
-            )
-
+    transaction_type = (await state.get_data()).get("transaction_type")
+    type_ = {"expense": "Expense", "income": "Income"}.get(transaction_type)
+    if type_ is None:
         await state.clear()
-    except ValueError:
+        return
+
+    # Все строки сообщения записываются вместе: либо все, либо ни одной.
+    # При записи через буфер счётчики бюджетов обновятся при сбросе пачки,
+    # поэтому предупреждений о бюджете в ответе нет.
+    budgets = []
+    try:
+        if write_buffer is not None:
+            await write_buffer.submit_many(message.from_user.id, type_, entries)
+        else:
+            budgets = await add_transactions(message.from_user.id, type_, entries)
+    except ValueError as e:
+        await message.answer(f"Ошибка! {e}. Попробуйте снова.")
+        return
+    except (RuntimeError, OSError) as e:
+        # Буфер останавливается вместе с ботом или не удалась запись журнала
+        print(f"[Ошибка] Транзакции user_id={message.from_user.id} не записаны: {e!r}")
         await message.answer(
-            "Ошибка! Укажите сумму числом (например: 500 Продукты или 500 Зарплата)"
+            "❌ Не удалось сохранить транзакцию, попробуйте позже.",
+            reply_markup=get_main_menu_keyboard(),
         )
+        await state.clear()
+        return
+
+    if len(entries) == 1:
+        amount, category_name = entries[0]
+        title = "Расход добавлен" if type_ == "Expense" else "Доход добавлен"
+        text = f"✅ {title}: {amount} руб. на {category_name}"
+    else:
+        title = "Добавлено расходов" if type_ == "Expense" else "Добавлено доходов"
+        total = sum(amount for amount, _ in entries)
+        lines = [f"• {amount} руб. — {category_name}" for amount, category_name in entries]
+        text = f"✅ {title}: {len(entries)} на {total} руб.\n" + "\n".join(lines)
+    alerts = budget_alerts(budgets)
+    if alerts:
+        text += "\n\n" + "\n".join(alerts)
+    await message.answer(text, reply_markup=get_main_menu_keyboard())
+    await state.clear()
 
 
 @dp.message(DeleteTransactionState.waiting_for_confirmation)
@@ -164,30 +476,104 @@ async def process_confirmation_handler(message: Message, state: FSMContext):
 async def cmd_delete_last_transaction(message: Message, state: FSMContext):
     """Команда для запроса на удаление последней транзакции."""
     # Получаем последнюю транзакцию
-    last_transaction = (await get_last_transaction(message.from_user.id, 1))[0]
+    rows = await get_last_transaction(message.from_user.id, 1)
+    last_transaction = rows[0] if rows else None
 
     if last_transaction:
         # Отправляем информацию о последней транзакции
         transaction_info = f"Последняя транзакция: {last_transaction['type']}, {last_transaction['category_name']} на {last_transaction['amount']} руб. ({last_transaction['created_at'].strftime('%Y-%m-%d %H:%M:%S')})\nУдалить? (Да/Нет)"
         await message.answer(transaction_info, reply_markup=get_confirm_keyboard())
 
-        # Сохраняем данные и переходим в ожидание ответа
-        await state.update_data(last_transaction=last_transaction)
+        # Сохраняем только id (данные FSM хранятся в JSON) и ждём ответа
+        await state.update_data(last_transaction_id=last_transaction["id"])
 
         await state.set_state(DeleteTransactionState.waiting_for_confirmation)
     else:
         await message.answer("Ошибка: нет транзакций для удаления.")
 
 
+async def render_history(user_id: int, cursor=None, newer=False, type_=None, category=None):
+    """Текст и клавиатура страницы истории транзакций."""
+    rows, has_more = await get_transactions_page(
+        user_id, HISTORY_PAGE_SIZE, cursor, newer, type_, category
+    )
+    if cursor is not None and (not rows or (newer and not has_more)):
+        # Дошли до начала (или строки удалены) — показываем первую страницу целиком
+        cursor, newer = None, False
+        rows, has_more = await get_transactions_page(
+            user_id, HISTORY_PAGE_SIZE, None, False, type_, category
+        )
+    if newer:
+        has_older, has_newer = True, has_more
+    else:
+        has_older, has_newer = has_more, cursor is not None
+
+    title = "📜 История транзакций"
+    if type_ is not None:
+        title += " — доходы" if type_ == "Income" else " — расходы"
+    if category is not None:
+        title += f", категория «{category}»"
+    info = f"{title}:\n\n"
+    if not rows:
+        info += "Транзакций не найдено."
+    for row in rows:
+        info += f"💰 {row['type']} | {row['amount']} руб. | {row['category_name']} | {row['created_at'].strftime('%Y-%m-%d %H:%M')}\n"
+    return info, get_history_keyboard(rows, has_older, has_newer, type_, category)
+
+
 @dp.message(lambda message: message.text == "📜 История транзакций")
-async def cmd_get_five_last_transactions(message: Message):
-    five_last = await get_last_transaction(message.from_user.id, 5)
-    info = f"Последние вашие транзакции:\n\n"
+async def cmd_history(message: Message):
+    info, keyboard = await render_history(message.from_user.id)
+    await message.answer(info, reply_markup=keyboard)
+
+
+@dp.message(Command("history"))
+async def cmd_history_filtered(message: Message):
+    """История с фильтром: /history [доходы|расходы] [категория]"""
+    args = message.text.split(maxsplit=1)[1:]
+    words = args[0].split(maxsplit=1) if args else []
+    type_ = None
+    if words and words[0].lower() in ("доходы", "расходы"):
+        type_ = "Income" if words.pop(0).lower() == "доходы" else "Expense"
+    category = words[0].strip() if words else None
+
+    info, keyboard = await render_history(
+        message.from_user.id, type_=type_, category=category
+    )
+    await message.answer(info, reply_markup=keyboard)
 
-    for row in five_last:
-        info += f"💰 {row['type']} | {row['amount']} руб. | {row['category_name']} | {row['created_at'].strftime('%Y-%m-%d %H:%M')}\n"
 
-    await message.answer(info, reply_markup=get_main_menu_keyboard())
+@dp.callback_query(lambda callback: callback.data.startswith("hist:"))
+async def process_history_page(callback: types.CallbackQuery):
+    notice = None
+    try:
+        action, cursor, type_, tag = decode_history_callback(callback.data)
+    except ValueError:
+        action, cursor, type_, tag = "f", None, None, None
+        notice = "Кнопка устарела, история показана с начала"
+    category = None
+    if tag is not None:
+        categories = await get_user_categories(callback.from_user.id)
+        names = {name for names in categories.values() for name in names}
+        category = next((name for name in names if category_tag(name) == tag), None)
+        if category is None:
+            # Категорию удалили или переименовали: без фильтра курсор не к месту
+            action, cursor = "f", None
+            notice = "Категория не найдена, история показана с начала без фильтра"
+
+    info, keyboard = await render_history(
+        callback.from_user.id,
+        cursor if action != "f" else None,
+        action == "p",
+        type_,
+        category,
+    )
+    try:
+        await callback.message.edit_text(info, reply_markup=keyboard)
+    except TelegramBadRequest:
+        # Страница не изменилась (повторное нажатие)
+        pass
+    await callback.answer(notice)
 
 
 @dp.message(lambda message: message.text == "💸 Статистика")
@@ -198,25 +584,28 @@ async def cmd_report(message: Message):
     )
 
 
+async def render_overall_report(user_id: int, days: int) -> str:
+    report_data = await get_overall_report(user_id, days=days)
+    if not report_data:
+        return "❌ Транзакции за выбранный период не найдены."
+    report_message = f"📊 Статистика за последние {days} дней:\n\n"
+    for row in report_data:
+        type_emoji = "💰" if row["type"] == "Income" else "💸"
+        report_message += f"{type_emoji} {row['type']}: {row['total_amount']} руб.\n"
+    return report_message
+
+
 @dp.callback_query(lambda callback: callback.data.startswith("report_"))
 async def process_report(callback: types.CallbackQuery):
     user_id = callback.from_user.id
     days = 7 if callback.data == "report_week" else 30
-    report_data = await get_overall_report(user_id, days=days)
-
-    if report_data:
-        report_message = f"📊 Статистика за последние {days} дней:\n\n"
-        for row in report_data:
-            type_emoji = "💰" if row["type"] == "Income" else "💸"
-            report_message += (
-                f"{type_emoji} {row['type']}: {row['total_amount']} руб.\n"
-            )
-        await callback.message.edit_text(report_message)
-    else:
-        await callback.message.edit_text(
-            "❌ Транзакции за выбранный период не найдены."
-        )
-
+    report_message = await response_cache.get_or_set(
+        user_id,
+        f"report:{days}",
+        lambda: render_overall_report(user_id, days),
+        ttl=RESPONSE_CACHE_TTL,
+    )
+    await callback.message.edit_text(report_message)
     await callback.answer()  # Закрытие уведомления после нажатия
 
 
@@ -278,21 +667,25 @@ async def process_time_period(callback: types.CallbackQuery, state: FSMContext):
     category = data.get("category")
 
     days = 7 if period == "week" else 30
-    report_data = await get_report_data(user_id, type_, category, days)
 
-    # Format report
-    report_message = (
-        f"📊 Статистика за последние {days} дней для категории {category}:\n"
+    async def render():
+        report_data = await get_report_data(user_id, type_, category, days)
+        report_message = (
+            f"📊 Статистика за последние {days} дней для категории {category}:\n"
+        )
+        if report_data:
+            for row in report_data:
+                type_emoji = "💰" if row["type"] == "Income" else "💸"
+                report_message += (
+                    f"{type_emoji} {row['type']}: {row['total_amount']} руб.\n"
+                )
+        else:
+            report_message += "❌ Транзакции не найдены за этот период."
+        return report_message
+
+    report_message = await response_cache.get_or_set(
+        user_id, f"report:{type_}:{category}:{days}", render, ttl=RESPONSE_CACHE_TTL
     )
-    if report_data:
-        for row in report_data:
-            type_emoji = "💰" if row["type"] == "Income" else "💸"
-            report_message += (
-                f"{type_emoji} {row['type']}: {row['total_amount']} руб.\n"
-            )
-    else:
-        report_message += "❌ Транзакции не найдены за этот период."
-
     await callback.message.edit_text(report_message)
     await callback.answer()
     await state.clear()
@@ -308,26 +701,141 @@ async def handle_chart_selection(callback: types.CallbackQuery):
     user_id = callback.from_user.id
     txn_type = "Expense" if callback.data == "chart_expense" else "Income"
 
-    chart_file = await generate_pie_chart(user_id, txn_type)
+    try:
+        chart = await generate_pie_chart(user_id, txn_type)
+    except ChartQueueFull:
+        await callback.answer(
+            "Сейчас строится слишком много графиков, попробуйте через минуту.",
+            show_alert=True,
+        )
+        return
 
-    if not chart_file:
+    if not chart:
         await callback.message.answer("Нет данных для построения графика.")
         return
 
-    photo = FSInputFile(chart_file)
-    await callback.message.answer_photo(photo)
-    os.remove(chart_file)
-
+    await send_chart(callback.message, chart)
     await callback.answer()  # Убираем “часики” после нажатия
 
 
-async def main():
+async def send_chart(message: Message, chart: dict, caption: str = None):
+    if chart["file_id"]:
+        # Данные не менялись — отправляем уже загруженную картинку
+        await message.answer_photo(chart["file_id"], caption=caption)
+    else:
+        sent = await message.answer_photo(
+            BufferedInputFile(chart["png"], filename="chart.png"), caption=caption
+        )
+        remember_chart_file_id(chart["key"], sent.photo[-1].file_id)
+
+
+async def answer_trend(message: Message, user_id: int, bucket: str, start=None, end=None):
+    """Отправляет график динамики; даты по умолчанию — см. generate_trend_chart.
+
+    ValueError (слишком длинный период) и ChartQueueFull пробрасываются.
+    """
+    chart, start, end = await generate_trend_chart(user_id, bucket, start, end)
+    if not chart:
+        await message.answer("Нет транзакций за этот период.")
+        return
+    await send_chart(
+        message,
+        chart,
+        f"📊 Доходы и расходы {_TREND_TITLES[bucket]} "
+        f"с {start:%d.%m.%Y} по {end:%d.%m.%Y}",
+    )
+
+
+@dp.callback_query(lambda callback: callback.data.startswith("trend:"))
+async def handle_trend_selection(callback: types.CallbackQuery):
+    bucket = callback.data.split(":", 1)[1]
+    if bucket not in TREND_BUCKETS:
+        # Кнопка от старой версии бота или подделанные данные
+        await callback.answer("Кнопка устарела, откройте 📈 График заново.")
+        return
+    try:
+        await answer_trend(callback.message, callback.from_user.id, bucket)
+    except ChartQueueFull:
+        await callback.answer(
+            "Сейчас строится слишком много графиков, попробуйте через минуту.",
+            show_alert=True,
+        )
+        return
+    await callback.answer()
+
+
+_TREND_USAGE = (
+    "Использование: /trend [день|неделя|месяц] [с ДД.ММ.ГГГГ] [по ДД.ММ.ГГГГ]\n"
+    "Например: /trend неделя 01.01.2024 30.06.2024"
+)
+
+
+@dp.message(Command("trend"))
+async def cmd_trend(message: Message):
+    """График динамики: /trend [день|неделя|месяц] [с ДД.ММ.ГГГГ] [по ДД.ММ.ГГГГ]"""
+    args = message.text.split()[1:]
+    bucket = "day"
+    if args and args[0].lower() in _TREND_BUCKETS:
+        bucket = _TREND_BUCKETS[args.pop(0).lower()]
+    try:
+        if len(args) > 2:
+            raise ValueError
+        dates = [datetime.strptime(arg, "%d.%m.%Y").date() for arg in args]
+    except ValueError:
+        await message.answer(_TREND_USAGE)
+        return
+    try:
+        await answer_trend(message, message.from_user.id, bucket, *dates)
+    except ValueError as e:
+        await message.answer(f"Ошибка: {e}.\n\n{_TREND_USAGE}")
+    except ChartQueueFull:
+        await message.answer("Сейчас строится слишком много графиков, попробуйте через минуту.")
+
+
+async def on_startup(background: bool = True, metrics_port: int = METRICS_PORT):
+    """Готовит базу и запускает фоновые задачи.
+
+    background=False — без рассылки напоминаний, очистки FSM и переноса
+    бюджетов на новый месяц (в режиме supervisor.py их выполняет только
+    один из процессов).
+    metrics_port — порт сервера /metrics (0 — не поднимать).
+    """
+    global _metrics_runner
+    await init_pool()
+    start_chart_pool()
     await create_tables()
-    asyncio.create_task(reminder_loop())
-    await dp.start_polling(bot)
+    if write_buffer is not None:
+        await write_buffer.start()
+    export_queue.start()
+    if background:
+        asyncio.create_task(reminder_loop())
+        asyncio.create_task(fsm_eviction_loop(dp.storage))
+        asyncio.create_task(budget_rollover_loop())
+    _metrics_runner = await start_metrics_server(port=metrics_port)
+
+
+async def on_shutdown():
+    global _metrics_runner
+    if _metrics_runner is not None:
+        await _metrics_runner.cleanup()
+        _metrics_runner = None
+    await export_queue.stop()
+    if write_buffer is not None:
+        await write_buffer.stop()
+    stop_chart_pool()
+    await close_pool()
 
 
-if __name__ == "__main__":
-    import asyncio
+async def main():
+    try:
+        await on_startup()
+        if BOT_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            await dp.start_polling(bot)
+    finally:
+        await on_shutdown()
 
+
+if __name__ == "__main__":
     asyncio.run(main())
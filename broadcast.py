@@ -0,0 +1,174 @@
+"""
+Массовая рассылка сообщений с учётом ограничений Telegram.
+
+Отправка идёт несколькими параллельными задачами, но не быстрее
+глобального лимита (сообщений в секунду) и не чаще одного сообщения
+в заданный интервал для одного чата. На 429 (retry_after) притормаживаем
+всю рассылку; чаты, куда писать больше нельзя (бот заблокирован,
+чат удалён), помечаются в базе и в следующие рассылки не попадают.
+"""
+import asyncio
+import os
+import time
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from database import mark_users_unreachable
+from metrics import BROADCAST_LATENCY, BROADCAST_MESSAGES
+
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_CHAT_INTERVAL = float(os.getenv("BROADCAST_CHAT_INTERVAL", "1"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))
+
+# Ответы BadRequest, после которых писать в чат бессмысленно
+_UNREACHABLE_ERRORS = ("chat not found", "user is deactivated", "bot was kicked")
+
+
+class RateLimiter:
+    """Выдаёт не больше rate разрешений в секунду, равномерно."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float):
+        """Сдвигает следующую отправку (после 429 от Telegram)."""
+        self._next = max(self._next, time.monotonic() + seconds)
+
+
+class Broadcaster:
+    def __init__(
+        self,
+        bot,
+        rate: float = BROADCAST_RATE,
+        chat_interval: float = BROADCAST_CHAT_INTERVAL,
+        concurrency: int = BROADCAST_CONCURRENCY,
+        max_retries: int = BROADCAST_MAX_RETRIES,
+    ):
+        self.bot = bot
+        self.limiter = RateLimiter(rate)
+        self.chat_interval = chat_interval
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self._last_sent = {}
+
+    async def _wait_chat(self, chat_id: int):
+        last = self._last_sent.get(chat_id)
+        if last is not None:
+            delay = last + self.chat_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def _send(self, chat_id: int, text: str, stats: dict, unreachable: list):
+        for attempt in range(self.max_retries + 1):
+            await self._wait_chat(chat_id)
+            await self.limiter.wait()
+            try:
+                await self.bot.send_message(chat_id, text)
+                self._last_sent[chat_id] = time.monotonic()
+                stats["sent"] += 1
+                return
+            except TelegramRetryAfter as e:
+                stats["retries"] += 1
+                self.limiter.pause(e.retry_after)
+            except TelegramForbiddenError:
+                unreachable.append(chat_id)
+                stats["unreachable"] += 1
+                return
+            except TelegramBadRequest as e:
+                if any(err in e.message.lower() for err in _UNREACHABLE_ERRORS):
+                    unreachable.append(chat_id)
+                    stats["unreachable"] += 1
+                else:
+                    print(f"[Рассылка] user_id={chat_id}: {e}")
+                    stats["failed"] += 1
+                return
+            except (TelegramNetworkError, TelegramServerError) as e:
+                stats["retries"] += 1
+                if attempt < self.max_retries:
+                    await asyncio.sleep(2**attempt)
+                else:
+                    print(f"[Рассылка] user_id={chat_id}: {e}")
+            except TelegramAPIError as e:
+                # Прочие ответы Telegram (чат перенесён, неверный токен и т.п.)
+                print(f"[Рассылка] user_id={chat_id}: {e}")
+                break
+            except Exception as e:
+                # Ошибка одного чата не должна останавливать обработчик рассылки
+                print(f"[Рассылка] user_id={chat_id}: {e!r}")
+                break
+        stats["failed"] += 1
+
+    async def run(self, chat_ids, text: str) -> dict:
+        """Рассылает text по chat_ids (обычный или асинхронный итератор).
+
+        Возвращает статистику: отправлено, ошибок, недоступных чатов,
+        повторов, длительность и скорость.
+        """
+        stats = {"sent": 0, "failed": 0, "unreachable": 0, "retries": 0}
+        unreachable = []
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        async def worker():
+            while True:
+                chat_id = await queue.get()
+                try:
+                    if chat_id is None:
+                        return
+                    await self._send(chat_id, text, stats, unreachable)
+                finally:
+                    queue.task_done()
+
+        started = time.monotonic()
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+
+        async def produce():
+            if hasattr(chat_ids, "__aiter__"):
+                async for chat_id in chat_ids:
+                    await queue.put(chat_id)
+            else:
+                for chat_id in chat_ids:
+                    await queue.put(chat_id)
+            for _ in workers:
+                await queue.put(None)
+
+        # Очередь заполняет отдельная задача: если все обработчики упадут,
+        # она не повиснет на переполненной очереди, а будет отменена
+        producer = asyncio.create_task(produce())
+        finished = asyncio.gather(*workers, return_exceptions=True)
+        try:
+            await asyncio.wait([producer, finished], return_when=asyncio.FIRST_COMPLETED)
+            if producer.done():
+                producer.result()
+            for error in await finished:
+                if isinstance(error, Exception):
+                    print(f"[Рассылка] Обработчик рассылки упал: {error!r}")
+        finally:
+            producer.cancel()
+            for task in workers:
+                task.cancel()
+            if unreachable:
+                await mark_users_unreachable(unreachable)
+
+        elapsed = time.monotonic() - started
+        BROADCAST_LATENCY.observe(elapsed)
+        for result in ("sent", "failed", "unreachable", "retries"):
+            BROADCAST_MESSAGES.inc(stats[result], result=result)
+        stats["elapsed"] = elapsed
+        stats["rate"] = stats["sent"] / elapsed if elapsed > 0 else 0.0
+        return stats
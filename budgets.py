@@ -0,0 +1,77 @@
+"""
+Месячные бюджеты по категориям расходов.
+
+Расходы категории за месяц хранятся готовым счётчиком (budgets.spent) и
+увеличиваются при каждой записи расхода в той же транзакции БД
+(ft_add_transaction, add_transactions_bulk), поэтому проверка бюджета —
+сравнение двух чисел без пересчёта транзакций. add_transactions
+возвращает счётчик до и после записи, а budget_alerts превращает
+пересечённые пороги (BUDGET_ALERT_THRESHOLDS, % лимита) в строки ответа.
+
+В начале месяца budget_rollover_loop обнуляет счётчики одним запросом
+(то же самое: python maintenance.py budgets --rollover).
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+from database import rollover_budgets
+
+# Пороги предупреждений, проценты лимита
+BUDGET_ALERT_THRESHOLDS = tuple(
+    sorted(int(value) for value in os.getenv("BUDGET_ALERT_THRESHOLDS", "80,100").split(","))
+)
+
+
+def budget_alerts(states) -> list[str]:
+    """Строки предупреждений для ответа на запись расходов.
+
+    states — строки из add_transactions. Несколько записей одной категории
+    в сообщении дают одно предупреждение — о самом высоком пересечённом
+    пороге.
+    """
+    categories = {}
+    for state in states:
+        first = categories.get(state["category_name"])
+        before = first[1] if first else state["spent_before"]
+        categories[state["category_name"]] = (state["budget_limit"], before, state["spent_after"])
+
+    alerts = []
+    for category_name, (limit, before, after) in categories.items():
+        crossed = [
+            threshold
+            for threshold in BUDGET_ALERT_THRESHOLDS
+            if before < limit * threshold / 100 <= after
+        ]
+        if not crossed:
+            continue
+        percent = (after / limit * 100).quantize(Decimal(1))
+        if crossed[-1] >= 100:
+            alerts.append(
+                f"🚨 Бюджет «{category_name}» превышен: {after} из {limit} руб. ({percent}%)"
+            )
+        else:
+            alerts.append(
+                f"⚠️ Бюджет «{category_name}»: потрачено {after} из {limit} руб. ({percent}%)"
+            )
+    return alerts
+
+
+def _seconds_to_next_month(now: datetime) -> float:
+    next_month = (now.replace(day=1) + timedelta(days=32)).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0
+    )
+    return (next_month - now).total_seconds()
+
+
+async def budget_rollover_loop():
+    """Обнуляет счётчики бюджетов при запуске и в начале каждого месяца."""
+    while True:
+        try:
+            count = await rollover_budgets()
+            if count:
+                print(f"[Бюджеты] Новый месяц, обнулено счётчиков: {count}")
+        except Exception as e:
+            print(f"[Ошибка] Не удалось обнулить счётчики бюджетов: {e}")
+        # Просыпаемся не реже раза в час: переживает перевод часов и сон машины
+        await asyncio.sleep(min(_seconds_to_next_month(datetime.now()) + 1, 3600))
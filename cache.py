@@ -0,0 +1,43 @@
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Ограниченный по размеру кэш в памяти процесса.
+
+    При переполнении вытесняется запись, к которой дольше всего не обращались.
+    """
+
+    _missing = object()
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        value = self._data.get(key, self._missing)
+        if value is self._missing:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, default)
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,164 @@
+"""
+Отрисовка графиков в отдельных процессах.
+
+matplotlib рисует синхронно и заметно долго, поэтому графики строятся
+в пуле процессов, а не в обработчике aiogram. Глобальное состояние pyplot
+не используем — только объектный API (Figure), по фигуре на запрос.
+Если пул и очередь заполнены, новый запрос сразу получает ChartQueueFull.
+"""
+import asyncio
+import hashlib
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from cache import LRUCache
+
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", "2"))
+# Сколько запросов может ждать свободный процесс сверх занятых
+CHART_QUEUE_LIMIT = int(os.getenv("CHART_QUEUE_LIMIT", "8"))
+# Больше точек на графике динамики не бывает: длинные ряды прореживаются
+TREND_MAX_POINTS = int(os.getenv("TREND_MAX_POINTS", "60"))
+# До стольких точек динамика рисуется столбцами, дальше — линиями
+TREND_BAR_LIMIT = 31
+
+_executor: ProcessPoolExecutor | None = None
+_pending = 0
+
+# Ключ (хэш пользователя, типа и данных графика) -> {"png": ..., "file_id": ...}.
+# После первой отправки Telegram возвращает file_id, и повторно картинку
+# можно отправить по нему, не рисуя и не загружая её заново.
+_chart_cache = LRUCache(int(os.getenv("CHART_CACHE_SIZE", "256")))
+
+
+class ChartQueueFull(Exception):
+    """Пул отрисовки перегружен, запрос нужно повторить позже."""
+
+
+def render_pie_chart(labels: list, sizes: list) -> bytes:
+    """Рисует круговую диаграмму и возвращает PNG. Выполняется в процессе пула."""
+    from matplotlib.figure import Figure
+
+    fig = Figure()
+    ax = fig.subplots()
+    ax.pie(sizes, labels=labels, autopct="%1.1f%%", startangle=90)
+    ax.axis("equal")
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=100)
+    return buffer.getvalue()
+
+
+def downsample(dates, *series, max_points: int = TREND_MAX_POINTS):
+    """Сводит ряды к не более чем max_points точкам.
+
+    Соседние периоды суммируются (итоги за весь диапазон не меняются),
+    дата точки — начало первого из объединённых периодов. Неполной
+    получается самая старая точка, а не последняя.
+    """
+    if len(dates) <= max_points:
+        return (dates, *series)
+    factor = -(-len(dates) // max_points)
+    pad = -len(dates) % factor
+    starts = np.maximum(np.arange(-pad, len(dates), factor), 0)
+    return (
+        dates[starts],
+        *(np.pad(values, (pad, 0)).reshape(-1, factor).sum(axis=1) for values in series),
+    )
+
+
+def render_trend_chart(dates, income, expense, bucket: str) -> bytes:
+    """Доходы и расходы по периодам: dates — datetime64[D], суммы — float64.
+
+    Выполняется в процессе пула; точек не больше TREND_MAX_POINTS.
+    """
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(8, 4.5))
+    ax = fig.subplots()
+    x = np.arange(len(dates))
+    if len(dates) <= TREND_BAR_LIMIT:
+        ax.bar(x - 0.2, income, width=0.4, color="tab:green", label="Доходы")
+        ax.bar(x + 0.2, expense, width=0.4, color="tab:red", label="Расходы")
+    else:
+        ax.plot(x, income, color="tab:green", label="Доходы")
+        ax.plot(x, expense, color="tab:red", label="Расходы")
+    ticks = np.unique(np.linspace(0, len(dates) - 1, min(len(dates), 8)).round().astype(int))
+    labels = np.datetime_as_string(dates[ticks], unit="M" if bucket == "month" else "D")
+    ax.set_xticks(ticks, labels, rotation=30, ha="right")
+    ax.grid(axis="y", alpha=0.3)
+    ax.legend()
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=100)
+    return buffer.getvalue()
+
+
+def start_chart_pool():
+    global _executor
+    if _executor is None:
+        # spawn, а не fork: бот уже работает с потоками и соединениями
+        # (пул asyncpg, сессия aiohttp), и fork в таком состоянии может
+        # оставить процесс пула с захваченной навсегда блокировкой
+        _executor = ProcessPoolExecutor(
+            max_workers=CHART_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+
+def stop_chart_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+
+
+async def render_chart(func, *args) -> bytes:
+    """Выполняет функцию отрисовки в пуле процессов.
+
+    Бросает ChartQueueFull, если в работе и в очереди уже максимум запросов.
+    """
+    global _pending
+    if _pending >= CHART_WORKERS + CHART_QUEUE_LIMIT:
+        raise ChartQueueFull()
+
+    executor = start_chart_pool()
+    _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+    finally:
+        _pending -= 1
+
+
+def get_chart_pool_stats() -> dict:
+    return {
+        "workers": CHART_WORKERS,
+        "queue_limit": CHART_QUEUE_LIMIT,
+        "pending": _pending,
+    }
+
+
+def chart_key(user_id: int, kind: str, data: dict) -> str:
+    """Ключ кэша: меняется, только если изменились данные графика."""
+    payload = repr((user_id, kind, sorted((k, str(v)) for k, v in data.items())))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def get_cached_chart(key: str):
+    return _chart_cache.get(key)
+
+
+def cache_chart(key: str, png: bytes) -> dict:
+    chart = {"key": key, "png": png, "file_id": None}
+    _chart_cache.set(key, chart)
+    return chart
+
+
+def remember_chart_file_id(key: str, file_id: str):
+    """Запоминает file_id загруженной картинки; сами байты больше не нужны."""
+    chart = _chart_cache.get(key)
+    if chart is not None:
+        chart["file_id"] = file_id
+        chart["png"] = None
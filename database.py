@@ -1,239 +1,795 @@
+import hashlib
 import os
-import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from contextlib import asynccontextmanager
 import asyncpg
 from dotenv import load_dotenv
 from aiogram.types import (
     InlineKeyboardMarkup,
     InlineKeyboardButton,
 )
-import matplotlib.pyplot as plt
+from cache import LRUCache
+import numpy as np
+from charts import (
+    cache_chart,
+    chart_key,
+    downsample,
+    get_cached_chart,
+    render_chart,
+    render_pie_chart,
+    render_trend_chart,
+)
+from metrics import timed_query
+from migrations import migrate
+from response_cache import response_cache
 
 load_dotenv()
 
 
-async def create_connection():
-    return await asyncpg.connect(os.getenv("DB_URL"))
+_pool: asyncpg.Pool | None = None
 
+# Счётчики для подбора размера пула: сколько соединений выдано сейчас
+# и сколько в сумме ждали свободного соединения.
+_pool_stats = {
+    "acquired_total": 0,
+    "in_use": 0,
+    "max_in_use": 0,
+    "wait_total": 0.0,
+    "wait_max": 0.0,
+}
 
-async def create_tables():
-    conn = await create_connection()
-    await conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            user_id BIGINT PRIMARY KEY,
-            username TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """
-    )
 
-    await conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS transactions (
-            id SERIAL PRIMARY KEY,
-            user_id BIGINT NOT NULL,
-            type TEXT,
-            amount NUMERIC NOT NULL,
-            category_name TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+async def init_pool():
+    """Создаёт общий пул соединений (один раз на процесс)."""
+    global _pool
+    if _pool is None:
+        _pool = await asyncpg.create_pool(
+            os.getenv("DB_URL"),
+            min_size=int(os.getenv("DB_POOL_MIN_SIZE", "1")),
+            max_size=int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+            statement_cache_size=int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100")),
+            max_inactive_connection_lifetime=float(
+                os.getenv("DB_POOL_MAX_IDLE", "300")
+            ),
         )
-        """
-    )
+    return _pool
 
-    await conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS expenses (
-            id SERIAL PRIMARY KEY,
-            user_id BIGINT NOT NULL,
-            amount NUMERIC NOT NULL,
-            category_name TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """
-    )
 
-    await conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS incomes (
-            id SERIAL PRIMARY KEY,
-            user_id BIGINT NOT NULL,
-            amount NUMERIC NOT NULL,
-            category_name TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+async def close_pool():
+    """Закрывает пул при остановке бота."""
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+@asynccontextmanager
+async def acquire():
+    """Берёт соединение из пула и учитывает время ожидания."""
+    pool = await init_pool()
+    started = time.perf_counter()
+    async with pool.acquire() as conn:
+        waited = time.perf_counter() - started
+        _pool_stats["acquired_total"] += 1
+        _pool_stats["wait_total"] += waited
+        _pool_stats["wait_max"] = max(_pool_stats["wait_max"], waited)
+        _pool_stats["in_use"] += 1
+        _pool_stats["max_in_use"] = max(
+            _pool_stats["max_in_use"], _pool_stats["in_use"]
         )
-        """
-    )
-    await conn.close()
+        try:
+            yield conn
+        finally:
+            _pool_stats["in_use"] -= 1
 
 
+def get_pool_stats() -> dict:
+    """Текущее состояние пула: размер, занятые соединения, время ожидания."""
+    stats = dict(_pool_stats)
+    acquired = stats["acquired_total"]
+    stats["wait_avg"] = stats["wait_total"] / acquired if acquired else 0.0
+    if _pool is not None:
+        stats["size"] = _pool.get_size()
+        stats["idle"] = _pool.get_idle_size()
+        stats["min_size"] = _pool.get_min_size()
+        stats["max_size"] = _pool.get_max_size()
+    return stats
+
+
+# Балансы, пересчитанные по таблице transactions
+_ACTUAL_BALANCES_SQL = """
+    SELECT
+        user_id,
+        COALESCE(SUM(CASE WHEN type = 'Income' THEN amount ELSE 0 END), 0) AS total_income,
+        COALESCE(SUM(CASE WHEN type = 'Expense' THEN amount ELSE 0 END), 0) AS total_expense
+    FROM transactions
+    GROUP BY user_id
+"""
+
+
+async def create_tables():
+    """Приводит схему базы к актуальной версии (см. migrations.py)."""
+    async with acquire() as conn:
+        await migrate(conn)
+
+
+@timed_query
 async def register_user(user_id: int, username: str, first_name: str, last_name: str):
-    conn = await create_connection()
+    async with acquire() as conn, conn.transaction():
+        await conn.execute(
+            """
+            INSERT INTO users (user_id, username, first_name, last_name)
+            VALUES ($1, $2, $3, $4)
+            ON CONFLICT (user_id) DO UPDATE SET blocked_at = NULL
+            WHERE users.blocked_at IS NOT NULL;
+        """,
+            user_id,
+            username,
+            first_name,
+            last_name,
+        )
+        await _schedule_reminder(conn, user_id, reschedule=False)
+
+
+async def _apply_balance_delta(conn, user_id: int, type_: str, amount):
+    """Изменяет накопительный баланс пользователя на сумму транзакции.
+
+    Вызывается внутри той же транзакции, что и запись в transactions.
+    Для удаления передаётся отрицательная сумма.
+    """
+    column = "total_income" if type_ == "Income" else "total_expense"
     await conn.execute(
-        """
-        INSERT INTO users (user_id, username, first_name, last_name)
-        VALUES ($1, $2, $3, $4)
-        ON CONFLICT (user_id) DO NOTHING;
-    """,
+        f"""
+        INSERT INTO user_balances (user_id, {column})
+        VALUES ($1, $2)
+        ON CONFLICT (user_id) DO UPDATE
+        SET {column} = user_balances.{column} + EXCLUDED.{column}
+        """,
         user_id,
-        username,
-        first_name,
-        last_name,
+        amount,
     )
-    await conn.close()
 
 
-async def add_expense(user_id, amount, category_name):
-    conn = await create_connection()
-    user_exists = await conn.fetchval("SELECT 1 FROM users WHERE user_id = $1", user_id)
-    if not user_exists:
-        raise ValueError("Пользователь не существует")
+# user_id -> {тип транзакции: [категории]}; сбрасывается при появлении новой категории
+_category_cache = LRUCache(int(os.getenv("CATEGORY_CACHE_SIZE", "10000")))
 
-    # Проверка на пустые значения
-    if not amount or not category_name:
-        raise ValueError("Сумма и категория не могут быть пустыми")
 
-    # Проверка на отрицательные значения суммы
-    if amount <= 0:
-        raise ValueError("Сумма расхода должна быть положительной")
+@timed_query
+async def get_user_categories(user_id: int, conn=None) -> dict:
+    """Категории пользователя по типам транзакций (из кэша или user_categories)."""
+    categories = _category_cache.get(user_id)
+    if categories is not None:
+        return categories
 
-    # Проверка на существование категории в базе
-    category_exists = await conn.fetchval(
-        "SELECT 1 FROM transactions WHERE user_id = $1 AND category_name = $2 LIMIT 1",
+    query = "SELECT type, name FROM user_categories WHERE user_id = $1 ORDER BY name"
+    if conn is None:
+        async with acquire() as conn:
+            rows = await conn.fetch(query, user_id)
+    else:
+        rows = await conn.fetch(query, user_id)
+    categories = {}
+    for row in rows:
+        categories.setdefault(row["type"], []).append(row["name"])
+    _category_cache.set(user_id, categories)
+    return categories
+
+
+async def _category_exists(conn, user_id: int, category_name: str) -> bool:
+    """Есть ли у пользователя категория с таким именем (любого типа).
+
+    conn=None — соединение берётся из пула, только если нужно читать базу.
+    """
+    categories = await get_user_categories(user_id, conn)
+    if any(category_name in names for names in categories.values()):
+        return True
+    # Категорию мог завести другой процесс — перечитываем справочник
+    _category_cache.pop(user_id)
+    categories = await get_user_categories(user_id, conn)
+    return any(category_name in names for names in categories.values())
+
+
+async def _apply_rollup_delta(
+    conn, user_id: int, type_: str, category_name: str, amount, count: int, day=None
+):
+    """Изменяет дневной итог (daily_rollups) на сумму и число транзакций.
+
+    day=None — сегодняшний день (дата новой транзакции). При удалении
+    передаются отрицательные amount и count; опустевшие строки удаляются.
+    """
+    row = await conn.fetchrow(
+        """
+        INSERT INTO daily_rollups (user_id, day, type, category_name, total, tx_count)
+        VALUES ($1, COALESCE($2::DATE, CURRENT_DATE), $3, COALESCE($4, ''), $5, $6)
+        ON CONFLICT (user_id, day, type, category_name) DO UPDATE
+        SET total = daily_rollups.total + EXCLUDED.total,
+            tx_count = daily_rollups.tx_count + EXCLUDED.tx_count
+        RETURNING day, tx_count
+        """,
         user_id,
+        day,
+        type_,
         category_name,
+        amount,
+        count,
     )
-    if not category_exists:
-        raise ValueError("Категория не существует для данного пользователя")
-    async with conn.transaction():
+    if row["tx_count"] <= 0:
         await conn.execute(
             """
-            INSERT INTO expenses (user_id, amount, category_name)
-            VALUES ($1, $2, $3)
+            DELETE FROM daily_rollups
+            WHERE user_id = $1 AND day = $2 AND type = $3
+              AND category_name = COALESCE($4, '') AND tx_count <= 0
             """,
             user_id,
-            amount,
+            row["day"],
+            type_,
             category_name,
         )
 
-        await conn.execute(
-            """
-            INSERT INTO transactions (user_id, type, amount, category_name)
-            VALUES ($1, 'Expense', $2, $3)
-            """,
-            user_id,
-            amount,
-            category_name,
-        )
-    await conn.close()
+
+# Коды ошибок ft_add_transaction (см. migrations.py) -> текст ValueError
+_TRANSACTION_ERRORS = {
+    "FT001": "Пользователь не существует",
+    "FT002": "Сумма и категория не могут быть пустыми",
+    "FT003": {
+        "Expense": "Сумма расхода должна быть положительной",
+        "Income": "Сумма дохода должна быть положительной",
+    },
+    "FT004": "Категория не существует для данного пользователя",
+}
+
+
+@timed_query
+async def add_transactions(user_id: int, type_: str, entries):
+    """Проверяет и записывает транзакции одного типа одним запросом.
+
+    entries — пары (сумма, категория). ft_add_transaction вызывается для
+    каждой пары внутри одного запроса, поэтому запись атомарна: если хоть
+    одна не прошла проверку, не записывается ни одна. Ошибки проверки
+    приходят из базы кодами FT00x и превращаются в ValueError.
+
+    Возвращает состояние бюджетов по записям в категориях, где бюджет
+    задан: строки (category_name, budget_limit, spent_before, spent_after)
+    в порядке entries (см. budgets.budget_alerts).
+    """
+    amounts = [amount for amount, _ in entries]
+    categories = [category_name for _, category_name in entries]
+    try:
+        async with acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT t.category_name, r.new_category,
+                       r.budget_limit, r.spent_before, r.spent_after
+                FROM unnest($3::NUMERIC[], $4::TEXT[])
+                    WITH ORDINALITY AS t(amount, category_name, n)
+                CROSS JOIN LATERAL
+                    ft_add_transaction($1, $2, t.amount, t.category_name) AS r
+                ORDER BY t.n
+                """,
+                user_id,
+                type_,
+                amounts,
+                categories,
+            )
+    except asyncpg.PostgresError as e:
+        message = _TRANSACTION_ERRORS.get(getattr(e, "sqlstate", None))
+        if message is None:
+            raise
+        if isinstance(message, dict):
+            message = message[type_]
+        raise ValueError(message) from None
+    if any(row["new_category"] for row in rows):
+        _category_cache.pop(user_id)
+    await response_cache.invalidate(user_id)
+    return [row for row in rows if row["budget_limit"] is not None]
+
+
+async def _add_transaction(user_id, type_: str, amount, category_name):
+    await add_transactions(user_id, type_, [(amount, category_name)])
+
+
+async def add_expense(user_id, amount, category_name):
+    await _add_transaction(user_id, "Expense", amount, category_name)
 
 
 async def add_income(user_id, amount, category_name):
-    conn = await create_connection()
-    user_exists = await conn.fetchval("SELECT 1 FROM users WHERE user_id = $1", user_id)
-    if not user_exists:
-        raise ValueError("Пользователь не существует")
+    await _add_transaction(user_id, "Income", amount, category_name)
+
+
+# Пользователи, существование которых уже проверено (для validate_transaction)
+_known_users = LRUCache(int(os.getenv("CATEGORY_CACHE_SIZE", "10000")))
+
+
+@timed_query
+async def validate_transaction(
+    user_id: int, type_: str, amount, category_name, pending_categories=()
+):
+    """Те же проверки, что в add_expense/add_income, но без записи.
+
+    Используется перед постановкой транзакции в буфер (ingest.py): ошибки
+    должны дойти до пользователя сразу, а не после сброса пачки.
+    pending_categories — категории пользователя из ещё не записанных
+    транзакций буфера. Обычно обходится кэшами и не ходит в базу.
+    """
+    if user_id not in _known_users:
+        async with acquire() as conn:
+            user_exists = await conn.fetchval(
+                "SELECT 1 FROM users WHERE user_id = $1", user_id
+            )
+        if not user_exists:
+            raise ValueError("Пользователь не существует")
+        _known_users.set(user_id, True)
 
-    # Проверка на пустые значения
     if not amount or not category_name:
         raise ValueError("Сумма и категория не могут быть пустыми")
 
-    # Проверка на отрицательные значения суммы
     if amount <= 0:
+        if type_ == "Expense":
+            raise ValueError("Сумма расхода должна быть положительной")
         raise ValueError("Сумма дохода должна быть положительной")
 
-    async with conn.transaction():
+    if (
+        type_ == "Expense"
+        and category_name not in pending_categories
+        and not await _category_exists(None, user_id, category_name)
+    ):
+        raise ValueError("Категория не существует для данного пользователя")
+
+
+# Вставка пачки из временной таблицы ingest_staging и обновление всех
+# производных таблиц одним запросом. Строки пользователей, которых нет
+# в users, не вставляются и возвращаются в rejected.
+_APPLY_STAGED_SQL = """
+WITH inserted AS (
+    INSERT INTO transactions
+        (user_id, type, amount, category_name, created_at, ingest_id)
+    SELECT s.user_id, s.type, s.amount, s.category_name, s.created_at, s.ingest_id
+    FROM ingest_staging s
+    WHERE EXISTS (SELECT 1 FROM users u WHERE u.user_id = s.user_id)
+    {filters}
+    ON CONFLICT (ingest_id) WHERE ingest_id IS NOT NULL DO NOTHING
+    RETURNING user_id, type, amount, category_name, created_at
+),
+balances AS (
+    INSERT INTO user_balances (user_id, total_income, total_expense)
+    SELECT user_id,
+           SUM(CASE WHEN type = 'Income' THEN amount ELSE 0 END),
+           SUM(CASE WHEN type = 'Expense' THEN amount ELSE 0 END)
+    FROM inserted
+    GROUP BY user_id
+    ON CONFLICT (user_id) DO UPDATE
+    SET total_income = user_balances.total_income + EXCLUDED.total_income,
+        total_expense = user_balances.total_expense + EXCLUDED.total_expense
+),
+rollups AS (
+    INSERT INTO daily_rollups (user_id, day, type, category_name, total, tx_count)
+    SELECT user_id, created_at::DATE, type, category_name, SUM(amount), COUNT(*)
+    FROM inserted
+    GROUP BY 1, 2, 3, 4
+    ON CONFLICT (user_id, day, type, category_name) DO UPDATE
+    SET total = daily_rollups.total + EXCLUDED.total,
+        tx_count = daily_rollups.tx_count + EXCLUDED.tx_count
+),
+categories AS (
+    INSERT INTO user_categories (user_id, type, name)
+    SELECT DISTINCT user_id, type, category_name FROM inserted
+    ON CONFLICT DO NOTHING
+    RETURNING user_id
+),
+budgets AS (
+    -- Счётчики бюджетов: только расходы текущего месяца (импорт выписки
+    -- за прошлые месяцы их не трогает)
+    UPDATE budgets b
+    SET spent = CASE WHEN b.month = m.month THEN b.spent ELSE 0 END + m.total,
+        month = m.month
+    FROM (
+        SELECT user_id, category_name,
+               date_trunc('month', CURRENT_DATE)::DATE AS month,
+               SUM(amount) AS total
+        FROM inserted
+        WHERE type = 'Expense' AND created_at >= date_trunc('month', CURRENT_DATE)
+        GROUP BY user_id, category_name
+    ) m
+    WHERE b.user_id = m.user_id AND b.category_name = m.category_name
+),
+activity AS (
+    UPDATE users u
+    SET last_activity_date = a.day
+    FROM (
+        SELECT user_id, MAX(created_at)::DATE AS day FROM inserted GROUP BY user_id
+    ) a
+    WHERE u.user_id = a.user_id
+      AND (u.last_activity_date IS NULL OR u.last_activity_date < a.day)
+)
+SELECT
+    (SELECT COUNT(*) FROM inserted) AS inserted,
+    ARRAY(SELECT DISTINCT user_id FROM categories) AS new_category_users,
+    ARRAY(SELECT DISTINCT user_id FROM inserted) AS users,
+    ARRAY(
+        SELECT s.ingest_id FROM ingest_staging s
+        WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.user_id = s.user_id)
+    ) AS rejected
+"""
+
+# Пропуск строк, совпадающих с уже записанными по сумме, времени и категории
+_SKIP_EXISTING_FILTER = """
+    AND NOT EXISTS (
+        SELECT 1 FROM transactions t
+        WHERE t.user_id = s.user_id
+          AND t.category_name = s.category_name
+          AND t.created_at = s.created_at
+          AND t.type = s.type
+          AND t.amount = s.amount
+    )
+"""
+
+_STAGING_COLUMNS = ("ingest_id", "user_id", "type", "amount", "category_name", "created_at")
+
+
+@timed_query
+async def add_transactions_bulk(
+    records, skip_existing: bool = False, source_timezone: str | None = None
+) -> dict:
+    """Записывает пачку уже проверенных транзакций одной транзакцией БД.
+
+    records — кортежи (ingest_id, user_id, type, amount, category_name,
+    created_at), список или асинхронный итератор. Строки загружаются через
+    COPY во временную таблицу, затем один запрос вставляет их в transactions
+    и обновляет балансы, дневные итоги, справочник категорий, счётчики
+    бюджетов и дату активности. Записи с ingest_id, который уже есть в базе,
+    пропускаются; с skip_existing — ещё и совпадающие с уже записанными
+    транзакциями.
+
+    created_at — время без часового пояса, как в transactions (часовой пояс
+    сессии базы, в нём же CURRENT_TIMESTAMP при прямой записи). Если время
+    записано в другом поясе (например, UTC), передайте его в
+    source_timezone — база переведёт время сама.
+
+    Возвращает {"inserted": число, "rejected": [ingest_id без пользователя]}.
+    """
+    async with acquire() as conn, conn.transaction():
         await conn.execute(
             """
-            INSERT INTO incomes (user_id, amount, category_name)
-            VALUES ($1, $2, $3)         
-    """,
-            user_id,
-            amount,
-            category_name,
-        )
-        await conn.execute(
+            CREATE TEMP TABLE ingest_staging (
+                ingest_id UUID,
+                user_id BIGINT,
+                type TEXT,
+                amount NUMERIC,
+                category_name TEXT,
+                created_at TIMESTAMP
+            ) ON COMMIT DROP
             """
-            INSERT INTO transactions (user_id, type, amount, category_name)
-            VALUES ($1, 'Income', $2, $3)
-            """,
-            user_id,
-            amount,
-            category_name,
         )
-    await conn.close()
+        await conn.copy_records_to_table(
+            "ingest_staging", records=records, columns=_STAGING_COLUMNS
+        )
+        if source_timezone is not None:
+            await conn.execute(
+                """
+                UPDATE ingest_staging
+                SET created_at = (created_at AT TIME ZONE $1)
+                                 AT TIME ZONE current_setting('TimeZone')
+                """,
+                source_timezone,
+            )
+        result = await conn.fetchrow(
+            _APPLY_STAGED_SQL.format(
+                filters=_SKIP_EXISTING_FILTER if skip_existing else ""
+            )
+        )
 
+    for user_id in result["new_category_users"]:
+        _category_cache.pop(user_id)
+    await response_cache.invalidate(*result["users"])
+    return {"inserted": result["inserted"], "rejected": list(result["rejected"])}
 
-async def delete_last_transaction(user_id: int):
-    """Удаляет последнюю транзакцию пользователя."""
-    conn = await create_connection()
-    try:
+
+@timed_query
+async def delete_last_transaction(user_id: int, transaction_id: int | None = None):
+    """Удаляет последнюю транзакцию пользователя.
+
+    Если передан transaction_id, удаляет её, только если она всё ещё
+    последняя (пользователь мог добавить новую, пока подтверждал удаление).
+    """
+    async with acquire() as conn, conn.transaction():
         row = await conn.fetchrow(
             """
             DELETE FROM transactions 
             WHERE id = (
                 SELECT id FROM transactions 
                 WHERE user_id = $1
-                ORDER BY created_at DESC 
+                ORDER BY created_at DESC, id DESC
                 LIMIT 1
             )
+            AND ($2::INT IS NULL OR id = $2::INT)
             RETURNING id, type, amount, category_name, created_at
             """,
             user_id,
+            transaction_id,
         )
-        return row
-    finally:
-        await conn.close()
+        if row:
+            await _apply_balance_delta(conn, user_id, row["type"], -row["amount"])
+            await _apply_rollup_delta(
+                conn,
+                user_id,
+                row["type"],
+                row["category_name"],
+                -row["amount"],
+                -1,
+                row["created_at"].date(),
+            )
+            if row["type"] == "Expense":
+                await conn.execute(
+                    """
+                    UPDATE budgets SET spent = GREATEST(spent - $3, 0)
+                    WHERE user_id = $1 AND category_name = $2
+                      AND month = date_trunc('month', $4::DATE)::DATE
+                    """,
+                    user_id,
+                    row["category_name"],
+                    row["amount"],
+                    row["created_at"].date(),
+                )
+    if row:
+        await response_cache.invalidate(user_id)
+    return row
 
 
+@timed_query
 async def get_last_transaction(user_id: int, limit: int = 5):
-    """Удаляет последнюю транзакцию пользователя."""
-    conn = await create_connection()
-    try:
+    """Возвращает последние транзакции пользователя."""
+    async with acquire() as conn:
         row = await conn.fetch(
             """
             SELECT id, type, amount, category_name, created_at FROM transactions 
             WHERE user_id = $1
-            ORDER BY created_at DESC 
+            ORDER BY created_at DESC, id DESC
             LIMIT $2
             """,
             user_id,
             limit,
         )
         return row
-    finally:
-        await conn.close()
 
 
+@timed_query
+async def get_transactions_page(
+    user_id: int,
+    limit: int,
+    cursor: tuple | None = None,
+    newer: bool = False,
+    type_: str | None = None,
+    category: str | None = None,
+):
+    """Страница истории транзакций (новые сверху) с пагинацией по ключу.
+
+    cursor — (created_at, id) крайней строки соседней страницы: без newer
+    возвращаются более старые строки, с newer — более новые. Запрос идёт
+    по индексу с (created_at, id), поэтому дальние страницы не дороже первой.
+    Возвращает (строки, есть ли ещё строки в том же направлении).
+    """
+    conditions = ["user_id = $1"]
+    params = [user_id]
+    if type_ is not None:
+        params.append(type_)
+        conditions.append(f"type = ${len(params)}")
+    if category is not None:
+        params.append(category)
+        conditions.append(f"category_name = ${len(params)}")
+    if cursor is not None:
+        params.extend(cursor)
+        op = ">" if newer else "<"
+        conditions.append(f"(created_at, id) {op} (${len(params) - 1}, ${len(params)})")
+    order = "ASC" if newer else "DESC"
+    params.append(limit + 1)
+
+    async with acquire() as conn:
+        rows = await conn.fetch(
+            f"""
+            SELECT id, type, amount, category_name, created_at FROM transactions
+            WHERE {" AND ".join(conditions)}
+            ORDER BY created_at {order}, id {order}
+            LIMIT ${len(params)}
+            """,
+            *params,
+        )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if newer:
+        rows.reverse()
+    return rows, has_more
+
+
+async def iter_user_transactions(user_id: int, batch_size: int = 1000):
+    """Вся история пользователя (от старых к новым) пачками по batch_size.
+
+    Строки читаются серверным курсором, поэтому в памяти одновременно
+    не больше одной пачки, сколько бы транзакций ни было.
+    """
+    async with acquire() as conn, conn.transaction():
+        cursor = await conn.cursor(
+            """
+            SELECT created_at, type, amount, category_name FROM transactions
+            WHERE user_id = $1
+            ORDER BY created_at, id
+            """,
+            user_id,
+        )
+        while True:
+            rows = await cursor.fetch(batch_size)
+            if not rows:
+                return
+            yield rows
+
+
+@timed_query
 async def get_user_balance(user_id: int):
 
-    # SQL-запрос для расчета баланса
-    conn = await create_connection()  # создаем подключение к БД
-    try:
+    # Баланс хранится в user_balances — читаем одну строку по ключу
+    async with acquire() as conn:
         balance_row = await conn.fetchrow(
             """
-            SELECT 
-                COALESCE(SUM(CASE WHEN type = 'Income' THEN amount ELSE 0 END), 0) AS total_income,
-                COALESCE(SUM(CASE WHEN type = 'Expense' THEN amount ELSE 0 END), 0) AS total_expense
-            FROM transactions
+            SELECT total_income, total_expense
+            FROM user_balances
             WHERE user_id = $1
             """,
             user_id,
         )
-        total_income = balance_row["total_income"]
-        total_expense = balance_row["total_expense"]
-        balance = total_income - total_expense
+    if balance_row is None:
+        return Decimal(0), Decimal(0), Decimal(0)
+
+    total_income = balance_row["total_income"]
+    total_expense = balance_row["total_expense"]
+    balance = total_income - total_expense
+
+    return total_income, total_expense, balance
+
+
+@timed_query
+async def check_user_balances(fix: bool = False):
+    """Сверяет user_balances с суммами по transactions.
+
+    Возвращает список расхождений (user_id, сохранённые и фактические суммы).
+    При fix=True расхождения исправляются; на время пересчёта таблица
+    балансов блокируется от записи, чтобы не потерять параллельные изменения.
+    """
+    async with acquire() as conn, conn.transaction():
+        if fix:
+            await conn.execute("LOCK TABLE user_balances IN EXCLUSIVE MODE")
+        drift = await conn.fetch(
+            f"""
+            WITH actual AS ({_ACTUAL_BALANCES_SQL})
+            SELECT
+                COALESCE(a.user_id, b.user_id) AS user_id,
+                COALESCE(b.total_income, 0) AS stored_income,
+                COALESCE(b.total_expense, 0) AS stored_expense,
+                COALESCE(a.total_income, 0) AS actual_income,
+                COALESCE(a.total_expense, 0) AS actual_expense
+            FROM actual a
+            FULL JOIN user_balances b ON b.user_id = a.user_id
+            WHERE COALESCE(b.total_income, 0) <> COALESCE(a.total_income, 0)
+               OR COALESCE(b.total_expense, 0) <> COALESCE(a.total_expense, 0)
+            ORDER BY 1
+            """
+        )
+        if fix and drift:
+            await conn.executemany(
+                """
+                INSERT INTO user_balances (user_id, total_income, total_expense)
+                VALUES ($1, $2, $3)
+                ON CONFLICT (user_id) DO UPDATE
+                SET total_income = EXCLUDED.total_income,
+                    total_expense = EXCLUDED.total_expense
+                """,
+                [
+                    (r["user_id"], r["actual_income"], r["actual_expense"])
+                    for r in drift
+                ],
+            )
+    if fix and drift:
+        await response_cache.invalidate(*{r["user_id"] for r in drift})
+    return drift
+
+
+# Дневные итоги, пересчитанные по таблице transactions
+_ACTUAL_ROLLUPS_SQL = """
+    SELECT user_id, created_at::DATE AS day, type,
+           COALESCE(category_name, '') AS category_name,
+           SUM(amount) AS total, COUNT(*)::INT AS tx_count
+    FROM transactions
+    WHERE type IS NOT NULL AND created_at IS NOT NULL
+    GROUP BY 1, 2, 3, 4
+"""
 
-        return total_income, total_expense, balance
-    finally:
-        await conn.close()  # Закрываем подключение к БД
+
+@timed_query
+async def check_daily_rollups(fix: bool = False):
+    """Сверяет daily_rollups с transactions.
+
+    Возвращает расхождения (ключ, сохранённые и фактические сумма/число).
+    При fix=True расхождения исправляются под блокировкой таблицы итогов.
+    """
+    async with acquire() as conn, conn.transaction():
+        if fix:
+            await conn.execute("LOCK TABLE daily_rollups IN EXCLUSIVE MODE")
+        drift = await conn.fetch(
+            f"""
+            WITH actual AS ({_ACTUAL_ROLLUPS_SQL})
+            SELECT
+                COALESCE(a.user_id, r.user_id) AS user_id,
+                COALESCE(a.day, r.day) AS day,
+                COALESCE(a.type, r.type) AS type,
+                COALESCE(a.category_name, r.category_name) AS category_name,
+                COALESCE(r.total, 0) AS stored_total,
+                COALESCE(r.tx_count, 0) AS stored_count,
+                COALESCE(a.total, 0) AS actual_total,
+                COALESCE(a.tx_count, 0) AS actual_count
+            FROM actual a
+            FULL JOIN daily_rollups r
+                ON r.user_id = a.user_id AND r.day = a.day
+               AND r.type = a.type AND r.category_name = a.category_name
+            WHERE COALESCE(r.total, 0) <> COALESCE(a.total, 0)
+               OR COALESCE(r.tx_count, 0) <> COALESCE(a.tx_count, 0)
+            ORDER BY 1, 2
+            """
+        )
+        if fix and drift:
+            keys = [
+                (r["user_id"], r["day"], r["type"], r["category_name"]) for r in drift
+            ]
+            await conn.executemany(
+                """
+                DELETE FROM daily_rollups
+                WHERE user_id = $1 AND day = $2 AND type = $3 AND category_name = $4
+                """,
+                keys,
+            )
+            await conn.executemany(
+                """
+                INSERT INTO daily_rollups
+                    (user_id, day, type, category_name, total, tx_count)
+                VALUES ($1, $2, $3, $4, $5, $6)
+                """,
+                [
+                    (*key, r["actual_total"], r["actual_count"])
+                    for key, r in zip(keys, drift)
+                    if r["actual_count"] > 0
+                ],
+            )
+    if fix and drift:
+        await response_cache.invalidate(*{r["user_id"] for r in drift})
+    return drift
+
+
+@timed_query
+async def rebuild_daily_rollups() -> int:
+    """Полностью пересобирает daily_rollups по transactions (бэкфилл).
+
+    Возвращает число строк итогов.
+    """
+    async with acquire() as conn, conn.transaction():
+        await conn.execute("LOCK TABLE daily_rollups IN EXCLUSIVE MODE")
+        await conn.execute("DELETE FROM daily_rollups")
+        result = await conn.execute(
+            f"""
+            INSERT INTO daily_rollups (user_id, day, type, category_name, total, tx_count)
+            {_ACTUAL_ROLLUPS_SQL}
+            """
+        )
+    # Итоги пересобраны у всех пользователей — сбрасываем кэш отчётов целиком
+    await response_cache.invalidate_all()
+    return int(result.split()[-1])
 
 
+@timed_query
 async def get_report_data(user_id: int, type_: str, category: str, days: int):
     """
     Fetch report data for a given user, type, and category within the last `days` days.
 
+    Totals are read from daily_rollups, so at most `days` rows are summed.
+    The period is counted in whole days, today included.
+
     Args:
         user_id (int): User ID
         type_ (str): Type of transaction (e.g., 'income' or 'expense')
@@ -243,31 +799,54 @@ async def get_report_data(user_id: int, type_: str, category: str, days: int):
     Returns:
         List of rows containing type, category_name, and total_amount
     """
-    conn = await create_connection()
-
-    try:
-        query = """
-            SELECT type, category_name, SUM(amount) AS total_amount
-            FROM transactions
-            WHERE user_id = $1 
-            AND type = $2 
-            AND category_name = $3 
-            AND created_at >= NOW() - $4 * INTERVAL '1 day'
-            GROUP BY type, category_name
-        """
+    query = """
+        SELECT type, category_name, SUM(total) AS total_amount
+        FROM daily_rollups
+        WHERE user_id = $1 
+        AND type = $2 
+        AND category_name = $3 
+        AND day > CURRENT_DATE - $4::INT
+        GROUP BY type, category_name
+    """
+    async with acquire() as conn:
         # Execute the query with the correct parameters
         rows = await conn.fetch(query, user_id, type_, category, days)
         return rows
-    finally:
-        await conn.close()
 
 
+@timed_query
+async def get_range_report(
+    user_id: int, start, end, type_: str = None, category: str = None
+):
+    """Итоги по типам и категориям за даты с start по end включительно.
+
+    type_ и category необязательны: без них отчёт по всем типам/категориям.
+    """
+    async with acquire() as conn:
+        return await conn.fetch(
+            """
+            SELECT type, category_name, SUM(total) AS total_amount,
+                   SUM(tx_count) AS tx_count
+            FROM daily_rollups
+            WHERE user_id = $1
+              AND day BETWEEN $2 AND $3
+              AND ($4::TEXT IS NULL OR type = $4)
+              AND ($5::TEXT IS NULL OR category_name = $5)
+            GROUP BY type, category_name
+            ORDER BY type, total_amount DESC
+            """,
+            user_id,
+            start,
+            end,
+            type_,
+            category,
+        )
+
+
+@timed_query
 async def get_category_keyboard(user_id: int, type_: str):
-    # Создаем соединение с базой данных
-    conn = await create_connection()
-    query = "SELECT DISTINCT category_name FROM transactions WHERE user_id = $1 AND type = $2"
-    categories = await conn.fetch(query, user_id, type_)
-    await conn.close()
+    # Категории берём из справочника (обычно из кэша)
+    categories = (await get_user_categories(user_id)).get(type_, [])
 
     if not categories:
         print("net c")
@@ -277,8 +856,8 @@ async def get_category_keyboard(user_id: int, type_: str):
         buttons.append(
             [
                 InlineKeyboardButton(
-                    text=category["category_name"],
-                    callback_data=f"{type_}_{category['category_name']}",
+                    text=category,
+                    callback_data=f"{type_}_{category}",
                 )
             ]
         )
@@ -288,64 +867,410 @@ async def get_category_keyboard(user_id: int, type_: str):
     return keyboard
 
 
-async def generate_pie_chart(user_id: int, txn_type: str) -> str:
-    conn = await create_connection()
-    try:
-        query = """
-            SELECT category_name, SUM(amount) AS total
-            FROM transactions
-            WHERE user_id = $1 AND type = $2
-            GROUP BY category_name
-        """
+@timed_query
+async def generate_pie_chart(user_id: int, txn_type: str):
+    """Круговая диаграмма по категориям.
+
+    Возвращает запись кэша графиков ({"key", "png", "file_id"}) или None,
+    если данных нет. Если данные не менялись, график повторно не рисуется.
+    """
+    query = """
+        SELECT category_name, SUM(amount) AS total
+        FROM transactions
+        WHERE user_id = $1 AND type = $2
+        GROUP BY category_name
+    """
+    async with acquire() as conn:
         rows = await conn.fetch(query, user_id, txn_type)
-        if not rows:
-            return None
+    if not rows:
+        return None
 
-        data = {row["category_name"]: float(row["total"]) for row in rows}
-        labels = list(data.keys())
-        sizes = list(data.values())
+    data = {row["category_name"]: row["total"] for row in rows}
+    key = chart_key(user_id, f"pie_{txn_type}", data)
+    chart = get_cached_chart(key)
+    if chart is not None:
+        return chart
 
-        fig, ax = plt.subplots()
-        ax.pie(sizes, labels=labels, autopct="%1.1f%%", startangle=90)
-        ax.axis("equal")
+    labels = list(data.keys())
+    sizes = [float(total) for total in data.values()]
 
-        tmp_file = tempfile.NamedTemporaryFile(suffix=".png", delete=False)
-        plt.savefig(tmp_file.name, dpi=100)
-        plt.close(fig)
-        return tmp_file.name
+    # Рисуем в пуле процессов, чтобы не блокировать обработку сообщений
+    png = await render_chart(render_pie_chart, labels, sizes)
+    return cache_chart(key, png)
 
-    finally:
-        await conn.close()
 
+# Диапазон графика динамики по умолчанию (дней до сегодня) для каждого шага
+TREND_DEFAULT_DAYS = {"day": 30, "week": 182, "month": 365}
+TREND_BUCKETS = tuple(TREND_DEFAULT_DAYS)
+# Больше периодов за один запрос не считаем: годы по дням — это тысячи
+# строк generate_series ради графика, который всё равно прорежается
+TREND_MAX_PERIODS = int(os.getenv("TREND_MAX_PERIODS", "400"))
 
-async def get_users_without_transactions_today():
-    conn = await create_connection()
-    query = """
-        SELECT user_id FROM users
-        WHERE user_id NOT IN (
-            SELECT DISTINCT user_id
-            FROM transactions
-            WHERE DATE(created_at) = CURRENT_DATE
-        );
+# Доходы и расходы по периодам из дневных итогов; периоды без транзакций —
+# нули. Ряды возвращаются массивами одной строкой, чтобы сразу стать
+# массивами NumPy без цикла по точкам.
+_TREND_SQL = """
+WITH totals AS (
+    SELECT date_trunc($2, day::TIMESTAMP)::DATE AS bucket,
+           SUM(total) FILTER (WHERE type = 'Income') AS income,
+           SUM(total) FILTER (WHERE type = 'Expense') AS expense
+    FROM daily_rollups
+    WHERE user_id = $1 AND day BETWEEN $3 AND $4
+    GROUP BY 1
+)
+SELECT array_agg(b.bucket ORDER BY b.bucket) AS buckets,
+       array_agg(COALESCE(t.income, 0)::FLOAT8 ORDER BY b.bucket) AS income,
+       array_agg(COALESCE(t.expense, 0)::FLOAT8 ORDER BY b.bucket) AS expense
+FROM (
+    SELECT generate_series(
+        date_trunc($2, $3::DATE::TIMESTAMP),
+        date_trunc($2, $4::DATE::TIMESTAMP),
+        ('1 ' || $2)::INTERVAL
+    )::DATE AS bucket
+) b
+LEFT JOIN totals t USING (bucket)
+"""
+
+
+def _trend_periods(bucket: str, start, end) -> int:
+    """Сколько периодов bucket в диапазоне с start по end включительно."""
+    if bucket == "day":
+        return (end - start).days + 1
+    if bucket == "week":
+        # Недели начинаются с понедельника, как date_trunc('week')
+        first = start - timedelta(days=start.weekday())
+        last = end - timedelta(days=end.weekday())
+        return (last - first).days // 7 + 1
+    return (end.year - start.year) * 12 + end.month - start.month + 1
+
+
+@timed_query
+async def generate_trend_chart(user_id: int, bucket: str, start=None, end=None):
+    """График доходов и расходов по дням, неделям или месяцам (bucket)
+    за даты с start по end включительно.
+
+    По умолчанию end — сегодня по часам базы (как в остальных отчётах),
+    start — за TREND_DEFAULT_DAYS[bucket] дней до end. Бросает ValueError,
+    если диапазон пуст или длиннее TREND_MAX_PERIODS периодов.
+
+    Возвращает (запись кэша графиков {"key", "png", "file_id"} или None,
+    если транзакций за период нет; start; end).
     """
-    rows = await conn.fetch(query)
-    return [row["user_id"] for row in rows]
+    if bucket not in TREND_BUCKETS:
+        raise ValueError(f"Неизвестный период: {bucket}")
+    async with acquire() as conn:
+        if end is None:
+            end = await conn.fetchval("SELECT CURRENT_DATE")
+        if start is None:
+            start = end - timedelta(days=TREND_DEFAULT_DAYS[bucket])
+        if start > end:
+            raise ValueError("Начало периода позже конца")
+        if _trend_periods(bucket, start, end) > TREND_MAX_PERIODS:
+            raise ValueError(
+                f"Слишком длинный период: не больше {TREND_MAX_PERIODS} точек, "
+                f"выберите шаг крупнее или даты ближе"
+            )
+        row = await conn.fetchrow(_TREND_SQL, user_id, bucket, start, end)
+    if not row["buckets"]:
+        return None, start, end
+    income = np.asarray(row["income"], dtype=np.float64)
+    expense = np.asarray(row["expense"], dtype=np.float64)
+    if not income.any() and not expense.any():
+        return None, start, end
+    dates = np.asarray(row["buckets"], dtype="datetime64[D]")
+    dates, income, expense = downsample(dates, income, expense)
+
+    digest = hashlib.sha256(dates.tobytes() + income.tobytes() + expense.tobytes())
+    key = chart_key(user_id, f"trend_{bucket}", {"data": digest.hexdigest()})
+    chart = get_cached_chart(key)
+    if chart is None:
+        png = await render_chart(render_trend_chart, dates, income, expense, bucket)
+        chart = cache_chart(key, png)
+    return chart, start, end
+
+
+# Часовой пояс пользователя и время его следующего напоминания.
+# В запросах к очереди $1 — пояс по умолчанию, $2 — разброс в секундах:
+# напоминания одного времени растягиваются на этот интервал по user_id,
+# чтобы не отправлять всё в одну секунду.
+DEFAULT_TIMEZONE = os.getenv("DEFAULT_TIMEZONE")
+REMINDER_SPREAD_SECONDS = int(os.getenv("REMINDER_SPREAD_SECONDS", "600"))
+
+_USER_TZ_SQL = "COALESCE(u.timezone, $1::TEXT, current_setting('TimeZone'))"
+_NEXT_REMINDER_SQL = f"""
+    ft_next_reminder_at({_USER_TZ_SQL}, u.reminder_time, now())
+    + (u.user_id % GREATEST($2::INT, 1)) * INTERVAL '1 second'
+"""
+
+
+async def _schedule_reminder(conn, user_id: int, reschedule: bool = True):
+    """Ставит (или переставляет) следующее напоминание пользователя в очередь."""
+    on_conflict = (
+        "DO UPDATE SET due_at = EXCLUDED.due_at, claimed_until = NULL"
+        if reschedule
+        else "DO NOTHING"
+    )
+    await conn.execute(
+        f"""
+        INSERT INTO reminder_queue (user_id, due_at)
+        SELECT u.user_id, {_NEXT_REMINDER_SQL}
+        FROM users u
+        WHERE u.user_id = $3
+        ON CONFLICT (user_id) {on_conflict}
+        """,
+        DEFAULT_TIMEZONE,
+        REMINDER_SPREAD_SECONDS,
+        user_id,
+    )
+
+
+@timed_query
+async def ensure_reminder_queue():
+    """Добавляет в очередь пользователей, которых там ещё нет."""
+    async with acquire() as conn:
+        await conn.execute(
+            f"""
+            INSERT INTO reminder_queue (user_id, due_at)
+            SELECT u.user_id, {_NEXT_REMINDER_SQL}
+            FROM users u
+            WHERE NOT EXISTS (
+                SELECT 1 FROM reminder_queue q WHERE q.user_id = u.user_id
+            )
+            ON CONFLICT (user_id) DO NOTHING
+            """,
+            DEFAULT_TIMEZONE,
+            REMINDER_SPREAD_SECONDS,
+        )
+
 
+@timed_query
+async def claim_due_reminders(limit: int, lease_seconds: int):
+    """Забирает из очереди до limit напоминаний, время которых наступило.
 
+    Строки арендуются на lease_seconds (SKIP LOCKED — несколько процессов
+    не получат одну и ту же строку). Для каждой строки возвращается
+    needs_reminder: пользователь доступен, сегодня (по его местному времени)
+    ещё не получал напоминание и не вносил транзакций.
+    """
+    async with acquire() as conn:
+        return await conn.fetch(
+            f"""
+            WITH due AS (
+                SELECT user_id FROM reminder_queue
+                WHERE due_at <= now()
+                  AND (claimed_until IS NULL OR claimed_until < now())
+                ORDER BY due_at
+                LIMIT $2
+                FOR UPDATE SKIP LOCKED
+            ),
+            claimed AS (
+                UPDATE reminder_queue q
+                SET claimed_until = now() + $3 * INTERVAL '1 second'
+                FROM due
+                WHERE q.user_id = due.user_id
+                RETURNING q.user_id, q.last_sent_on
+            )
+            SELECT
+                c.user_id,
+                u.blocked_at IS NULL
+                AND c.last_sent_on IS DISTINCT FROM d.day
+                AND NOT COALESCE(
+                    -- last_activity_date — дата сервера; если она старше
+                    -- вчерашней, сегодня по местному времени транзакций точно нет
+                    u.last_activity_date >= d.day - 1
+                    AND EXISTS (
+                        SELECT 1 FROM transactions t
+                        WHERE t.user_id = u.user_id
+                          AND t.created_at >= (d.day::TIMESTAMP AT TIME ZONE z.tz)::TIMESTAMP
+                          AND t.created_at < ((d.day + 1)::TIMESTAMP AT TIME ZONE z.tz)::TIMESTAMP
+                    ),
+                    FALSE
+                ) AS needs_reminder
+            FROM claimed c
+            JOIN users u ON u.user_id = c.user_id
+            CROSS JOIN LATERAL (SELECT {_USER_TZ_SQL} AS tz) z
+            CROSS JOIN LATERAL (SELECT (now() AT TIME ZONE z.tz)::DATE AS day) d
+            """,
+            DEFAULT_TIMEZONE,
+            limit,
+            lease_seconds,
+        )
+
+
+@timed_query
+async def complete_reminders(user_ids: list, reminded_ids: list):
+    """Переносит обработанные напоминания на следующий день.
+
+    reminded_ids — кому напоминание действительно отправлялось:
+    для них запоминается местная дата, чтобы не отправить повторно.
+    """
+    async with acquire() as conn:
+        await conn.execute(
+            f"""
+            UPDATE reminder_queue q
+            SET due_at = {_NEXT_REMINDER_SQL},
+                claimed_until = NULL,
+                last_sent_on = CASE
+                    WHEN q.user_id = ANY($4::BIGINT[])
+                        THEN (now() AT TIME ZONE {_USER_TZ_SQL})::DATE
+                    ELSE q.last_sent_on
+                END
+            FROM users u
+            WHERE u.user_id = q.user_id AND q.user_id = ANY($3::BIGINT[])
+            """,
+            DEFAULT_TIMEZONE,
+            REMINDER_SPREAD_SECONDS,
+            user_ids,
+            reminded_ids,
+        )
+
+
+@timed_query
+async def get_next_reminder_due():
+    """Время ближайшего напоминания в очереди (или None)."""
+    async with acquire() as conn:
+        return await conn.fetchval("SELECT MIN(due_at) FROM reminder_queue")
+
+
+@timed_query
+async def set_user_timezone(user_id: int, timezone: str):
+    async with acquire() as conn, conn.transaction():
+        await conn.execute(
+            "UPDATE users SET timezone = $2 WHERE user_id = $1", user_id, timezone
+        )
+        await _schedule_reminder(conn, user_id)
+
+
+@timed_query
+async def set_reminder_time(user_id: int, reminder_time):
+    async with acquire() as conn, conn.transaction():
+        await conn.execute(
+            "UPDATE users SET reminder_time = $2 WHERE user_id = $1",
+            user_id,
+            reminder_time,
+        )
+        await _schedule_reminder(conn, user_id)
+
+
+@timed_query
+async def set_budget(user_id: int, category_name: str, monthly_limit):
+    """Задаёт месячный бюджет категории расходов (или меняет его лимит).
+
+    Счётчик spent один раз считается по дневным итогам текущего месяца,
+    дальше его ведёт ft_add_transaction. Бросает ValueError, если у
+    пользователя нет такой категории расходов: бюджет категории доходов
+    считал бы только случайные расходы в ней.
+    """
+    async with acquire() as conn:
+        row = await conn.fetchrow(
+            """
+            INSERT INTO budgets (user_id, category_name, monthly_limit, month, spent)
+            SELECT $1, $2, $3, date_trunc('month', CURRENT_DATE)::DATE,
+                   COALESCE((
+                       SELECT SUM(total) FROM daily_rollups
+                       WHERE user_id = $1 AND type = 'Expense' AND category_name = $2
+                         AND day >= date_trunc('month', CURRENT_DATE)
+                   ), 0)
+            WHERE EXISTS (
+                SELECT 1 FROM user_categories
+                WHERE user_id = $1 AND type = 'Expense' AND name = $2
+            )
+            ON CONFLICT (user_id, category_name) DO UPDATE
+            SET monthly_limit = EXCLUDED.monthly_limit,
+                month = EXCLUDED.month,
+                spent = EXCLUDED.spent
+            RETURNING monthly_limit, spent
+            """,
+            user_id,
+            category_name,
+            monthly_limit,
+        )
+        if row is None and await conn.fetchval(
+            "SELECT 1 FROM user_categories WHERE user_id = $1 AND name = $2",
+            user_id,
+            category_name,
+        ):
+            raise ValueError("Бюджет можно задать только для категории расходов")
+    if row is None:
+        raise ValueError("Категория не существует для данного пользователя")
+    return row
+
+
+@timed_query
+async def delete_budget(user_id: int, category_name: str) -> bool:
+    async with acquire() as conn:
+        status = await conn.execute(
+            "DELETE FROM budgets WHERE user_id = $1 AND category_name = $2",
+            user_id,
+            category_name,
+        )
+    return status != "DELETE 0"
+
+
+@timed_query
+async def get_budgets(user_id: int):
+    """Бюджеты пользователя с расходами за текущий месяц."""
+    async with acquire() as conn:
+        return await conn.fetch(
+            """
+            SELECT category_name, monthly_limit,
+                   CASE WHEN month = date_trunc('month', CURRENT_DATE)::DATE
+                        THEN spent ELSE 0 END AS spent
+            FROM budgets
+            WHERE user_id = $1
+            ORDER BY category_name
+            """,
+            user_id,
+        )
+
+
+@timed_query
+async def rollover_budgets() -> int:
+    """Обнуляет счётчики бюджетов прошлых месяцев одним запросом.
+
+    ft_add_transaction и так начинает новый месяц с нуля; перенос нужен,
+    чтобы счётчики не ждали первого расхода в категории.
+    """
+    async with acquire() as conn:
+        status = await conn.execute(
+            """
+            UPDATE budgets
+            SET spent = 0, month = date_trunc('month', CURRENT_DATE)::DATE
+            WHERE month < date_trunc('month', CURRENT_DATE)::DATE
+            """
+        )
+    return int(status.split()[-1])
+
+
+@timed_query
+async def mark_users_unreachable(user_ids: list):
+    """Отмечает пользователей, которым бот больше не может писать.
+
+    Повторный /start снимает отметку (см. register_user).
+    """
+    async with acquire() as conn:
+        await conn.execute(
+            """
+            UPDATE users SET blocked_at = CURRENT_TIMESTAMP
+            WHERE user_id = ANY($1::BIGINT[]) AND blocked_at IS NULL
+            """,
+            user_ids,
+        )
+
+
+@timed_query
 async def get_overall_report(user_id: int, days: int):
-    conn = await create_connection()
-    try:
+    """Итоги по типам за последние days дней (включая сегодня) из daily_rollups."""
+    async with acquire() as conn:
         rows = await conn.fetch(
             """
-            SELECT type, SUM(amount) AS total_amount
-            FROM transactions
+            SELECT type, SUM(total) AS total_amount
+            FROM daily_rollups
             WHERE user_id = $1
-              AND created_at >= NOW() - ($2 * INTERVAL '1 day')
+              AND day > CURRENT_DATE - $2::INT
             GROUP BY type
             """,
             user_id,
             days,
         )
         return rows
-    finally:
-        await conn.close()
@@ -0,0 +1,164 @@
+"""
+Выгрузка всей истории транзакций пользователя в CSV или XLSX.
+
+Строки читаются из базы серверным курсором и пачками дописываются во
+временный файл, так что память не растёт с размером истории. Выгрузки
+выполняются фоновыми задачами (EXPORT_WORKERS) из ограниченной очереди:
+обработчики бота только ставят задачу и сразу отвечают. Если очередь
+заполнена, новая выгрузка получает ExportQueueFull.
+
+Для XLSX нужен пакет openpyxl (pip install openpyxl); без него доступен CSV.
+"""
+import asyncio
+import csv
+import os
+import tempfile
+from datetime import datetime
+from aiogram.types import FSInputFile
+from database import iter_user_transactions
+
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "2"))
+EXPORT_QUEUE_LIMIT = int(os.getenv("EXPORT_QUEUE_LIMIT", "20"))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+
+EXPORT_FORMATS = ("csv", "xlsx")
+_HEADER = ["Дата", "Тип", "Сумма", "Категория"]
+_TYPE_NAMES = {"Income": "Доход", "Expense": "Расход"}
+
+
+class ExportQueueFull(Exception):
+    """Очередь выгрузок заполнена, запрос нужно повторить позже."""
+
+
+class ExportAlreadyQueued(Exception):
+    """Выгрузка для этого пользователя уже в очереди или выполняется."""
+
+
+def xlsx_available() -> bool:
+    try:
+        import openpyxl  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _row_values(row) -> list:
+    return [
+        row["created_at"].strftime("%Y-%m-%d %H:%M:%S"),
+        _TYPE_NAMES.get(row["type"], row["type"]),
+        row["amount"],
+        row["category_name"],
+    ]
+
+
+async def write_csv(user_id: int, path: str, batch_size: int = EXPORT_BATCH_SIZE) -> int:
+    """Пишет историю в CSV. Возвращает число строк."""
+    count = 0
+    # utf-8-sig — чтобы Excel правильно открыл кириллицу
+    with open(path, "w", encoding="utf-8-sig", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(_HEADER)
+        async for rows in iter_user_transactions(user_id, batch_size):
+            await asyncio.to_thread(writer.writerows, [_row_values(row) for row in rows])
+            count += len(rows)
+    return count
+
+
+async def write_xlsx(user_id: int, path: str, batch_size: int = EXPORT_BATCH_SIZE) -> int:
+    """Пишет историю в XLSX (потоковый режим openpyxl). Возвращает число строк."""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Транзакции")
+    sheet.append(_HEADER)
+
+    def append(rows):
+        for row in rows:
+            values = _row_values(row)
+            values[2] = float(values[2])
+            sheet.append(values)
+
+    count = 0
+    async for rows in iter_user_transactions(user_id, batch_size):
+        await asyncio.to_thread(append, rows)
+        count += len(rows)
+    await asyncio.to_thread(workbook.save, path)
+    return count
+
+
+_WRITERS = {"csv": write_csv, "xlsx": write_xlsx}
+
+
+class ExportQueue:
+    def __init__(
+        self,
+        bot,
+        workers: int = EXPORT_WORKERS,
+        queue_limit: int = EXPORT_QUEUE_LIMIT,
+    ):
+        self.bot = bot
+        self.workers = workers
+        self._queue = asyncio.Queue(maxsize=queue_limit)
+        # Пользователи, чья выгрузка ждёт в очереди или выполняется
+        self._active = set()
+        self._tasks = []
+        self.stats = {"done": 0, "failed": 0, "rows": 0}
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, user_id: int, chat_id: int, fmt: str = "csv"):
+        if user_id in self._active:
+            raise ExportAlreadyQueued()
+        try:
+            self._queue.put_nowait((user_id, chat_id, fmt))
+        except asyncio.QueueFull:
+            raise ExportQueueFull() from None
+        self._active.add(user_id)
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    async def _worker(self):
+        while True:
+            user_id, chat_id, fmt = await self._queue.get()
+            try:
+                await self._export(user_id, chat_id, fmt)
+            except Exception as e:
+                self.stats["failed"] += 1
+                print(f"[Выгрузка] user_id={user_id}: {e}")
+                try:
+                    await self.bot.send_message(
+                        chat_id, "❌ Не удалось выгрузить историю, попробуйте позже."
+                    )
+                except Exception:
+                    pass
+            finally:
+                self._active.discard(user_id)
+                self._queue.task_done()
+
+    async def _export(self, user_id: int, chat_id: int, fmt: str):
+        fd, path = tempfile.mkstemp(suffix=f".{fmt}", prefix="export_")
+        os.close(fd)
+        try:
+            count = await _WRITERS[fmt](user_id, path)
+            if not count:
+                await self.bot.send_message(chat_id, "Транзакций для выгрузки пока нет.")
+                return
+            filename = f"transactions_{datetime.now():%Y-%m-%d}.{fmt}"
+            await self.bot.send_document(
+                chat_id,
+                FSInputFile(path, filename=filename),
+                caption=f"📤 История транзакций: {count} шт.",
+            )
+            self.stats["done"] += 1
+            self.stats["rows"] += count
+        finally:
+            os.remove(path)
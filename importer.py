@@ -0,0 +1,356 @@
+"""
+Импорт банковских выписок (CSV и OFX).
+
+Файл разбирается в отдельном потоке (кусками, чтобы показывать ход
+импорта), и только потом записи уходят в COPY
+(database.add_transactions_bulk): весь импорт — одна транзакция базы,
+балансы, дневные итоги и справочник категорий обновляются одним запросом
+на всю выписку, а не по строке. Файл не больше 20 МБ, поэтому записи
+держим в памяти.
+
+Категории выписки сопоставляются с категориями пользователя без учёта
+регистра. Если категории нет (OFX) или у расхода она незнакома, ищем
+название известной категории в описании операции, иначе —
+IMPORT_DEFAULT_CATEGORY.
+
+Повторный импорт той же выписки ничего не дублирует: ingest_id строки —
+хэш (пользователь, тип, сумма, время, категория и номер повтора такой же
+строки в файле), а строки, совпадающие с уже записанными транзакциями,
+пропускаются. Номер повтора нужен, чтобы две одинаковые покупки за день
+(в выписке только с датой) не слились в одну.
+"""
+import asyncio
+import csv
+import re
+from collections import Counter
+import time
+import uuid
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from database import add_transactions_bulk, get_user_categories
+
+IMPORT_FORMATS = ("csv", "ofx")
+IMPORT_DEFAULT_CATEGORY = "Прочее"
+# Не чаще, чем раз в столько секунд, обновляем сообщение о ходе импорта
+IMPORT_PROGRESS_INTERVAL = 2.0
+# Сколько ошибок разбора запоминать для ответа пользователю
+IMPORT_MAX_ERRORS = 10
+# Сколько строк разбирать в потоке за один раз (между ними — отчёт о ходе)
+IMPORT_PARSE_CHUNK = 5000
+
+_IMPORT_NAMESPACE = uuid.UUID("5b0c3f0e-6a8e-4f7c-9a41-1f3f0a9d2c11")
+
+# Возможные названия колонок CSV (в нижнем регистре)
+_CSV_COLUMNS = {
+    "date": ("дата операции", "дата платежа", "дата", "date", "время"),
+    "amount": ("сумма операции", "сумма платежа", "сумма", "amount"),
+    "category": ("категория", "category"),
+    "description": ("описание", "назначение", "description", "memo"),
+    "type": ("тип", "тип операции", "type"),
+}
+_DATE_FORMATS = (
+    "%d.%m.%Y %H:%M:%S",
+    "%d.%m.%Y %H:%M",
+    "%d.%m.%Y",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%d",
+)
+_INCOME_TYPES = {"income", "доход", "пополнение", "зачисление", "credit"}
+_EXPENSE_TYPES = {"expense", "расход", "списание", "покупка", "debit"}
+
+_OFX_TAG = re.compile(r"<(/?)([A-Z0-9.]+)>([^<]*)", re.IGNORECASE)
+_AMOUNT_JUNK = re.compile(r"[\s\u00a0\u202f₽$€]|руб\.?|rub", re.IGNORECASE)
+
+
+class StatementFormatError(ValueError):
+    """Файл не похож на поддерживаемую выписку."""
+
+
+def parse_amount(text: str) -> Decimal:
+    """'-1 234,56 ₽' -> Decimal('-1234.56')."""
+    value = _AMOUNT_JUNK.sub("", text or "")
+    if "," in value and "." in value:
+        # 1,234.56 — запятая разделяет тысячи
+        value = value.replace(",", "")
+    value = value.replace(",", ".").replace("−", "-")
+    try:
+        amount = Decimal(value)
+    except InvalidOperation:
+        raise ValueError(f"не сумма: {text!r}") from None
+    if not amount.is_finite():
+        raise ValueError(f"не сумма: {text!r}")
+    return amount
+
+
+def parse_date(text: str) -> datetime:
+    text = (text or "").strip()
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    try:
+        return datetime.fromisoformat(text).replace(tzinfo=None)
+    except ValueError:
+        raise ValueError(f"не дата: {text!r}") from None
+
+
+def _detect_type(type_text: str, amount: Decimal) -> str:
+    value = (type_text or "").strip().lower()
+    if value in _INCOME_TYPES:
+        return "Income"
+    if value in _EXPENSE_TYPES:
+        return "Expense"
+    return "Expense" if amount < 0 else "Income"
+
+
+class CategoryMapper:
+    """Сопоставляет категории выписки с категориями пользователя."""
+
+    def __init__(self, categories: dict, default: str = IMPORT_DEFAULT_CATEGORY):
+        self.default = default
+        self._known = {}
+        for names in categories.values():
+            for name in names:
+                self._known.setdefault(name.casefold(), name)
+        # Сначала длинные названия: «Кафе и рестораны» раньше «Кафе»
+        self._by_length = sorted(self._known.items(), key=lambda item: -len(item[0]))
+
+    def map(
+        self, category: str | None, description: str | None = None, type_: str = "Expense"
+    ) -> str:
+        """Категория пользователя для строки выписки.
+
+        Незнакомая категория банка у расхода не создаётся (как и при вводе
+        вручную — см. FT004): ищем категорию по описанию, иначе default.
+        Доходы, как и add_income, могут завести новую категорию.
+        """
+        if category and category.strip():
+            category = category.strip()
+            known = self._known.get(category.casefold())
+            if known is not None:
+                return known
+            if type_ == "Income":
+                return category
+        text = (description or "").casefold()
+        for key, name in self._by_length:
+            if key in text:
+                return name
+        return self.default
+
+
+def iter_csv(lines):
+    """Строки CSV-выписки -> (время, тип, сумма, категория, описание)."""
+    lines = iter(lines)
+    head = []
+    for line in lines:
+        head.append(line)
+        if len(head) >= 5:
+            break
+    try:
+        dialect = csv.Sniffer().sniff("".join(head), delimiters=";,\t")
+    except csv.Error:
+        dialect = csv.excel
+
+    def all_lines():
+        yield from head
+        yield from lines
+
+    reader = csv.reader(all_lines(), dialect)
+    header = [column.strip().lower() for column in next(reader, [])]
+    index = {}
+    for field, names in _CSV_COLUMNS.items():
+        for name in names:
+            if name in header:
+                index[field] = header.index(name)
+                break
+    if "date" not in index or "amount" not in index:
+        raise StatementFormatError("в CSV нет колонок с датой и суммой")
+
+    def column(row, field):
+        position = index.get(field)
+        return row[position] if position is not None and position < len(row) else None
+
+    for line_no, row in enumerate(reader, start=2):
+        if not any(cell.strip() for cell in row):
+            continue
+        try:
+            amount = parse_amount(column(row, "amount"))
+            created_at = parse_date(column(row, "date"))
+        except ValueError as e:
+            yield line_no, e
+            continue
+        yield line_no, (
+            created_at,
+            _detect_type(column(row, "type"), amount),
+            abs(amount),
+            column(row, "category"),
+            column(row, "description"),
+        )
+
+
+def iter_ofx(chunks):
+    """Куски OFX-файла -> (время, тип, сумма, None, описание) по STMTTRN."""
+    current = None
+    number = 0
+
+    def tags():
+        buffer = ""
+        for chunk in chunks:
+            buffer += chunk
+            # Последний тег может быть разрезан границей куска — оставляем его на потом
+            cut = buffer.rfind("<")
+            if cut <= 0:
+                continue
+            ready, buffer = buffer[:cut], buffer[cut:]
+            yield from _OFX_TAG.findall(ready)
+        yield from _OFX_TAG.findall(buffer)
+
+    for closing, tag, value in tags():
+        tag = tag.upper()
+        if tag == "STMTTRN":
+            if not closing:
+                current = {}
+            elif current is not None:
+                number += 1
+                yield number, _ofx_record(current)
+                current = None
+        elif current is not None and not closing:
+            current[tag] = value.strip()
+
+
+def _ofx_record(fields: dict):
+    try:
+        amount = parse_amount(fields.get("TRNAMT"))
+        posted = re.match(r"\d{8}(\d{6})?", fields.get("DTPOSTED", ""))
+        if not posted:
+            raise ValueError(f"не дата: {fields.get('DTPOSTED')!r}")
+        fmt = "%Y%m%d%H%M%S" if posted.group(1) else "%Y%m%d"
+        created_at = datetime.strptime(posted.group(0), fmt)
+    except ValueError as e:
+        return e
+    description = " ".join(filter(None, (fields.get("NAME"), fields.get("MEMO"))))
+    return created_at, _detect_type(None, amount), abs(amount), None, description
+
+
+def _open_text(path: str, sample_size: int = 65536):
+    """Открывает выписку как текст: UTF-8, иначе cp1251 (частая у банков)."""
+    with open(path, "rb") as file:
+        sample = file.read(sample_size)
+    encoding = "utf-8-sig"
+    try:
+        sample.decode(encoding)
+    except UnicodeDecodeError as e:
+        # Образец мог оборваться посреди символа — это ещё не повод менять кодировку
+        if e.start < len(sample) - 3:
+            encoding = "cp1251"
+    return open(path, encoding=encoding, errors="replace", newline="")
+
+
+def ingest_key(user_id: int, type_: str, amount: Decimal, created_at: datetime,
+               category: str, occurrence: int = 1) -> uuid.UUID:
+    """ingest_id строки выписки: одинаковый при повторном импорте того же файла.
+
+    occurrence — номер такой же строки в файле (с 1). У первой ключ без
+    номера: выписки, импортированные до появления номера, не задвоятся.
+    """
+    key = f"{user_id}|{type_}|{amount.normalize()}|{created_at.isoformat()}|{category}"
+    if occurrence > 1:
+        key += f"|{occurrence}"
+    return uuid.uuid5(_IMPORT_NAMESPACE, key)
+
+
+class StatementParser:
+    """Превращает строки выписки в записи для add_transactions_bulk.
+
+    Синхронный: import_statement вызывает parse() в отдельном потоке
+    кусками по IMPORT_PARSE_CHUNK строк, чтобы не блокировать цикл событий.
+    """
+
+    def __init__(self, user_id: int, entries, mapper: CategoryMapper):
+        self.user_id = user_id
+        self.entries = iter(entries)
+        self.mapper = mapper
+        self.stats = {"parsed": 0, "failed": 0, "errors": []}
+        self._occurrences = Counter()
+
+    def parse(self, limit: int | None = None) -> list:
+        """Следующие записи (не больше limit); пустой список — файл кончился."""
+        records = []
+        for line_no, entry in self.entries:
+            if isinstance(entry, Exception):
+                self.stats["failed"] += 1
+                if len(self.stats["errors"]) < IMPORT_MAX_ERRORS:
+                    self.stats["errors"].append((line_no, str(entry)))
+                continue
+            created_at, type_, amount, category, description = entry
+            if not amount:
+                continue
+            category = self.mapper.map(category, description, type_)
+            occurrence_key = (type_, amount, created_at, category)
+            self._occurrences[occurrence_key] += 1
+            records.append(
+                (
+                    ingest_key(
+                        self.user_id,
+                        type_,
+                        amount,
+                        created_at,
+                        category,
+                        self._occurrences[occurrence_key],
+                    ),
+                    self.user_id,
+                    type_,
+                    amount,
+                    category,
+                    created_at,
+                )
+            )
+            self.stats["parsed"] += 1
+            if limit is not None and len(records) >= limit:
+                break
+        return records
+
+
+async def import_statement(user_id: int, path: str, fmt: str, progress=None) -> dict:
+    """Импортирует выписку из файла path (fmt — csv или ofx).
+
+    progress(разобрано) — корутина для показа хода импорта.
+    Возвращает {"parsed", "inserted", "duplicates", "rejected", "failed",
+    "errors": [(строка, текст)]}: rejected — не записано, потому что
+    пользователь не зарегистрирован, failed — строк с ошибками разбора,
+    errors — первые IMPORT_MAX_ERRORS из них.
+    """
+    if fmt not in IMPORT_FORMATS:
+        raise StatementFormatError(f"формат {fmt} не поддерживается")
+    mapper = CategoryMapper(await get_user_categories(user_id))
+    records = []
+    # Файл разбирается целиком до записи: транзакция базы не ждёт разбора
+    with await asyncio.to_thread(_open_text, path) as file:
+        if fmt == "csv":
+            entries = iter_csv(file)
+        else:
+            entries = iter_ofx(iter(lambda: file.read(65536), ""))
+        parser = StatementParser(user_id, entries, mapper)
+        last_progress = time.monotonic()
+        while True:
+            chunk = await asyncio.to_thread(parser.parse, IMPORT_PARSE_CHUNK)
+            if not chunk:
+                break
+            records += chunk
+            if progress is not None and time.monotonic() - last_progress >= IMPORT_PROGRESS_INTERVAL:
+                last_progress = time.monotonic()
+                await progress(len(records))
+
+    result = await add_transactions_bulk(records, skip_existing=True)
+    stats = parser.stats
+    rejected = len(result["rejected"])
+    return {
+        "parsed": stats["parsed"],
+        "inserted": result["inserted"],
+        "duplicates": stats["parsed"] - result["inserted"] - rejected,
+        "rejected": rejected,
+        "failed": stats["failed"],
+        "errors": stats["errors"],
+    }
@@ -0,0 +1,295 @@
+"""
+Отложенная пакетная запись транзакций (INGEST_MODE=buffered).
+
+Транзакция проверяется, дописывается в журнал на диске (с fsync) — после
+этого пользователю уже можно ответить — и копится в буфере. Буфер
+сбрасывается в базу пачками через COPY (database.add_transactions_bulk):
+по размеру пачки или по таймеру. Если бот упал, не успев сбросить буфер,
+при следующем запуске записи поднимаются из журнала; повторная вставка
+уже записанных строк отсекается по ingest_id.
+
+Пока база недоступна, пачка остаётся в буфере и журнале, а попытки
+повторяются с растущей паузой (до INGEST_RETRY_MAX_DELAY). Автору
+сообщается об ошибке, только если база отвергла саму запись (неверные
+данные, пользователь удалён) — такие записи ищутся поштучно.
+
+Время транзакции ставится в UTC и переводится в часовой пояс базы при
+записи (add_transactions_bulk(source_timezone="UTC")), поэтому транзакция
+попадает в тот же день, что и при прямой записи.
+"""
+import asyncio
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+import asyncpg
+from database import add_transactions_bulk, validate_transaction
+
+INGEST_MODE = os.getenv("INGEST_MODE", "direct")
+INGEST_FLUSH_SIZE = int(os.getenv("INGEST_FLUSH_SIZE", "500"))
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", "0.5"))
+INGEST_JOURNAL = os.getenv("INGEST_JOURNAL", "ingest.journal")
+INGEST_RETRY_MAX_DELAY = float(os.getenv("INGEST_RETRY_MAX_DELAY", "30"))
+
+# Ошибки, при которых повтор не поможет: запись отвергнута базой или
+# не кодируется драйвером (TypeError/ValueError при COPY)
+_PERMANENT_ERRORS = (
+    asyncpg.DataError,
+    asyncpg.IntegrityConstraintViolationError,
+    TypeError,
+    ValueError,
+)
+
+
+def _utcnow() -> datetime:
+    # В буфере и при COPY время хранится без пояса, но всегда в UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _encode(record: tuple) -> str:
+    ingest_id, user_id, type_, amount, category_name, created_at = record
+    return json.dumps(
+        [
+            str(ingest_id),
+            user_id,
+            type_,
+            str(amount),
+            category_name,
+            created_at.replace(tzinfo=timezone.utc).isoformat(),
+        ],
+        ensure_ascii=False,
+    )
+
+
+def _decode(line: str) -> tuple:
+    ingest_id, user_id, type_, amount, category_name, created_at = json.loads(line)
+    # Журналы прежних версий хранят местное время сервера без пояса
+    created_at = datetime.fromisoformat(created_at).astimezone(timezone.utc)
+    return (
+        uuid.UUID(ingest_id),
+        user_id,
+        type_,
+        Decimal(amount),
+        category_name,
+        created_at.replace(tzinfo=None),
+    )
+
+
+class WriteBehindBuffer:
+    def __init__(
+        self,
+        on_failure=None,
+        journal_path: str = INGEST_JOURNAL,
+        flush_size: int = INGEST_FLUSH_SIZE,
+        flush_interval: float = INGEST_FLUSH_INTERVAL,
+        retry_max_delay: float = INGEST_RETRY_MAX_DELAY,
+    ):
+        # on_failure(record, error) — корутина, сообщающая автору об ошибке
+        self.on_failure = on_failure
+        self.journal_path = journal_path
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.retry_max_delay = retry_max_delay
+        self._pending = []
+        self._journal = None
+        self._journal_lock = asyncio.Lock()
+        # Записи, ждущие попадания в журнал: пишутся группой с одним fsync
+        self._journal_queue = []
+        self._journal_writer = None
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._stopping = False
+        self.stats = {"enqueued": 0, "flushed": 0, "batches": 0, "failed": 0, "retries": 0}
+
+    async def start(self):
+        """Поднимает несброшенные записи из журнала и запускает сброс."""
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, encoding="utf-8") as journal:
+                self._pending = [_decode(line) for line in journal if line.strip()]
+            if self._pending:
+                print(f"[Буфер] Восстановлено из журнала: {len(self._pending)}")
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Останавливает приём и сбрасывает в базу всё, что осталось в буфере."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+        while self._pending:
+            if not await self.flush():
+                print(f"[Буфер] База недоступна, в журнале остаётся: {len(self._pending)}")
+                break
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    async def submit(self, user_id: int, type_: str, amount, category_name: str):
+        """Проверяет транзакцию и надёжно ставит её в очередь на запись.
+
+        Ошибки проверки (ValueError) возникают сразу. После возврата
+        запись сохранена в журнале и не потеряется при перезапуске.
+        """
+        await self.submit_many(user_id, type_, [(amount, category_name)])
+
+    async def submit_many(self, user_id: int, type_: str, entries):
+        """То же для нескольких пар (сумма, категория) одного сообщения.
+
+        Сначала проверяются все записи: при ошибке в очередь не попадает
+        ни одна. Записи журналируются одной группой и уходят в базу вместе.
+        """
+        if self._stopping:
+            raise RuntimeError("Буфер записи остановлен")
+        pending_categories = {
+            record[4]
+            for record in (*self._pending, *(r for r, _ in self._journal_queue))
+            if record[1] == user_id
+        }
+        for amount, category_name in entries:
+            await validate_transaction(
+                user_id, type_, amount, category_name, pending_categories
+            )
+            pending_categories.add(category_name)
+        now = _utcnow()
+        records = [
+            (uuid.uuid4(), user_id, type_, Decimal(str(amount)), category_name, now)
+            for amount, category_name in entries
+        ]
+        written = [asyncio.get_running_loop().create_future() for _ in records]
+        self._journal_queue.extend(zip(records, written))
+        if self._journal_writer is None or self._journal_writer.done():
+            self._journal_writer = asyncio.create_task(self._write_journal())
+        # Вся группа пишется одним fsync, ошибка записи у всех одна и та же
+        for result in await asyncio.gather(*written, return_exceptions=True):
+            if isinstance(result, Exception):
+                raise result
+        self.stats["enqueued"] += len(records)
+        if len(self._pending) >= self.flush_size:
+            self._wakeup.set()
+
+    async def _write_journal(self):
+        """Дописывает в журнал всё, что накопилось, одним fsync на группу."""
+        async with self._journal_lock:
+            while self._journal_queue:
+                group, self._journal_queue = self._journal_queue, []
+                lines = [_encode(record) for record, _ in group]
+                try:
+                    await asyncio.to_thread(self._append, lines)
+                except Exception as e:
+                    for _, written in group:
+                        written.set_exception(e)
+                    continue
+                self._pending.extend(record for record, _ in group)
+                for _, written in group:
+                    written.set_result(None)
+
+    def _append(self, lines: list):
+        self._journal.write("".join(line + "\n" for line in lines))
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def _rewrite_journal(self, records: list):
+        """Оставляет в журнале только ещё не записанные в базу строки."""
+        tmp_path = self.journal_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as tmp:
+            for record in records:
+                tmp.write(_encode(record) + "\n")
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        self._journal.close()
+        os.replace(tmp_path, self.journal_path)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+    async def _wait(self, timeout: float, until_stopping: bool = False):
+        """Ждёт timeout секунд или сигнала; until_stopping — только остановки."""
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not self._stopping:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                return
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), remaining)
+            except asyncio.TimeoutError:
+                return
+            self._wakeup.clear()
+            if not until_stopping:
+                return
+
+    async def _flush_loop(self):
+        delay = 0
+        while not self._stopping:
+            if delay:
+                # База недоступна: полная пачка не сокращает паузу
+                await self._wait(delay, until_stopping=True)
+            else:
+                await self._wait(self.flush_interval)
+            while self._pending and not self._stopping:
+                if not await self.flush():
+                    delay = min(max(delay * 2, 1), self.retry_max_delay)
+                    break
+            else:
+                delay = 0
+
+    async def _write_batch(self, batch: list):
+        """Пишет пачку; если база отвергла её, ищет виноватые записи поштучно.
+
+        Возвращает (записанные, отвергнутые [(запись, ошибка)]). При
+        временной ошибке бросает исключение — пачка остаётся в буфере.
+        """
+        try:
+            result = await add_transactions_bulk(batch, source_timezone="UTC")
+        except _PERMANENT_ERRORS as e:
+            if len(batch) == 1:
+                return [], [(batch[0], e)]
+            print(f"[Буфер] База отвергла пачку, запись по одной: {e}")
+            written, failed = [], []
+            for record in batch:
+                ok, bad = await self._write_batch([record])
+                written += ok
+                failed += bad
+            return written, failed
+        self.stats["flushed"] += result["inserted"]
+        self.stats["batches"] += 1
+        rejected = set(result["rejected"])
+        failed = [
+            (record, ValueError("Пользователь не существует"))
+            for record in batch
+            if record[0] in rejected
+        ]
+        return [record for record in batch if record[0] not in rejected], failed
+
+    async def flush(self) -> bool:
+        """Записывает в базу одну пачку.
+
+        Возвращает False, если база недоступна: пачка остаётся в буфере и
+        журнале до следующей попытки.
+        """
+        async with self._flush_lock:
+            batch = self._pending[: self.flush_size]
+            if not batch:
+                return True
+
+            try:
+                written, failed = await self._write_batch(batch)
+            except Exception as e:
+                self.stats["retries"] += 1
+                print(f"[Буфер] Ошибка записи пачки, повтор позже: {e}")
+                return False
+
+            done = {record[0] for record in written}
+            done.update(record[0] for record, _ in failed)
+            async with self._journal_lock:
+                self._pending = [record for record in self._pending if record[0] not in done]
+                await asyncio.to_thread(self._rewrite_journal, list(self._pending))
+
+            self.stats["failed"] += len(failed)
+            for record, err in failed:
+                if self.on_failure is not None:
+                    try:
+                        await self.on_failure(record, err)
+                    except Exception as e:
+                        print(f"[Буфер] Не удалось сообщить об ошибке: {e}")
+            return True
@@ -1,3 +1,5 @@
+import hashlib
+from datetime import datetime, timedelta
 from aiogram.types import (
     ReplyKeyboardMarkup,
     KeyboardButton,
@@ -84,6 +86,88 @@ def chart_type_keyboard():
         [
             InlineKeyboardButton(text="📉 Расходы", callback_data="chart_expense"),
             InlineKeyboardButton(text="📈 Доходы", callback_data="chart_income"),
-        ]
+        ],
+        [
+            InlineKeyboardButton(text="📅 По дням", callback_data="trend:day"),
+            InlineKeyboardButton(text="🗓 По неделям", callback_data="trend:week"),
+            InlineKeyboardButton(text="📆 По месяцам", callback_data="trend:month"),
+        ],
     ])
-    return keyboard
\ No newline at end of file
+    return keyboard
+
+# callback_data истории: hist:<действие>:<время>:<id>:<тип>:<категория>.
+# Действие: f — первая страница, n — старее курсора, p — новее курсора.
+# Курсор (created_at, id) — в base36, категория — коротким хэшем:
+# Telegram ограничивает callback_data 64 байтами.
+_EPOCH = datetime(1970, 1, 1)
+_HISTORY_TYPES = {"Income": "i", "Expense": "e"}
+
+
+def _base36(number: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    if number < 0:
+        # Транзакции до 1970 года (например, из импорта выписки)
+        return "-" + _base36(-number)
+    result = ""
+    while True:
+        number, rest = divmod(number, 36)
+        result = digits[rest] + result
+        if not number:
+            return result
+
+
+def category_tag(name: str) -> str:
+    return hashlib.blake2s(name.encode(), digest_size=4).hexdigest()
+
+
+def encode_history_callback(action: str, cursor=None, type_=None, category=None) -> str:
+    created, tx_id = "", ""
+    if cursor is not None:
+        created = _base36((cursor[0] - _EPOCH) // timedelta(microseconds=1))
+        tx_id = _base36(cursor[1])
+    tag = category_tag(category) if category else ""
+    return f"hist:{action}:{created}:{tx_id}:{_HISTORY_TYPES.get(type_, '')}:{tag}"
+
+
+def decode_history_callback(data: str):
+    """Возвращает (действие, курсор, тип, хэш категории).
+
+    ValueError — данные не в этом формате (кнопка из старой версии бота).
+    """
+    _, action, created, tx_id, type_code, tag = data.split(":")
+    cursor = None
+    if created:
+        cursor = (_EPOCH + timedelta(microseconds=int(created, 36)), int(tx_id, 36))
+    types = {code: type_ for type_, code in _HISTORY_TYPES.items()}
+    return action, cursor, types.get(type_code), tag or None
+
+
+def get_history_keyboard(rows, has_older: bool, has_newer: bool, type_=None, category=None):
+    buttons = []
+    nav = []
+    if rows and has_newer:
+        first = (rows[0]["created_at"], rows[0]["id"])
+        nav.append(InlineKeyboardButton(
+            text="⬅️ Новее", callback_data=encode_history_callback("p", first, type_, category)
+        ))
+    if rows and has_older:
+        last = (rows[-1]["created_at"], rows[-1]["id"])
+        nav.append(InlineKeyboardButton(
+            text="Старее ➡️", callback_data=encode_history_callback("n", last, type_, category)
+        ))
+    if nav:
+        buttons.append(nav)
+
+    filters = []
+    for value, title in ((None, "Все"), ("Income", "💰 Доходы"), ("Expense", "💸 Расходы")):
+        mark = "✅ " if value == type_ else ""
+        filters.append(InlineKeyboardButton(
+            text=mark + title, callback_data=encode_history_callback("f", None, value, category)
+        ))
+    buttons.append(filters)
+    if category:
+        buttons.append([InlineKeyboardButton(
+            text=f"✖️ Все категории (сейчас: {category})",
+            callback_data=encode_history_callback("f", None, type_, None),
+        )])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
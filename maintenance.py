@@ -0,0 +1,118 @@
+"""
+Служебные команды для обслуживания базы.
+
+Примеры:
+    python maintenance.py balances          # только проверка
+    python maintenance.py balances --fix    # проверка и пересчёт
+    python maintenance.py rollups           # сверка дневных итогов
+    python maintenance.py rollups --fix     # исправить расхождения
+    python maintenance.py rollups --rebuild # пересобрать итоги целиком
+    python maintenance.py budgets --rollover # обнулить бюджеты прошлых месяцев
+"""
+import argparse
+import asyncio
+from database import (
+    init_pool,
+    close_pool,
+    check_user_balances,
+    check_daily_rollups,
+    rebuild_daily_rollups,
+    rollover_budgets,
+)
+
+
+async def cmd_balances(args):
+    drift = await check_user_balances(fix=args.fix)
+    for row in drift:
+        print(
+            f"user_id={row['user_id']}: "
+            f"доходы {row['stored_income']} -> {row['actual_income']}, "
+            f"расходы {row['stored_expense']} -> {row['actual_expense']}"
+        )
+    if not drift:
+        print("[Балансы] Расхождений нет.")
+    elif args.fix:
+        print(f"[Балансы] Исправлено расхождений: {len(drift)}")
+    else:
+        print(f"[Балансы] Найдено расхождений: {len(drift)} (запустите с --fix)")
+    return 1 if drift and not args.fix else 0
+
+
+async def cmd_rollups(args):
+    if args.rebuild:
+        rows = await rebuild_daily_rollups()
+        print(f"[Итоги] Пересобрано строк: {rows}")
+        return 0
+
+    drift = await check_daily_rollups(fix=args.fix)
+    for row in drift:
+        print(
+            f"user_id={row['user_id']} {row['day']} {row['type']} "
+            f"'{row['category_name']}': "
+            f"сумма {row['stored_total']} -> {row['actual_total']}, "
+            f"транзакций {row['stored_count']} -> {row['actual_count']}"
+        )
+    if not drift:
+        print("[Итоги] Расхождений нет.")
+    elif args.fix:
+        print(f"[Итоги] Исправлено расхождений: {len(drift)}")
+    else:
+        print(f"[Итоги] Найдено расхождений: {len(drift)} (запустите с --fix)")
+    return 1 if drift and not args.fix else 0
+
+
+async def cmd_budgets(args):
+    if not args.rollover:
+        print("[Бюджеты] Укажите действие: --rollover")
+        return 2
+    count = await rollover_budgets()
+    print(f"[Бюджеты] Обнулено счётчиков прошлых месяцев: {count}")
+    return 0
+
+
+COMMANDS = {
+    "balances": cmd_balances,
+    "rollups": cmd_rollups,
+    "budgets": cmd_budgets,
+}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Обслуживание базы финансового трекера")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    balances = sub.add_parser(
+        "balances", help="сверить user_balances с таблицей transactions"
+    )
+    balances.add_argument(
+        "--fix", action="store_true", help="пересчитать балансы с расхождениями"
+    )
+
+    rollups = sub.add_parser(
+        "rollups", help="сверить daily_rollups с таблицей transactions"
+    )
+    rollups.add_argument(
+        "--fix", action="store_true", help="исправить итоги с расхождениями"
+    )
+    rollups.add_argument(
+        "--rebuild", action="store_true", help="пересобрать все итоги заново"
+    )
+
+    budgets = sub.add_parser("budgets", help="обслуживание месячных бюджетов")
+    budgets.add_argument(
+        "--rollover", action="store_true", help="обнулить счётчики прошлых месяцев"
+    )
+    return parser
+
+
+async def main(argv=None):
+    args = build_parser().parse_args(argv)
+    await init_pool()
+    try:
+        return await COMMANDS[args.command](args)
+    finally:
+        await close_pool()
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main()))
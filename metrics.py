@@ -0,0 +1,210 @@
+"""
+Метрики бота в текстовом формате Prometheus.
+
+- время и ошибки обработчиков aiogram (HandlerTimingMiddleware);
+- время и ошибки запросов к базе по имени функции database.py
+  (timed_query) и журнал запросов дольше SLOW_QUERY_MS;
+- число пользователей в каждом состоянии FSM, напоминания и рассылки;
+- состояние пула соединений, буфера записи, очереди выгрузок и графиков
+  (их снимают функции, зарегистрированные через register_gauge).
+
+Метрики отдаются по HTTP: http://METRICS_HOST:METRICS_PORT/metrics
+(METRICS_PORT=0 — сервер не поднимается). В режиме supervisor.py каждый
+шард слушает свой порт: METRICS_PORT + номер шарда.
+"""
+import functools
+import inspect
+import os
+import time
+from aiohttp import web
+from aiogram import BaseMiddleware
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+
+_PREFIX = "finance_bot_"
+# Границы корзин гистограмм, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_metrics = []
+_gauges = []
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value) -> str:
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help_: str):
+        self.name = _PREFIX + name
+        self.help = help_
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        self._values[key] = self._values.get(key, 0) + value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_: str, buckets=DEFAULT_BUCKETS):
+        self.name = _PREFIX + name
+        self.help = help_
+        self.buckets = tuple(buckets)
+        # метки -> [счётчики по корзинам (не накопительные), сумма, количество]
+        self._values = {}
+        _metrics.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[0][i] += 1
+                break
+        state[1] += value
+        state[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                labels = _format_labels((*key, ("le", _format_value(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels((*key, ("le", "+Inf")))
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+def register_gauge(name: str, help_: str, func, label: str | None = None):
+    """Показатель, который снимается при каждом запросе /metrics.
+
+    func() — функция или корутина, возвращает число, а если задан label —
+    словарь {значение метки: число}.
+    """
+    _gauges.append((_PREFIX + name, help_, func, label))
+
+
+async def _render_gauges() -> list:
+    lines = []
+    for name, help_, func, label in _gauges:
+        try:
+            value = func()
+            if inspect.isawaitable(value):
+                value = await value
+        except Exception as e:
+            print(f"[Метрики] {name}: {e}")
+            continue
+        lines += [f"# HELP {name} {help_}", f"# TYPE {name} gauge"]
+        if label is None:
+            lines.append(f"{name} {_format_value(value)}")
+        else:
+            for key, item in value.items():
+                lines.append(f"{name}{_format_labels(((label, key),))} {_format_value(item)}")
+    return lines
+
+
+async def render() -> str:
+    lines = []
+    for metric in _metrics:
+        lines += metric.render()
+    lines += await _render_gauges()
+    return "\n".join(lines) + "\n"
+
+
+HANDLER_LATENCY = Histogram("handler_seconds", "Время обработчиков aiogram")
+HANDLER_ERRORS = Counter("handler_errors_total", "Исключения в обработчиках aiogram")
+DB_LATENCY = Histogram("db_query_seconds", "Время запросов к базе по имени функции")
+DB_ERRORS = Counter("db_query_errors_total", "Ошибки запросов к базе по имени функции")
+DB_SLOW = Counter("db_slow_queries_total", "Запросы к базе дольше SLOW_QUERY_MS")
+BROADCAST_MESSAGES = Counter(
+    "broadcast_messages_total", "Сообщения рассылок по результату отправки"
+)
+BROADCAST_LATENCY = Histogram(
+    "broadcast_seconds", "Длительность рассылок", buckets=(1, 5, 15, 60, 300, 900, 3600)
+)
+REMINDERS_CLAIMED = Counter(
+    "reminders_processed_total", "Обработанные записи очереди напоминаний"
+)
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Замеряет время каждого обработчика; метка handler — имя функции.
+
+    Регистрируется как внутренний middleware наблюдателя
+    (dp.message.middleware(...)), где уже известен выбранный обработчик.
+    """
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            HANDLER_ERRORS.inc(handler=name, error=type(e).__name__)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, handler=name)
+
+
+def timed_query(func):
+    """Декоратор функций database.py: время, ошибки и журнал медленных запросов."""
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception as e:
+            DB_ERRORS.inc(query=name, error=type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            DB_LATENCY.observe(elapsed, query=name)
+            if elapsed * 1000 >= SLOW_QUERY_MS:
+                DB_SLOW.inc(query=name)
+                print(f"[Медленный запрос] {name}: {elapsed * 1000:.0f} мс, аргументы: {args!r:.200}")
+
+    return wrapper
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=await render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    """Поднимает HTTP-сервер с /metrics. Возвращает runner для остановки или None."""
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"[Метрики] http://{host}:{port}/metrics")
+    return runner
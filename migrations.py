@@ -0,0 +1,564 @@
+"""
+Версионированные миграции схемы.
+
+Каждая миграция — (версия, описание, SQL). Применённые версии хранятся
+в таблице schema_migrations; новые миграции выполняются по порядку,
+каждая в своей транзакции. Одновременный запуск нескольких процессов
+защищён advisory-блокировкой.
+
+Миграции, которые на большой таблице надолго заблокировали бы запись
+(CREATE INDEX, VALIDATE CONSTRAINT), задаются кортежем шагов: каждый шаг
+выполняется отдельно, без общей транзакции, а версия записывается после
+последнего. Так можно строить индексы CREATE INDEX CONCURRENTLY (такой
+оператор должен быть единственным в шаге). Шаги должны быть повторяемыми
+(IF NOT EXISTS и т.п.): после сбоя миграция выполняется заново с первого
+шага, а недостроенный индекс (INVALID) перед повтором удаляется.
+
+Новую миграцию добавляем в конец MIGRATIONS со следующим номером,
+уже применённые миграции не редактируем.
+"""
+
+import re
+
+# Произвольный ключ advisory-блокировки для миграций
+MIGRATIONS_LOCK_KEY = 724_310_001
+
+MIGRATIONS = [
+    (
+        1,
+        "Начальная схема",
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS transactions (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            type TEXT,
+            amount NUMERIC NOT NULL,
+            category_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS expenses (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            amount NUMERIC NOT NULL,
+            category_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS incomes (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            amount NUMERIC NOT NULL,
+            category_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS user_balances (
+            user_id BIGINT PRIMARY KEY,
+            total_income NUMERIC NOT NULL DEFAULT 0,
+            total_expense NUMERIC NOT NULL DEFAULT 0
+        );
+
+        INSERT INTO user_balances (user_id, total_income, total_expense)
+        SELECT
+            user_id,
+            COALESCE(SUM(CASE WHEN type = 'Income' THEN amount ELSE 0 END), 0),
+            COALESCE(SUM(CASE WHEN type = 'Expense' THEN amount ELSE 0 END), 0)
+        FROM transactions
+        GROUP BY user_id
+        ON CONFLICT (user_id) DO NOTHING;
+        """,
+    ),
+    (
+        2,
+        "Индексы для частых запросов по transactions",
+        (
+            # История, удаление последней транзакции, отчёты за период
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS transactions_user_created_idx
+                ON transactions (user_id, created_at DESC, id DESC)
+            """,
+            # Отчёт по категории, список категорий, круговая диаграмма
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS transactions_user_type_category_created_idx
+                ON transactions (user_id, type, category_name, created_at)
+            """,
+        ),
+    ),
+    (
+        3,
+        "Внешний ключ transactions.user_id -> users",
+        (
+            # Транзакции без пользователя могли остаться с тех пор,
+            # когда ключа не было: заводим для них пустые записи.
+            # NOT VALID не проверяет старые строки и блокирует таблицу
+            # лишь на мгновение; новые строки проверяются сразу.
+            """
+            INSERT INTO users (user_id)
+            SELECT DISTINCT t.user_id
+            FROM transactions t
+            WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.user_id = t.user_id)
+            ON CONFLICT (user_id) DO NOTHING;
+
+            ALTER TABLE transactions
+                DROP CONSTRAINT IF EXISTS transactions_user_id_fkey;
+            ALTER TABLE transactions
+                ADD CONSTRAINT transactions_user_id_fkey
+                FOREIGN KEY (user_id) REFERENCES users (user_id) NOT VALID;
+            """,
+            # Проверка старых строк — отдельной транзакцией: она долгая, но
+            # держит SHARE UPDATE EXCLUSIVE и не мешает чтению и записи
+            "ALTER TABLE transactions VALIDATE CONSTRAINT transactions_user_id_fkey",
+        ),
+    ),
+    (
+        4,
+        "expenses/incomes становятся представлениями над transactions",
+        """
+        -- Строки старых таблиц без пары в transactions — это транзакции,
+        -- удалённые через delete_last_transaction (он чистил только
+        -- transactions). Источник истины — transactions, поэтому такие
+        -- строки не возвращаем, а сохраняем для истории.
+        CREATE TABLE IF NOT EXISTS legacy_typed_drift (
+            source TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            user_id BIGINT NOT NULL,
+            amount NUMERIC NOT NULL,
+            category_name TEXT,
+            created_at TIMESTAMP,
+            PRIMARY KEY (source, id)
+        );
+
+        INSERT INTO legacy_typed_drift
+        SELECT 'expenses', e.id, e.user_id, e.amount, e.category_name, e.created_at
+        FROM expenses e
+        WHERE NOT EXISTS (
+            SELECT 1 FROM transactions t
+            WHERE t.user_id = e.user_id
+              AND t.type = 'Expense'
+              AND t.amount = e.amount
+              AND t.category_name IS NOT DISTINCT FROM e.category_name
+              AND t.created_at IS NOT DISTINCT FROM e.created_at
+        );
+
+        INSERT INTO legacy_typed_drift
+        SELECT 'incomes', i.id, i.user_id, i.amount, i.category_name, i.created_at
+        FROM incomes i
+        WHERE NOT EXISTS (
+            SELECT 1 FROM transactions t
+            WHERE t.user_id = i.user_id
+              AND t.type = 'Income'
+              AND t.amount = i.amount
+              AND t.category_name IS NOT DISTINCT FROM i.category_name
+              AND t.created_at IS NOT DISTINCT FROM i.created_at
+        );
+
+        DROP TABLE expenses;
+        DROP TABLE incomes;
+
+        -- Только для чтения: для совместимости со старыми запросами
+        CREATE VIEW expenses AS
+            SELECT id, user_id, amount, category_name, created_at
+            FROM transactions
+            WHERE type = 'Expense';
+
+        CREATE VIEW incomes AS
+            SELECT id, user_id, amount, category_name, created_at
+            FROM transactions
+            WHERE type = 'Income';
+        """,
+    ),
+    (
+        5,
+        "Справочник категорий пользователя",
+        """
+        CREATE TABLE user_categories (
+            user_id BIGINT NOT NULL REFERENCES users (user_id),
+            type TEXT NOT NULL,
+            name TEXT NOT NULL,
+            PRIMARY KEY (user_id, type, name)
+        );
+
+        INSERT INTO user_categories (user_id, type, name)
+        SELECT DISTINCT user_id, type, category_name
+        FROM transactions
+        WHERE type IS NOT NULL AND category_name IS NOT NULL;
+        """,
+    ),
+    (
+        6,
+        "Отметка о недоступных для рассылки пользователях",
+        """
+        ALTER TABLE users ADD COLUMN blocked_at TIMESTAMP;
+        """,
+    ),
+    (
+        7,
+        "Дата последней активности пользователя",
+        """
+        ALTER TABLE users ADD COLUMN last_activity_date DATE;
+
+        UPDATE users u
+        SET last_activity_date = t.last_date
+        FROM (
+            SELECT user_id, MAX(created_at)::DATE AS last_date
+            FROM transactions
+            GROUP BY user_id
+        ) t
+        WHERE t.user_id = u.user_id;
+        """,
+    ),
+    (
+        8,
+        "Часовые пояса и очередь напоминаний",
+        """
+        -- NULL — часовой пояс по умолчанию (DEFAULT_TIMEZONE или пояс сервера)
+        ALTER TABLE users ADD COLUMN timezone TEXT;
+        ALTER TABLE users ADD COLUMN reminder_time TIME NOT NULL DEFAULT '20:00';
+
+        -- Ближайшее после after наступление местного времени at в поясе tz
+        CREATE FUNCTION ft_next_reminder_at(tz TEXT, at TIME, after TIMESTAMPTZ)
+        RETURNS TIMESTAMPTZ
+        LANGUAGE sql STABLE
+        AS $$
+            SELECT CASE
+                WHEN ((after AT TIME ZONE tz)::DATE + at) AT TIME ZONE tz > after
+                    THEN ((after AT TIME ZONE tz)::DATE + at) AT TIME ZONE tz
+                ELSE ((after AT TIME ZONE tz)::DATE + 1 + at) AT TIME ZONE tz
+            END
+        $$;
+
+        -- Очередь напоминаний: строка на пользователя со временем следующего
+        -- срабатывания. claimed_until — аренда строки обработчиком: если он
+        -- упал, не дойдя до отметки об отправке, строку заберут повторно.
+        CREATE TABLE reminder_queue (
+            user_id BIGINT PRIMARY KEY REFERENCES users (user_id) ON DELETE CASCADE,
+            due_at TIMESTAMPTZ NOT NULL,
+            claimed_until TIMESTAMPTZ,
+            last_sent_on DATE
+        );
+        CREATE INDEX reminder_queue_due_idx ON reminder_queue (due_at);
+        """,
+    ),
+    (
+        9,
+        "Дневные итоги по пользователю, типу и категории",
+        """
+        CREATE TABLE daily_rollups (
+            user_id BIGINT NOT NULL REFERENCES users (user_id),
+            day DATE NOT NULL,
+            type TEXT NOT NULL,
+            category_name TEXT NOT NULL,
+            total NUMERIC NOT NULL DEFAULT 0,
+            tx_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day, type, category_name)
+        );
+
+        INSERT INTO daily_rollups (user_id, day, type, category_name, total, tx_count)
+        SELECT user_id, created_at::DATE, type, COALESCE(category_name, ''),
+               SUM(amount), COUNT(*)
+        FROM transactions
+        WHERE type IS NOT NULL AND created_at IS NOT NULL
+        GROUP BY 1, 2, 3, 4;
+        """,
+    ),
+    (
+        10,
+        "Идентификатор записи для пакетной загрузки транзакций",
+        (
+            # Повторная загрузка той же пачки (после сбоя) не создаёт дублей
+            "ALTER TABLE transactions ADD COLUMN IF NOT EXISTS ingest_id UUID",
+            """
+            CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS transactions_ingest_id_idx
+                ON transactions (ingest_id) WHERE ingest_id IS NOT NULL
+            """,
+        ),
+    ),
+    (
+        11,
+        "Функция ft_add_transaction: проверка и запись за один запрос",
+        """
+        -- Проверяет пользователя, сумму и категорию и записывает транзакцию
+        -- вместе со всеми производными таблицами. Ошибки проверки —
+        -- собственные коды SQLSTATE (FT001–FT004), их разбирает database.py.
+        -- Возвращает TRUE, если категория у пользователя появилась впервые.
+        CREATE FUNCTION ft_add_transaction(
+            p_user_id BIGINT, p_type TEXT, p_amount NUMERIC, p_category TEXT
+        )
+        RETURNS BOOLEAN
+        LANGUAGE plpgsql
+        AS $$
+        DECLARE
+            v_new_category INTEGER;
+        BEGIN
+            PERFORM 1 FROM users WHERE user_id = p_user_id;
+            IF NOT FOUND THEN
+                RAISE EXCEPTION 'user % does not exist', p_user_id
+                    USING ERRCODE = 'FT001';
+            END IF;
+
+            IF p_amount IS NULL OR p_amount = 0
+               OR p_category IS NULL OR p_category = '' THEN
+                RAISE EXCEPTION 'amount and category are required'
+                    USING ERRCODE = 'FT002';
+            END IF;
+
+            IF p_amount < 0 THEN
+                RAISE EXCEPTION 'amount must be positive' USING ERRCODE = 'FT003';
+            END IF;
+
+            IF p_type = 'Expense' AND NOT EXISTS (
+                SELECT 1 FROM user_categories
+                WHERE user_id = p_user_id AND name = p_category
+            ) THEN
+                RAISE EXCEPTION 'category % does not exist', p_category
+                    USING ERRCODE = 'FT004';
+            END IF;
+
+            INSERT INTO transactions (user_id, type, amount, category_name)
+            VALUES (p_user_id, p_type, p_amount, p_category);
+
+            INSERT INTO user_balances (user_id, total_income, total_expense)
+            VALUES (
+                p_user_id,
+                CASE WHEN p_type = 'Income' THEN p_amount ELSE 0 END,
+                CASE WHEN p_type = 'Expense' THEN p_amount ELSE 0 END
+            )
+            ON CONFLICT (user_id) DO UPDATE
+            SET total_income = user_balances.total_income + EXCLUDED.total_income,
+                total_expense = user_balances.total_expense + EXCLUDED.total_expense;
+
+            INSERT INTO daily_rollups (user_id, day, type, category_name, total, tx_count)
+            VALUES (p_user_id, CURRENT_DATE, p_type, p_category, p_amount, 1)
+            ON CONFLICT (user_id, day, type, category_name) DO UPDATE
+            SET total = daily_rollups.total + EXCLUDED.total,
+                tx_count = daily_rollups.tx_count + 1;
+
+            UPDATE users SET last_activity_date = CURRENT_DATE
+            WHERE user_id = p_user_id
+              AND last_activity_date IS DISTINCT FROM CURRENT_DATE;
+
+            INSERT INTO user_categories (user_id, type, name)
+            VALUES (p_user_id, p_type, p_category)
+            ON CONFLICT DO NOTHING;
+            GET DIAGNOSTICS v_new_category = ROW_COUNT;
+
+            RETURN v_new_category > 0;
+        END;
+        $$;
+        """,
+    ),
+    (
+        12,
+        "Таблица fsm_state для состояний диалогов (FSM_STORAGE=postgres)",
+        """
+        CREATE TABLE IF NOT EXISTS fsm_state (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data JSONB NOT NULL DEFAULT '{}'::JSONB,
+            expires_at TIMESTAMPTZ NOT NULL
+        );
+
+        -- Фоновая очистка брошенных диалогов
+        CREATE INDEX IF NOT EXISTS fsm_state_expires_idx ON fsm_state (expires_at);
+        """,
+    ),
+    (
+        13,
+        "Индексы для истории транзакций с фильтром по типу и категории",
+        (
+            # Постраничная история по ключу (created_at, id) с фильтрами
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS transactions_user_type_created_idx
+                ON transactions (user_id, type, created_at DESC, id DESC)
+            """,
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS transactions_user_category_created_idx
+                ON transactions (user_id, category_name, created_at DESC, id DESC)
+            """,
+        ),
+    ),
+    (
+        14,
+        "Бюджеты по категориям на месяц со счётчиком расходов",
+        """
+        -- spent — расходы категории за месяц month; обновляется при каждой
+        -- записи расхода, поэтому проверка бюджета не пересчитывает суммы
+        CREATE TABLE budgets (
+            user_id BIGINT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+            category_name TEXT NOT NULL,
+            monthly_limit NUMERIC NOT NULL CHECK (monthly_limit > 0),
+            month DATE NOT NULL,
+            spent NUMERIC NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, category_name)
+        );
+        CREATE INDEX budgets_month_idx ON budgets (month);
+
+        -- ft_add_transaction дополнительно возвращает состояние бюджета
+        -- категории (NULL, если бюджета нет). Тип результата меняется,
+        -- поэтому функцию нужно пересоздать, а не заменить.
+        DROP FUNCTION ft_add_transaction(BIGINT, TEXT, NUMERIC, TEXT);
+        CREATE FUNCTION ft_add_transaction(
+            p_user_id BIGINT, p_type TEXT, p_amount NUMERIC, p_category TEXT,
+            OUT new_category BOOLEAN,
+            OUT budget_limit NUMERIC,
+            OUT spent_before NUMERIC,
+            OUT spent_after NUMERIC
+        )
+        LANGUAGE plpgsql
+        AS $$
+        DECLARE
+            v_new_category INTEGER;
+            v_month DATE := date_trunc('month', CURRENT_DATE)::DATE;
+        BEGIN
+            PERFORM 1 FROM users WHERE user_id = p_user_id;
+            IF NOT FOUND THEN
+                RAISE EXCEPTION 'user % does not exist', p_user_id
+                    USING ERRCODE = 'FT001';
+            END IF;
+
+            IF p_amount IS NULL OR p_amount = 0
+               OR p_category IS NULL OR p_category = '' THEN
+                RAISE EXCEPTION 'amount and category are required'
+                    USING ERRCODE = 'FT002';
+            END IF;
+
+            IF p_amount < 0 THEN
+                RAISE EXCEPTION 'amount must be positive' USING ERRCODE = 'FT003';
+            END IF;
+
+            IF p_type = 'Expense' AND NOT EXISTS (
+                SELECT 1 FROM user_categories
+                WHERE user_id = p_user_id AND name = p_category
+            ) THEN
+                RAISE EXCEPTION 'category % does not exist', p_category
+                    USING ERRCODE = 'FT004';
+            END IF;
+
+            INSERT INTO transactions (user_id, type, amount, category_name)
+            VALUES (p_user_id, p_type, p_amount, p_category);
+
+            INSERT INTO user_balances (user_id, total_income, total_expense)
+            VALUES (
+                p_user_id,
+                CASE WHEN p_type = 'Income' THEN p_amount ELSE 0 END,
+                CASE WHEN p_type = 'Expense' THEN p_amount ELSE 0 END
+            )
+            ON CONFLICT (user_id) DO UPDATE
+            SET total_income = user_balances.total_income + EXCLUDED.total_income,
+                total_expense = user_balances.total_expense + EXCLUDED.total_expense;
+
+            INSERT INTO daily_rollups (user_id, day, type, category_name, total, tx_count)
+            VALUES (p_user_id, CURRENT_DATE, p_type, p_category, p_amount, 1)
+            ON CONFLICT (user_id, day, type, category_name) DO UPDATE
+            SET total = daily_rollups.total + EXCLUDED.total,
+                tx_count = daily_rollups.tx_count + 1;
+
+            UPDATE users SET last_activity_date = CURRENT_DATE
+            WHERE user_id = p_user_id
+              AND last_activity_date IS DISTINCT FROM CURRENT_DATE;
+
+            INSERT INTO user_categories (user_id, type, name)
+            VALUES (p_user_id, p_type, p_category)
+            ON CONFLICT DO NOTHING;
+            GET DIAGNOSTICS v_new_category = ROW_COUNT;
+            new_category := v_new_category > 0;
+
+            -- Бюджет категории: одна строка по первичному ключу. Счётчик
+            -- прошлого месяца обнуляется здесь же, даже если перенос
+            -- (rollover_budgets) ещё не выполнялся.
+            IF p_type = 'Expense' THEN
+                UPDATE budgets
+                SET spent = CASE WHEN month = v_month THEN spent ELSE 0 END + p_amount,
+                    month = v_month
+                WHERE user_id = p_user_id AND category_name = p_category
+                RETURNING monthly_limit, spent - p_amount, spent
+                INTO budget_limit, spent_before, spent_after;
+            END IF;
+        END;
+        $$;
+        """,
+    ),
+]
+
+
+_CONCURRENT_INDEX = re.compile(
+    r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE
+)
+
+
+async def _drop_invalid_index(conn, step: str):
+    """Удаляет индекс шага, недостроенный прошлым запуском (он INVALID).
+
+    Иначе IF NOT EXISTS пропустил бы его, и индекс так и остался бы
+    непригодным для запросов.
+    """
+    match = _CONCURRENT_INDEX.search(step)
+    if match is None:
+        return
+    invalid = await conn.fetchval(
+        """
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = $1 AND pg_table_is_visible(c.oid) AND NOT i.indisvalid
+        """,
+        match.group(1),
+    )
+    if invalid:
+        print(f"[Миграции] Удаляю недостроенный индекс {match.group(1)}")
+        await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {match.group(1)}")
+
+
+async def migrate(conn, target: int | None = None):
+    """Применяет недостающие миграции (до версии target включительно).
+
+    Возвращает список применённых версий.
+    """
+    applied = []
+    await conn.execute("SELECT pg_advisory_lock($1)", MIGRATIONS_LOCK_KEY)
+    try:
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        done = {
+            row["version"]
+            for row in await conn.fetch("SELECT version FROM schema_migrations")
+        }
+        for version, name, sql in MIGRATIONS:
+            if version in done or (target is not None and version > target):
+                continue
+            if isinstance(sql, str):
+                async with conn.transaction():
+                    await conn.execute(sql)
+                    await conn.execute(
+                        "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)",
+                        version,
+                        name,
+                    )
+            else:
+                for step in sql:
+                    await _drop_invalid_index(conn, step)
+                    await conn.execute(step)
+                await conn.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)",
+                    version,
+                    name,
+                )
+            print(f"[Миграции] Применена {version}: {name}")
+            applied.append(version)
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK_KEY)
+    return applied
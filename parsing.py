@@ -0,0 +1,138 @@
+"""
+Разбор ввода «сумма категория».
+
+Сумма — точный Decimal (копейки, без ошибок float):
+
+- разделители тысяч — пробел, точка или запятая перед группой из трёх
+  цифр: «1 500», «1.500», «1,500,000»;
+- дробная часть — после точки или запятой: «99,90», «1 500.5»;
+- множители: «1.5k», «2к» (вплотную к числу), «3 тыс»;
+- простая арифметика: «120+35», «3*250», «1000/3» (результат округляется
+  до копеек).
+
+В одном сообщении можно прислать несколько записей — по одной на строку.
+"""
+import re
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+MAX_AMOUNT = Decimal("1000000000000")
+_CENT = Decimal("0.01")
+
+_NUMBER = r"""
+    (?P<number>
+        \d{1,3}(?:[ \u00a0\u202f.,]\d{3})+(?:[.,]\d{1,2})?   # 1 500,50 | 1,500.50
+        | \d+(?:[.,]\d+)?                                    # 1500 | 1.5
+    )
+    # k/к — только вплотную к числу: в «500 к празднику» «к» — предлог
+    (?P<suffix>(?:[kк]|\s*тыс)\.?(?![^\W\d_]))?               # 1.5k | 2к | 3 тыс
+"""
+_TERM_RE = re.compile(r"\s*" + _NUMBER, re.VERBOSE | re.IGNORECASE)
+_OPERATOR_RE = re.compile(r"\s*([-+*/×])")
+_SEPARATOR_RE = re.compile(r"[ \u00a0\u202f.,]")
+_MULTIPLIERS = {"k": 1000, "к": 1000, "тыс": 1000}
+
+
+class ParseError(ValueError):
+    """Строку не удалось разобрать; line — её номер (с 1) или None."""
+
+    def __init__(self, message: str, line: int | None = None):
+        super().__init__(message)
+        self.line = line
+
+
+def _number(text: str) -> Decimal:
+    separators = _SEPARATOR_RE.findall(text)
+    digits = _SEPARATOR_RE.split(text)
+    # «1.500» и «1,500» — тысячи, «1.5», «0,500» и «1500.125» — дробь
+    thousands = digits[0] != "0" and len(digits[0]) <= 3 and all(
+        len(group) == 3 for group in digits[1:]
+    )
+    if separators and separators[-1] in ".," and not thousands:
+        return Decimal("".join(digits[:-1]) + "." + digits[-1])
+    return Decimal("".join(digits))
+
+
+def _term(match) -> Decimal:
+    value = _number(match.group("number"))
+    suffix = match.group("suffix")
+    if suffix:
+        value *= _MULTIPLIERS[suffix.strip().rstrip(".").lower()]
+    return value
+
+
+def parse_amount(text: str) -> tuple[Decimal, str]:
+    """Разбирает сумму в начале строки.
+
+    Возвращает (сумма, остаток строки). Бросает ParseError, если суммы нет
+    или она не положительная.
+    """
+    match = _TERM_RE.match(text)
+    if match is None:
+        raise ParseError("Укажите сумму числом")
+    # Сумма слагаемых, каждое — произведение/частное множителей
+    total = Decimal(0)
+    product = _term(match)
+    sign = 1
+    position = match.end()
+    while True:
+        operator = _OPERATOR_RE.match(text, position)
+        if operator is None:
+            break
+        operand = _TERM_RE.match(text, operator.end())
+        if operand is None:
+            break
+        value = _term(operand)
+        symbol = operator.group(1)
+        if symbol in "*×":
+            product *= value
+        elif symbol == "/":
+            if not value:
+                raise ParseError("Деление на ноль")
+            product /= value
+        else:
+            total += sign * product
+            sign = 1 if symbol == "+" else -1
+            product = value
+        position = operand.end()
+    total += sign * product
+
+    try:
+        amount = total.quantize(_CENT, rounding=ROUND_HALF_UP)
+    except InvalidOperation:
+        raise ParseError("Слишком большая сумма") from None
+    if amount <= 0:
+        raise ParseError("Сумма должна быть положительной")
+    if amount > MAX_AMOUNT:
+        raise ParseError("Слишком большая сумма")
+    return amount, text[position:]
+
+
+def parse_entry(line: str) -> tuple[Decimal, str]:
+    """«1 500,50 Продукты» -> (Decimal('1500.50'), 'Продукты')."""
+    amount, rest = parse_amount(line)
+    if rest and not rest[0].isspace():
+        raise ParseError("Отделите сумму от категории пробелом")
+    category = " ".join(rest.split())
+    if not category:
+        raise ParseError("Укажите категорию после суммы")
+    if category.isdigit():
+        raise ParseError("Категория не может быть числом")
+    return amount, category
+
+
+def parse_entries(text: str) -> list[tuple[Decimal, str]]:
+    """Разбирает все непустые строки сообщения.
+
+    Бросает ParseError с номером первой ошибочной строки.
+    """
+    entries = []
+    for number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            entries.append(parse_entry(line))
+        except ParseError as e:
+            raise ParseError(str(e), number) from None
+    if not entries:
+        raise ParseError("Введите сумму и категорию")
+    return entries
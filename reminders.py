@@ -1,68 +1,86 @@
+"""
+Ежедневные напоминания пользователям, не внёсшим транзакции за день.
+
+Доставка — «хотя бы один раз»: пачка из reminder_queue забирается с
+арендой (REMINDER_LEASE_SECONDS), рассылается, и только потом сроки всей
+пачки переносятся на следующий день (complete_reminders). Если процесс
+упадёт между рассылкой и переносом, по истечении аренды пачку заберут
+снова и часть пользователей получит напоминание повторно. Отметка после
+каждого сообщения убрала бы повторы ценой запроса к базе на сообщение;
+для напоминания повтор безопаснее, чем потеря. Чем меньше
+REMINDER_BATCH_SIZE, тем меньше повторов после сбоя.
+"""
 import asyncio
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
 from aiogram import Bot
 from dotenv import load_dotenv
-from database import get_users_without_transactions_today
+from database import (
+    claim_due_reminders,
+    complete_reminders,
+    ensure_reminder_queue,
+    get_next_reminder_due,
+)
+from broadcast import Broadcaster
+from metrics import REMINDERS_CLAIMED
 
 load_dotenv()
 bot = Bot(token=os.getenv("BOT_TOKEN"))
 
+REMINDER_TEXT = "💡 Напоминаем: вы сегодня ещё не добавили доходы или расходы."
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", "1000"))
+# Сколько секунд пачка считается занятой; после этого её заберут повторно
+REMINDER_LEASE_SECONDS = int(os.getenv("REMINDER_LEASE_SECONDS", "600"))
 
-async def reminder_loop():
-    """
-    Цикл, запускающийся один раз при старте приложения и ждущий до 20:00 каждый день.
-    Если пользователь за день не внёс транзакции — ему отправляется напоминание.
-    """
+
+async def process_due_reminders() -> dict:
+    """Отправляет все наступившие напоминания пачками из очереди."""
+    total = {"claimed": 0, "sent": 0, "failed": 0, "unreachable": 0, "retries": 0}
     while True:
-        now = datetime.now()
-        target_time = now.replace(hour=20, minute=0, second=0, microsecond=0)
+        batch = await claim_due_reminders(REMINDER_BATCH_SIZE, REMINDER_LEASE_SECONDS)
+        if not batch:
+            return total
 
-        # Если текущее время уже позже 20:00 — ждать до 20:00 следующего дня
-        if now >= target_time:
-            target_time += timedelta(days=1)
+        user_ids = [row["user_id"] for row in batch]
+        to_remind = [row["user_id"] for row in batch if row["needs_reminder"]]
+        if to_remind:
+            stats = await Broadcaster(bot).run(to_remind, REMINDER_TEXT)
+            for key in ("sent", "failed", "unreachable", "retries"):
+                total[key] += stats[key]
+        await complete_reminders(user_ids, to_remind)
+        total["claimed"] += len(user_ids)
+        REMINDERS_CLAIMED.inc(len(user_ids) - len(to_remind), result="skipped")
+        REMINDERS_CLAIMED.inc(len(to_remind), result="reminded")
 
-        sleep_duration = (target_time - now).total_seconds()
-        print(f"[Напоминания] Ожидание до {target_time} ({sleep_duration:.0f} сек)")
-        await asyncio.sleep(sleep_duration)
 
+async def reminder_loop():
+    """
+    Планировщик напоминаний. У каждого пользователя своё время напоминания
+    (по умолчанию 20:00 в его часовом поясе), очередь хранится в базе
+    (reminder_queue), поэтому перезапуск бота напоминаний не теряет.
+    Просыпаемся к ближайшему сроку (но не реже раза в минуту) и обрабатываем
+    только тех, чьё время наступило. Если пользователь за свой день не внёс
+    транзакции — ему отправляется напоминание.
+    """
+    await ensure_reminder_queue()
+    while True:
         try:
-            users = await get_users_without_transactions_today()
-            print(f"[Напоминания] Пользователей без транзакций сегодня: {len(users)}")
-
-            for user_id in users:
-                try:
-                    await bot.send_message(
-                        user_id,
-                        "💡 Напоминаем: вы сегодня ещё не добавили доходы или расходы.",
-                    )
-                except Exception as e:
-                    print(f"[Ошибка отправки] user_id={user_id}: {e}")
-
+            stats = await process_due_reminders()
+            if stats["claimed"]:
+                print(
+                    f"[Напоминания] Обработано: {stats['claimed']}, "
+                    f"отправлено: {stats['sent']}, ошибок: {stats['failed']}, "
+                    f"недоступны: {stats['unreachable']}, повторов: {stats['retries']}"
+                )
         except Exception as e:
             print(f"[Ошибка] Напоминания не отправлены: {e}")
 
-
-# async def reminder_loop():
-#     """
-#     Тестовый цикл напоминаний — проверяет каждые 30 секунд.
-#     """
-#     while True:
-#         print("[Тест] Проверка напоминаний...")
-#         try:
-#             users = await get_users_without_transactions_today()
-#             print(f"[Тест] Пользователей без транзакций: {len(users)}")
-
-#             for user_id in users:
-#                 try:
-#                     await bot.send_message(
-#                         user_id,
-#                         "💡 [ТЕСТ] Напоминание: вы ещё не внесли доходы/расходы."
-#                     )
-#                 except Exception as e:
-#                     print(f"[Ошибка отправки] user_id={user_id}: {e}")
-
-#         except Exception as e:
-#             print(f"[Ошибка] Напоминания не отправлены: {e}")
-
-#         await asyncio.sleep(30)  # Повтор через 30 секунд
+        sleep_duration = 60
+        try:
+            next_due = await get_next_reminder_due()
+            if next_due is not None:
+                delay = (next_due - datetime.now(timezone.utc)).total_seconds()
+                sleep_duration = min(max(delay, 1), 60)
+        except Exception as e:
+            print(f"[Ошибка] Не удалось получить время следующего напоминания: {e}")
+        await asyncio.sleep(sleep_duration)
@@ -0,0 +1,182 @@
+"""
+Кэш готовых ответов бота (баланс, статистика) по пользователям.
+
+Ключ записи включает версию пользователя. Любая запись его транзакций
+(database.add_transactions, add_transactions_bulk, delete_last_transaction)
+меняет версию — старые ответы становятся недоступны и вытесняются сами.
+Новая версия берётся из общего возрастающего счётчика, а не +1, поэтому
+версия, вытесненная из кэша, никогда не повторится и устаревший ответ
+не оживёт.
+
+RESPONSE_CACHE=memory — LRU в памяти процесса (подходит и для
+supervisor.py: пользователь всегда попадает в один и тот же шард),
+redis — общий кэш нескольких процессов или серверов (pip install redis,
+адрес в REDIS_URL), off — без кэша.
+
+Корректность держится только на версиях: запись транзакций, исправления
+сверок и пересборка дневных итогов (invalidate_all) сбрасывают ответы
+сразу, без срока жизни. Исключение — сброс из другого процесса
+(python maintenance.py ... --fix) до кэша в памяти бота не доходит: после
+таких исправлений перезапустите бота или используйте redis.
+RESPONSE_CACHE_MAX_AGE — необязательный страховочный срок жизни любого
+ответа в памяти (по умолчанию выключен).
+"""
+import itertools
+import os
+import time
+from cache import LRUCache
+
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "memory")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "10000"))
+# Ответы, зависящие от текущего времени (отчёты «за 7 дней»), живут не дольше
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "300"))
+# Страховочный предел для любого ответа в кэше в памяти, 0 — без предела
+RESPONSE_CACHE_MAX_AGE = int(os.getenv("RESPONSE_CACHE_MAX_AGE", "0"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+_REDIS_PREFIX = "ft:resp:"
+
+
+class MemoryResponseCache:
+    def __init__(
+        self, maxsize: int = RESPONSE_CACHE_SIZE, max_age: float = RESPONSE_CACHE_MAX_AGE
+    ):
+        # user_id -> версия; (user_id, версия, вид ответа) -> (текст, годен до)
+        self._versions = LRUCache(maxsize)
+        self._entries = LRUCache(maxsize)
+        self.max_age = max_age
+        self._clock = itertools.count(1)
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def _version(self, user_id: int) -> int:
+        version = self._versions.get(user_id)
+        if version is None:
+            version = next(self._clock)
+            self._versions.set(user_id, version)
+        return version
+
+    async def get_or_set(self, user_id: int, kind: str, build, ttl: float | None = None):
+        """Готовый ответ вида kind или await build(), сохранённый в кэше.
+
+        Версия берётся до build(): если транзакцию запишут, пока ответ
+        строится, он сохранится под уже устаревшей версией.
+        """
+        key = (user_id, self._version(user_id), kind)
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] >= time.monotonic():
+            self.stats["hits"] += 1
+            return entry[0]
+        self.stats["misses"] += 1
+        value = await build()
+        max_age = min(filter(None, (ttl, self.max_age)), default=None)
+        expires = time.monotonic() + max_age if max_age else float("inf")
+        self._entries.set(key, (value, expires))
+        return value
+
+    async def invalidate(self, *user_ids: int):
+        for user_id in user_ids:
+            self._versions.set(user_id, next(self._clock))
+        self.stats["invalidations"] += len(user_ids)
+
+    async def invalidate_all(self):
+        # Новые версии берутся из того же счётчика и не совпадут со старыми
+        self._versions.clear()
+        self._entries.clear()
+        self.stats["invalidations"] += 1
+
+
+class RedisResponseCache:
+    """Тот же кэш в Redis. Ошибки Redis не мешают боту: чтение считается
+    промахом, а ответ просто не кэшируется."""
+
+    def __init__(self, url: str = REDIS_URL, ttl: int = 3600):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("Для RESPONSE_CACHE=redis установите пакет redis") from None
+        self._redis = redis.from_url(url, decode_responses=True)
+        # Срок жизни записей без своего TTL: ответы старых версий удалятся сами
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0, "errors": 0}
+
+    async def _version(self, user_id: int) -> str:
+        # Версия пользователя и поколение всего кэша (см. invalidate_all)
+        key = f"{_REDIS_PREFIX}v:{user_id}"
+        generation, version = await self._redis.mget(f"{_REDIS_PREFIX}gen", key)
+        if version is None:
+            await self._redis.set(key, await self._redis.incr(f"{_REDIS_PREFIX}clock"), nx=True)
+            version = await self._redis.get(key)
+        return f"{generation or 0}.{version}"
+
+    async def get_or_set(self, user_id: int, kind: str, build, ttl: float | None = None):
+        try:
+            key = f"{_REDIS_PREFIX}r:{user_id}:{await self._version(user_id)}:{kind}"
+            value = await self._redis.get(key)
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"[Кэш ответов] Redis: {e}")
+            return await build()
+        if value is not None:
+            self.stats["hits"] += 1
+            return value
+        self.stats["misses"] += 1
+        value = await build()
+        try:
+            await self._redis.set(key, value, ex=int(ttl or self.ttl))
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"[Кэш ответов] Redis: {e}")
+        return value
+
+    async def invalidate(self, *user_ids: int):
+        if not user_ids:
+            return
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for user_id in user_ids:
+                    pipe.incr(f"{_REDIS_PREFIX}clock")
+                clocks = await pipe.execute()
+                for user_id, clock in zip(user_ids, clocks):
+                    pipe.set(f"{_REDIS_PREFIX}v:{user_id}", clock)
+                await pipe.execute()
+        except Exception as e:
+            self.stats["errors"] += 1
+            # Запись в базу уже прошла — остаётся только сообщить
+            print(f"[Кэш ответов] Не удалось сбросить кэш {list(user_ids)}: {e}")
+            return
+        self.stats["invalidations"] += len(user_ids)
+
+    async def invalidate_all(self):
+        try:
+            await self._redis.incr(f"{_REDIS_PREFIX}gen")
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"[Кэш ответов] Не удалось сбросить весь кэш: {e}")
+            return
+        self.stats["invalidations"] += 1
+
+
+class NullResponseCache:
+    stats = {}
+
+    async def get_or_set(self, user_id: int, kind: str, build, ttl: float | None = None):
+        return await build()
+
+    async def invalidate(self, *user_ids: int):
+        pass
+
+    async def invalidate_all(self):
+        pass
+
+
+def create_response_cache(kind: str = RESPONSE_CACHE):
+    if kind == "memory":
+        return MemoryResponseCache()
+    if kind == "redis":
+        return RedisResponseCache()
+    if kind == "off":
+        return NullResponseCache()
+    raise ValueError(f"Неизвестный кэш ответов: {kind}")
+
+
+response_cache = create_response_cache()
@@ -0,0 +1,266 @@
+"""
+Хранилища состояний FSM (диалогов) для aiogram.
+
+По умолчанию aiogram держит состояния в памяти: после перезапуска они
+теряются, и несколько процессов бота не видят диалоги друг друга.
+Здесь два постоянных хранилища:
+
+- SQLiteStorage — файл на диске; подходит для нескольких процессов
+  на одной машине;
+- PostgresStorage — таблица fsm_state в базе бота (через общий пул).
+
+Состояние и данные сериализуются в компактный JSON, поэтому в данные
+диалога кладём только простые значения (id, строки, числа), а не записи
+из базы. Неактивные дольше FSM_TTL секунд диалоги считаются брошенными:
+они не возвращаются и удаляются фоновой очисткой (fsm_eviction_loop).
+
+Выбор хранилища — переменная FSM_STORAGE: memory, sqlite или postgres.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from collections import Counter
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from database import acquire
+
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory")
+FSM_TTL = int(os.getenv("FSM_TTL", "86400"))
+FSM_SQLITE_PATH = os.getenv("FSM_SQLITE_PATH", "fsm.sqlite3")
+FSM_PURGE_INTERVAL = int(os.getenv("FSM_PURGE_INTERVAL", "600"))
+
+_key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+
+def _dumps(data) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def _state_name(state) -> str | None:
+    return state.state if isinstance(state, State) else state
+
+
+class SQLiteStorage(BaseStorage):
+    """Состояния FSM в файле SQLite.
+
+    Запросы выполняются в отдельном потоке, чтобы не блокировать цикл событий.
+    """
+
+    def __init__(self, path: str = FSM_SQLITE_PATH, ttl: int = FSM_TTL):
+        self.ttl = ttl
+        self._lock = asyncio.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS fsm_state (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT NOT NULL DEFAULT '{}',
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS fsm_state_expires_idx ON fsm_state (expires_at)"
+        )
+
+    async def _run(self, sql: str, *params):
+        async with self._lock:
+            return await asyncio.to_thread(
+                lambda: self._conn.execute(sql, params).fetchone()
+            )
+
+    async def _get(self, key: StorageKey):
+        return await self._run(
+            "SELECT state, data FROM fsm_state WHERE key = ? AND expires_at > ?",
+            _key_builder.build(key),
+            time.time(),
+        )
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        # Данные истёкшей записи не должны ожить вместе с новым состоянием
+        now = time.time()
+        await self._run(
+            """
+            INSERT INTO fsm_state (key, state, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE
+            SET state = excluded.state,
+                data = CASE WHEN fsm_state.expires_at <= ? THEN '{}' ELSE fsm_state.data END,
+                expires_at = excluded.expires_at
+            """,
+            _key_builder.build(key),
+            _state_name(state),
+            now + self.ttl,
+            now,
+        )
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        row = await self._get(key)
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data) -> None:
+        now = time.time()
+        await self._run(
+            """
+            INSERT INTO fsm_state (key, data, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE
+            SET data = excluded.data,
+                state = CASE WHEN fsm_state.expires_at <= ? THEN NULL ELSE fsm_state.state END,
+                expires_at = excluded.expires_at
+            """,
+            _key_builder.build(key),
+            _dumps(dict(data)),
+            now + self.ttl,
+            now,
+        )
+
+    async def get_data(self, key: StorageKey) -> dict:
+        row = await self._get(key)
+        return json.loads(row[1]) if row else {}
+
+    async def purge_expired(self) -> None:
+        """Удаляет брошенные диалоги и пустые записи."""
+        await self._run(
+            "DELETE FROM fsm_state WHERE expires_at <= ? OR (state IS NULL AND data = '{}')",
+            time.time(),
+        )
+
+    async def count_states(self) -> dict:
+        async with self._lock:
+            rows = await asyncio.to_thread(
+                lambda: self._conn.execute(
+                    """
+                    SELECT state, COUNT(*) FROM fsm_state
+                    WHERE state IS NOT NULL AND expires_at > ?
+                    GROUP BY state
+                    """,
+                    (time.time(),),
+                ).fetchall()
+            )
+        return dict(rows)
+
+    async def close(self) -> None:
+        self._conn.close()
+
+
+class PostgresStorage(BaseStorage):
+    """Состояния FSM в таблице fsm_state базы бота (см. миграцию 12).
+
+    Несколько процессов бота с одной базой видят общие диалоги.
+    """
+
+    def __init__(self, ttl: int = FSM_TTL):
+        self.ttl = ttl
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        async with acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO fsm_state (key, state, expires_at)
+                VALUES ($1, $2, now() + $3 * INTERVAL '1 second')
+                ON CONFLICT (key) DO UPDATE
+                SET state = EXCLUDED.state,
+                    data = CASE WHEN fsm_state.expires_at <= now()
+                                THEN '{}'::JSONB ELSE fsm_state.data END,
+                    expires_at = EXCLUDED.expires_at
+                """,
+                _key_builder.build(key),
+                _state_name(state),
+                self.ttl,
+            )
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        async with acquire() as conn:
+            return await conn.fetchval(
+                "SELECT state FROM fsm_state WHERE key = $1 AND expires_at > now()",
+                _key_builder.build(key),
+            )
+
+    async def set_data(self, key: StorageKey, data) -> None:
+        async with acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO fsm_state (key, data, expires_at)
+                VALUES ($1, $2::JSONB, now() + $3 * INTERVAL '1 second')
+                ON CONFLICT (key) DO UPDATE
+                SET data = EXCLUDED.data,
+                    state = CASE WHEN fsm_state.expires_at <= now()
+                                 THEN NULL ELSE fsm_state.state END,
+                    expires_at = EXCLUDED.expires_at
+                """,
+                _key_builder.build(key),
+                _dumps(dict(data)),
+                self.ttl,
+            )
+
+    async def get_data(self, key: StorageKey) -> dict:
+        async with acquire() as conn:
+            data = await conn.fetchval(
+                "SELECT data::TEXT FROM fsm_state WHERE key = $1 AND expires_at > now()",
+                _key_builder.build(key),
+            )
+        return json.loads(data) if data else {}
+
+    async def purge_expired(self) -> None:
+        async with acquire() as conn:
+            await conn.execute(
+                """
+                DELETE FROM fsm_state
+                WHERE expires_at <= now() OR (state IS NULL AND data = '{}'::JSONB)
+                """
+            )
+
+    async def count_states(self) -> dict:
+        async with acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT state, COUNT(*) AS cnt FROM fsm_state
+                WHERE state IS NOT NULL AND expires_at > now()
+                GROUP BY state
+                """
+            )
+        return {row["state"]: row["cnt"] for row in rows}
+
+    async def close(self) -> None:
+        # Пул соединений закрывает bot.main()
+        pass
+
+
+def create_storage(kind: str = FSM_STORAGE) -> BaseStorage:
+    if kind == "sqlite":
+        return SQLiteStorage()
+    if kind == "postgres":
+        return PostgresStorage()
+    if kind == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Неизвестное хранилище FSM: {kind}")
+
+
+async def count_states(storage: BaseStorage) -> dict:
+    """Число диалогов в каждом состоянии FSM (метрика fsm_states)."""
+    if hasattr(storage, "count_states"):
+        return await storage.count_states()
+    if isinstance(storage, MemoryStorage):
+        return dict(
+            Counter(
+                record.state for record in storage.storage.values() if record.state is not None
+            )
+        )
+    return {}
+
+
+async def fsm_eviction_loop(storage: BaseStorage, interval: int = FSM_PURGE_INTERVAL):
+    """Периодически удаляет брошенные диалоги (для хранилищ с purge_expired)."""
+    if not hasattr(storage, "purge_expired"):
+        return
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await storage.purge_expired()
+        except Exception as e:
+            print(f"[FSM] Ошибка очистки состояний: {e}")
@@ -0,0 +1,269 @@
+"""
+Запуск бота в нескольких процессах (шардах).
+
+    python supervisor.py
+
+Главный процесс получает обновления от Telegram (опросом или вебхуком —
+BOT_MODE) и раздаёт их SHARDS рабочим процессам по user_id отправителя:
+все обновления одного пользователя попадают в один и тот же процесс,
+поэтому порядок шагов диалога и кэши пользователя остаются локальными.
+Рабочие процессы выполняют обычные обработчики из bot.py.
+
+Каждый рабочий процесс раз в секунду отмечается в общей памяти. Упавший
+или зависший (нет отметки дольше SHARD_HEARTBEAT_TIMEOUT) процесс
+перезапускается; его очередь обновлений сохраняется.
+
+Напоминания и очистку FSM выполняет только шард 0. Журнал отложенной
+записи (INGEST_MODE=buffered) у каждого шарда свой: INGEST_JOURNAL.<номер>.
+"""
+import asyncio
+import multiprocessing
+import os
+import queue
+import signal
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SHARDS = int(os.getenv("SHARDS", str(os.cpu_count() or 1)))
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", "1000"))
+SHARD_HEARTBEAT_TIMEOUT = float(os.getenv("SHARD_HEARTBEAT_TIMEOUT", "30"))
+SHARD_RESTART_DELAY = float(os.getenv("SHARD_RESTART_DELAY", "5"))
+SHARD_STOP_TIMEOUT = float(os.getenv("SHARD_STOP_TIMEOUT", "35"))
+
+# Виды обновлений, в которых отправитель лежит не в поле from
+_CHAT_ONLY_UPDATES = ("channel_post", "edited_channel_post")
+
+
+def shard_of(raw: dict, shards: int) -> int:
+    """Номер шарда для обновления Telegram (в виде JSON-словаря)."""
+    for field, event in raw.items():
+        if field == "update_id" or not isinstance(event, dict):
+            continue
+        sender = event.get("from") if field not in _CHAT_ONLY_UPDATES else None
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        owner = sender or chat
+        if owner and "id" in owner:
+            return owner["id"] % shards
+    return 0
+
+
+# --- Рабочий процесс ---
+
+
+def _worker_main(shard: int, updates, heartbeat):
+    journal = os.getenv("INGEST_JOURNAL", "ingest.journal")
+    os.environ["INGEST_JOURNAL"] = f"{journal}.{shard}"
+    # Шард останавливает главный процесс: присылает None в очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(_run_worker(shard, updates, heartbeat))
+
+
+async def _run_worker(shard: int, updates, heartbeat):
+    from aiogram.types import Update
+    import bot as app
+    from webhook import UpdateFeeder
+
+    async def beat():
+        while True:
+            heartbeat.value = time.time()
+            await asyncio.sleep(1)
+
+    beater = asyncio.create_task(beat())
+    feeder = UpdateFeeder(app.dp, app.bot)
+    try:
+        # У каждого шарда свой порт /metrics: METRICS_PORT + номер шарда
+        await app.on_startup(
+            background=shard == 0,
+            metrics_port=app.METRICS_PORT + shard if app.METRICS_PORT else 0,
+        )
+        await app.dp.emit_startup(bot=app.bot, dispatcher=app.dp, bots=[app.bot])
+        print(f"[Шард {shard}] Запущен, pid={os.getpid()}")
+        while True:
+            try:
+                raw = await asyncio.to_thread(updates.get, True, 1)
+            except queue.Empty:
+                if not multiprocessing.parent_process().is_alive():
+                    print(f"[Шард {shard}] Главный процесс завершился")
+                    break
+                continue
+            if raw is None:
+                break
+            feeder.submit(Update.model_validate(raw, context={"bot": app.bot}))
+    finally:
+        await feeder.drain()
+        await app.dp.emit_shutdown(bot=app.bot, dispatcher=app.dp, bots=[app.bot])
+        await app.on_shutdown()
+        beater.cancel()
+        print(f"[Шард {shard}] Остановлен")
+
+
+# --- Главный процесс ---
+
+
+class Supervisor:
+    def __init__(self, shards: int = SHARDS):
+        self.shards = shards
+        self._ctx = multiprocessing.get_context("spawn")
+        self._queues = [self._ctx.Queue(SHARD_QUEUE_SIZE) for _ in range(shards)]
+        self._heartbeats = [self._ctx.Value("d", 0.0) for _ in range(shards)]
+        self._workers = [None] * shards
+        self._restart_at = [0.0] * shards
+        self.restarts = 0
+
+    def _spawn(self, shard: int):
+        self._heartbeats[shard].value = time.time()
+        worker = self._ctx.Process(
+            target=_worker_main,
+            args=(shard, self._queues[shard], self._heartbeats[shard]),
+            name=f"shard-{shard}",
+        )
+        worker.start()
+        self._workers[shard] = worker
+
+    def start(self):
+        for shard in range(self.shards):
+            self._spawn(shard)
+
+    async def route(self, raw: dict):
+        # Ждём, если очередь шарда заполнена: это притормаживает приём обновлений
+        await asyncio.to_thread(self._queues[shard_of(raw, self.shards)].put, raw)
+
+    def check_health(self):
+        """Перезапускает упавшие и зависшие рабочие процессы."""
+        now = time.time()
+        for shard, worker in enumerate(self._workers):
+            if worker.is_alive():
+                if now - self._heartbeats[shard].value <= SHARD_HEARTBEAT_TIMEOUT:
+                    continue
+                print(f"[Шард {shard}] Не отвечает, перезапуск")
+                worker.kill()
+                worker.join()
+            elif not self._restart_at[shard]:
+                print(f"[Шард {shard}] Завершился с кодом {worker.exitcode}")
+                # Не перезапускаем сразу, чтобы не крутиться при постоянной ошибке
+                self._restart_at[shard] = now + SHARD_RESTART_DELAY
+                continue
+            if now < self._restart_at[shard]:
+                continue
+            self._restart_at[shard] = 0.0
+            self.restarts += 1
+            self._spawn(shard)
+
+    async def monitor(self, interval: float = 1.0):
+        while True:
+            self.check_health()
+            await asyncio.sleep(interval)
+
+    async def stop(self):
+        """Просит шарды доработать начатое и ждёт их завершения."""
+        for shard_queue in self._queues:
+            await asyncio.to_thread(shard_queue.put, None)
+        deadline = time.time() + SHARD_STOP_TIMEOUT
+        for worker in self._workers:
+            await asyncio.to_thread(worker.join, max(deadline - time.time(), 0))
+            if worker.is_alive():
+                worker.kill()
+
+
+async def poll_updates(bot, allowed_updates, route):
+    """Получает обновления опросом и отдаёт их в route."""
+    from aiogram.exceptions import TelegramNetworkError, TelegramServerError
+
+    offset = None
+    backoff = 1
+    while True:
+        try:
+            updates = await bot.get_updates(
+                offset=offset, timeout=30, allowed_updates=allowed_updates
+            )
+        except (TelegramNetworkError, TelegramServerError) as e:
+            print(f"[Супервизор] Ошибка получения обновлений: {e}")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+            continue
+        backoff = 1
+        for update in updates:
+            await route(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+            offset = update.update_id + 1
+
+
+async def serve_webhook(bot, allowed_updates, route):
+    """Принимает обновления вебхуком и отдаёт их в route."""
+    from aiohttp import web
+    from webhook import (
+        WEBHOOK_HOST,
+        WEBHOOK_PATH,
+        WEBHOOK_PORT,
+        WEBHOOK_SECRET,
+        WEBHOOK_URL,
+    )
+
+    async def handle(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get(
+            "X-Telegram-Bot-Api-Secret-Token"
+        ) != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        await route(await request.json())
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        print(f"[Супервизор] Слушаю {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        if WEBHOOK_URL:
+            await bot.set_webhook(
+                WEBHOOK_URL,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=allowed_updates,
+            )
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def main():
+    from bot import BOT_MODE, bot, dp
+
+    supervisor = Supervisor()
+    supervisor.start()
+    print(f"[Супервизор] Запущено шардов: {supervisor.shards}")
+
+    receive = serve_webhook if BOT_MODE == "webhook" else poll_updates
+    tasks = [
+        asyncio.create_task(supervisor.monitor()),
+        asyncio.create_task(
+            receive(bot, dp.resolve_used_update_types(), supervisor.route)
+        ),
+    ]
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    try:
+        # Приём или мониторинг завершаются только с ошибкой
+        stop_task = asyncio.create_task(stop.wait())
+        done, _ = await asyncio.wait(
+            [stop_task, *tasks], return_when=asyncio.FIRST_COMPLETED
+        )
+        for task in done:
+            if task is not stop_task:
+                task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+        print("[Супервизор] Остановка шардов...")
+        await supervisor.stop()
+        await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
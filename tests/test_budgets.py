@@ -0,0 +1,73 @@
+from decimal import Decimal
+
+import pytest
+
+import budgets
+from budgets import budget_alerts
+
+
+@pytest.fixture(autouse=True)
+def thresholds(monkeypatch):
+    # Значения по умолчанию, даже если BUDGET_ALERT_THRESHOLDS задан в окружении
+    monkeypatch.setattr(budgets, "BUDGET_ALERT_THRESHOLDS", (80, 100))
+
+
+def state(category, limit, before, after):
+    return {
+        "category_name": category,
+        "budget_limit": Decimal(limit),
+        "spent_before": Decimal(before),
+        "spent_after": Decimal(after),
+    }
+
+
+@pytest.mark.parametrize(
+    "before, after, expected",
+    [
+        ("0", "500", None),
+        ("0", "799.99", None),
+        ("0", "800", "⚠️"),
+        ("700", "900", "⚠️"),
+        ("800", "900", None),
+        ("900", "999.99", None),
+        ("900", "1000", "🚨"),
+        ("500", "1200", "🚨"),
+        ("1000", "1500", None),
+    ],
+)
+def test_thresholds(before, after, expected):
+    alerts = budget_alerts([state("Еда", "1000", before, after)])
+    if expected is None:
+        assert alerts == []
+    else:
+        assert len(alerts) == 1 and alerts[0].startswith(expected)
+
+
+def test_alert_text():
+    assert budget_alerts([state("Еда", "1000", "700", "810")]) == [
+        "⚠️ Бюджет «Еда»: потрачено 810 из 1000 руб. (81%)"
+    ]
+    assert budget_alerts([state("Еда", "1000", "900", "1110")]) == [
+        "🚨 Бюджет «Еда» превышен: 1110 из 1000 руб. (111%)"
+    ]
+
+
+def test_one_alert_per_category():
+    # Несколько строк одного сообщения: считаем от счётчика до первой записи
+    alerts = budget_alerts(
+        [
+            state("Еда", "1000", "700", "790"),
+            state("Еда", "1000", "790", "850"),
+            state("Еда", "1000", "850", "1100"),
+            state("Кафе", "500", "0", "450"),
+            state("Такси", "300", "0", "100"),
+        ]
+    )
+    assert alerts == [
+        "🚨 Бюджет «Еда» превышен: 1100 из 1000 руб. (110%)",
+        "⚠️ Бюджет «Кафе»: потрачено 450 из 500 руб. (90%)",
+    ]
+
+
+def test_no_states():
+    assert budget_alerts([]) == []
@@ -0,0 +1,176 @@
+import io
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from importer import (
+    IMPORT_DEFAULT_CATEGORY,
+    CategoryMapper,
+    StatementParser,
+    iter_csv,
+    iter_ofx,
+    parse_amount,
+    parse_date,
+)
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("100", Decimal("100")),
+        ("-1 234,56 ₽", Decimal("-1234.56")),
+        ("1,234.56", Decimal("1234.56")),
+        ("1 000 руб.", Decimal("1000")),
+        ("−99,90", Decimal("-99.90")),
+        ("12.5 RUB", Decimal("12.5")),
+    ],
+)
+def test_parse_amount(text, expected):
+    assert parse_amount(text) == expected
+
+
+@pytest.mark.parametrize("text", ["", None, "abc", "NaN", "Infinity", "-inf", "sNaN"])
+def test_parse_amount_rejects(text):
+    with pytest.raises(ValueError):
+        parse_amount(text)
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("05.03.2024", datetime(2024, 3, 5)),
+        ("05.03.2024 14:30", datetime(2024, 3, 5, 14, 30)),
+        ("05.03.2024 14:30:15", datetime(2024, 3, 5, 14, 30, 15)),
+        ("2024-03-05", datetime(2024, 3, 5)),
+        ("2024-03-05 14:30:15", datetime(2024, 3, 5, 14, 30, 15)),
+        ("2024-03-05T14:30:15+03:00", datetime(2024, 3, 5, 14, 30, 15)),
+    ],
+)
+def test_parse_date(text, expected):
+    assert parse_date(text) == expected
+
+
+@pytest.mark.parametrize("text", ["", "32.01.2024", "вчера", "2024/03/05"])
+def test_parse_date_rejects(text):
+    with pytest.raises(ValueError):
+        parse_date(text)
+
+
+@pytest.mark.parametrize("delimiter", [";", ",", "\t"])
+def test_iter_csv_dialects(delimiter):
+    rows = [
+        ["Дата операции", "Сумма", "Категория", "Описание"],
+        ["05.03.2024", "-250.50", "Кафе", "Обед"],
+        ["06.03.2024", "1000", "Зарплата", ""],
+        ["", "", "", ""],
+        ["вчера", "10", "Кафе", ""],
+    ]
+    text = "\n".join(delimiter.join(row) for row in rows) + "\n"
+    entries = list(iter_csv(io.StringIO(text)))
+    assert entries[0] == (
+        2, (datetime(2024, 3, 5), "Expense", Decimal("250.50"), "Кафе", "Обед")
+    )
+    assert entries[1] == (
+        3, (datetime(2024, 3, 6), "Income", Decimal("1000"), "Зарплата", "")
+    )
+    line_no, error = entries[2]
+    assert line_no == 5 and isinstance(error, ValueError)
+    assert len(entries) == 3
+
+
+def test_iter_csv_without_columns():
+    with pytest.raises(ValueError):
+        list(iter_csv(io.StringIO("a;b\n1;2\n")))
+
+
+def _ofx(padding: int) -> str:
+    transaction = (
+        "<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240305143000<TRNAMT>-250.50"
+        "<NAME>Кафе<MEMO>Обед</STMTTRN>"
+    )
+    return "<OFX><BANKTRANLIST>" + " " * padding + transaction * 2 + "</BANKTRANLIST></OFX>"
+
+
+def _chunks(text: str, size: int):
+    return (text[start:start + size] for start in range(0, len(text), size))
+
+
+@pytest.mark.parametrize("shift", range(-25, 5))
+def test_iter_ofx_tag_across_chunks(shift):
+    # Сдвигаем транзакцию так, чтобы граница 64 КиБ резала каждый тег по очереди
+    text = _ofx(65536 - len("<OFX><BANKTRANLIST>") + shift)
+    entries = list(iter_ofx(_chunks(text, 65536)))
+    expected = (datetime(2024, 3, 5, 14, 30), "Expense", Decimal("250.50"), None, "Кафе Обед")
+    assert entries == [(1, expected), (2, expected)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 7, 64])
+def test_iter_ofx_small_chunks(size):
+    assert list(iter_ofx(_chunks(_ofx(0), size))) == list(iter_ofx([_ofx(0)]))
+
+
+@pytest.mark.parametrize(
+    "category, description, type_, expected",
+    [
+        ("кафе", None, "Expense", "Кафе"),
+        ("  Кафе и рестораны ", None, "Expense", "Кафе и рестораны"),
+        (None, "Оплата: кафе и рестораны Ромашка", "Expense", "Кафе и рестораны"),
+        ("Фастфуд", "Кафе у дома", "Expense", "Кафе"),
+        ("Неизвестная категория банка", "", "Expense", IMPORT_DEFAULT_CATEGORY),
+        (None, None, "Expense", IMPORT_DEFAULT_CATEGORY),
+        ("Кэшбэк", None, "Income", "Кэшбэк"),
+    ],
+)
+def test_category_mapper(category, description, type_, expected):
+    mapper = CategoryMapper({"Expense": ["Кафе", "Кафе и рестораны", "Транспорт"]})
+    assert mapper.map(category, description, type_) == expected
+
+
+def _parse(entries, limit=None):
+    parser = StatementParser(42, entries, CategoryMapper({"Expense": ["Кафе"]}))
+    records = []
+    while chunk := parser.parse(limit):
+        records += chunk
+    return records, parser.stats
+
+
+ROW = (datetime(2024, 3, 5), "Expense", Decimal("250.50"), "Кафе", "")
+
+
+@pytest.mark.parametrize("limit", [None, 1, 2])
+def test_dedupe_key_counts_occurrences(limit):
+    entries = [(2, ROW), (3, ROW), (4, ValueError("не дата")), (5, ROW)]
+    records, stats = _parse(entries, limit)
+    ids = [record[0] for record in records]
+    assert len(set(ids)) == 3
+    # Повторный разбор того же файла даёт те же ключи
+    assert ids == [record[0] for record in _parse(entries)[0]]
+    assert stats == {"parsed": 3, "failed": 1, "errors": [(4, "не дата")]}
+
+
+def test_dedupe_key_first_occurrence_is_stable():
+    # Первая строка не зависит от повторов дальше в файле
+    single, _ = _parse([(2, ROW)])
+    repeated, _ = _parse([(2, ROW), (3, ROW)])
+    assert single[0][0] == repeated[0][0]
+
+
+@pytest.mark.parametrize(
+    "other",
+    [
+        (datetime(2024, 3, 5), "Expense", Decimal("250.50"), "Прочее", ""),
+        (datetime(2024, 3, 6), "Expense", Decimal("250.50"), "Кафе", ""),
+        (datetime(2024, 3, 5), "Expense", Decimal("250.51"), "Кафе", ""),
+        (datetime(2024, 3, 5), "Income", Decimal("250.50"), "Кафе", ""),
+    ],
+)
+def test_dedupe_key_distinguishes_rows(other):
+    records, _ = _parse([(2, ROW), (3, other)])
+    assert records[0][0] != records[1][0]
+
+
+def test_dedupe_key_ignores_amount_format():
+    records, _ = _parse([(2, ROW)])
+    same = (ROW[0], ROW[1], Decimal("250.500"), ROW[3], ROW[4])
+    assert _parse([(2, same)])[0][0][0] == records[0][0]
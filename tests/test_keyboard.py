@@ -0,0 +1,43 @@
+from datetime import datetime
+
+import pytest
+
+from keyboard import category_tag, decode_history_callback, encode_history_callback
+
+# Telegram принимает callback_data не длиннее 64 байт
+CALLBACK_DATA_LIMIT = 64
+LONG_NAMES = ["Я" * 4096, "🍕" * 1024, "x" * 4096]
+CURSORS = [
+    (datetime(1970, 1, 1), 0),
+    (datetime(2024, 3, 5, 14, 30, 15, 123456), 1),
+    (datetime(1969, 12, 31, 23, 59, 59, 999999), 42),
+    (datetime(1900, 1, 1), 2**31 - 1),
+    (datetime.max, 2**63 - 1),
+]
+
+
+@pytest.mark.parametrize("cursor", CURSORS)
+@pytest.mark.parametrize("type_", [None, "Income", "Expense"])
+@pytest.mark.parametrize("action", ["n", "p"])
+def test_cursor_round_trip(cursor, type_, action):
+    data = encode_history_callback(action, cursor, type_, "Кафе")
+    assert decode_history_callback(data) == (action, cursor, type_, category_tag("Кафе"))
+
+
+def test_first_page_round_trip():
+    assert decode_history_callback(encode_history_callback("f")) == ("f", None, None, None)
+
+
+@pytest.mark.parametrize("category", [None, "Кафе", *LONG_NAMES])
+@pytest.mark.parametrize("cursor", CURSORS)
+def test_callback_data_fits_limit(category, cursor):
+    data = encode_history_callback("n", cursor, "Expense", category)
+    assert len(data.encode()) <= CALLBACK_DATA_LIMIT
+
+
+@pytest.mark.parametrize(
+    "data", ["hist:n", "hist:n:zz:1:e", "hist:n:??:1:e:", "hist:n:1:xyz!:e:", "hist:n:1::e:"]
+)
+def test_decode_rejects_malformed(data):
+    with pytest.raises(ValueError):
+        decode_history_callback(data)
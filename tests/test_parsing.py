@@ -0,0 +1,101 @@
+from decimal import Decimal
+
+import pytest
+from hypothesis import given, strategies as st
+
+from parsing import MAX_AMOUNT, ParseError, parse_entries, parse_entry
+
+amounts = st.decimals(
+    min_value=Decimal("0.01"), max_value=MAX_AMOUNT, places=2, allow_nan=False
+)
+words = st.text(
+    alphabet=st.characters(whitelist_categories=("Lu", "Ll")), min_size=1, max_size=12
+)
+categories = st.lists(words, min_size=1, max_size=3).map(" ".join).filter(
+    # «тыс» после суммы — множитель, а не категория
+    lambda category: category.split()[0].lower() not in ("тыс", "тыс.")
+)
+spaces = st.sampled_from([" ", "  ", "\t", "\u00a0"])
+
+
+def group_thousands(number: int, separator: str) -> str:
+    return f"{number:,}".replace(",", separator)
+
+
+@given(amounts, categories, spaces)
+def test_round_trip(amount, category, space):
+    assert parse_entry(f"{amount}{space}{category}") == (amount, category)
+
+
+@given(amounts, categories)
+def test_comma_decimal(amount, category):
+    text = str(amount).replace(".", ",")
+    assert parse_entry(f"{text} {category}") == (amount, category)
+
+
+@given(
+    st.integers(min_value=1000, max_value=10**11),
+    st.sampled_from([" ", "\u00a0", "\u202f", ",", "."]),
+    st.one_of(st.none(), st.integers(min_value=0, max_value=99)),
+    categories,
+)
+def test_thousands_separators(number, separator, cents, category):
+    text = group_thousands(number, separator)
+    expected = Decimal(number)
+    if cents is not None:
+        # Разделитель копеек — не тот, что у тысяч
+        text += ("," if separator == "." else ".") + f"{cents:02d}"
+        expected += Decimal(cents) / 100
+    expected = expected.quantize(Decimal("0.01"))
+    assert parse_entry(f"{text} {category}") == (expected, category)
+
+
+@given(
+    st.integers(min_value=1, max_value=10**6), st.sampled_from(["к", "k", "К", "K"]), words
+)
+def test_detached_letter_is_not_thousands(number, letter, word):
+    # «500 к празднику»: отдельно стоящая «к» — предлог, часть категории
+    assert parse_entry(f"{number} {letter} {word}") == (
+        Decimal(number).quantize(Decimal("0.01")),
+        f"{letter} {word}",
+    )
+
+
+@given(
+    st.integers(min_value=1, max_value=10**6),
+    st.sampled_from(["к", "k", "К", "тыс", " тыс", "тыс."]),
+)
+def test_attached_suffix_is_thousands(number, suffix):
+    assert parse_entry(f"{number}{suffix} Аренда") == (
+        Decimal(number * 1000).quantize(Decimal("0.01")),
+        "Аренда",
+    )
+
+
+@given(st.lists(st.tuples(amounts, categories), min_size=1, max_size=5))
+def test_entries_keep_order(entries):
+    text = "\n\n".join(f"{amount} {category}" for amount, category in entries)
+    assert parse_entries(text) == entries
+
+
+@pytest.mark.parametrize(
+    "line, expected",
+    [
+        ("500 к празднику", (Decimal("500.00"), "к празднику")),
+        ("300 k bar", (Decimal("300.00"), "k bar")),
+        ("1.5k Кофе", (Decimal("1500.00"), "Кофе")),
+        ("3 тыс Аренда", (Decimal("3000.00"), "Аренда")),
+        ("1.500 Кафе", (Decimal("1500.00"), "Кафе")),
+        ("1500.125 Кафе", (Decimal("1500.13"), "Кафе")),
+        ("120+35 Такси", (Decimal("155.00"), "Такси")),
+        ("1000/3 Подарок", (Decimal("333.33"), "Подарок")),
+    ],
+)
+def test_examples(line, expected):
+    assert parse_entry(line) == expected
+
+
+@pytest.mark.parametrize("line", ["Продукты", "0 Кафе", "5-10 Кафе", "500кофе", "500", "1/0 Кафе"])
+def test_rejected(line):
+    with pytest.raises(ParseError):
+        parse_entry(line)
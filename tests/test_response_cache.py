@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+import response_cache
+from response_cache import MemoryResponseCache
+
+
+class Builder:
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        return f"ответ {self.calls}"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_entries_live_until_invalidated(clock):
+    cache, build = MemoryResponseCache(), Builder()
+
+    async def scenario():
+        assert await cache.get_or_set(1, "balance", build) == "ответ 1"
+        clock[0] += 86400
+        assert await cache.get_or_set(1, "balance", build) == "ответ 1"
+        await cache.invalidate(1)
+        assert await cache.get_or_set(1, "balance", build) == "ответ 2"
+        await cache.invalidate_all()
+        assert await cache.get_or_set(1, "balance", build) == "ответ 3"
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize(
+    "max_age, ttl, alive, expired",
+    [(0, 300, 299, 301), (60, None, 59, 61), (60, 300, 59, 61), (600, 300, 299, 301)],
+)
+def test_entry_expiry(clock, max_age, ttl, alive, expired):
+    cache, build = MemoryResponseCache(max_age=max_age), Builder()
+
+    async def scenario():
+        start = clock[0]
+        await cache.get_or_set(1, "stats", build, ttl)
+        clock[0] = start + alive
+        assert await cache.get_or_set(1, "stats", build, ttl) == "ответ 1"
+        clock[0] = start + expired
+        assert await cache.get_or_set(1, "stats", build, ttl) == "ответ 2"
+
+    asyncio.run(scenario())
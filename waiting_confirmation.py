@@ -15,13 +15,15 @@ async def process_confirmation(message: Message, state: FSMContext):
     user_reply = message.text.strip()
     # Если ответ "Да"
     if user_reply == "Да✅":
-        # Получаем данные последней транзакции из состояния
+        # Получаем id последней транзакции из состояния
         data = await state.get_data()
-        row = data.get("last_transaction")
+        transaction_id = data.get("last_transaction_id")
 
-        if row:
-            # Вызываем функцию для удаления транзакции
-            result = await delete_last_transaction(message.from_user.id)
+        if transaction_id:
+            # Удаляем, только если это всё ещё та транзакция, что показали
+            result = await delete_last_transaction(
+                message.from_user.id, transaction_id
+            )
 
             if result:
                 await message.answer(
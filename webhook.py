@@ -0,0 +1,203 @@
+"""
+Приём обновлений Telegram через вебхук (BOT_MODE=webhook).
+
+Telegram присылает обновления POST-запросами на aiohttp-сервер. Сервер
+сразу отвечает 200, а обновление обрабатывается в фоне, так что
+обработчики разных пользователей выполняются параллельно. Обновления
+одного пользователя (или чата — WEBHOOK_SERIALIZE) обрабатываются строго
+по очереди, иначе шаги диалога FSM могли бы перепутаться.
+
+При остановке (SIGINT/SIGTERM) сервер перестаёт принимать обновления
+(Telegram повторит их позже) и дожидается уже начатых обработчиков,
+но не дольше WEBHOOK_DRAIN_TIMEOUT секунд.
+"""
+import asyncio
+import os
+import signal
+from aiohttp import web
+from aiogram.types import Update
+
+# Публичный адрес вебхука (https://.../webhook); если задан, регистрируется при запуске
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# user — по очереди для каждого пользователя, chat — для чата, none — без очереди
+WEBHOOK_SERIALIZE = os.getenv("WEBHOOK_SERIALIZE", "user")
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "100"))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))
+
+
+def serialization_key(update: Update, mode: str = WEBHOOK_SERIALIZE):
+    """Ключ, по которому обновления обрабатываются по очереди (None — без очереди)."""
+    if mode == "none":
+        return None
+    event = update.event
+    if mode == "chat":
+        chat = getattr(event, "chat", None) or getattr(
+            getattr(event, "message", None), "chat", None
+        )
+        return chat.id if chat else None
+    user = getattr(event, "from_user", None)
+    return user.id if user else None
+
+
+class UpdateFeeder:
+    """Передаёт обновления диспетчеру в фоновых задачах.
+
+    Обновления с одинаковым ключом (serialization_key) обрабатываются
+    по очереди, остальные — параллельно, но не больше max_concurrency сразу.
+    """
+
+    def __init__(
+        self,
+        dp,
+        bot,
+        serialize: str = WEBHOOK_SERIALIZE,
+        max_concurrency: int = WEBHOOK_MAX_CONCURRENCY,
+    ):
+        self.dp = dp
+        self.bot = bot
+        self.serialize = serialize
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # Ключ очереди -> [блокировка, сколько обновлений её ждёт или держит]
+        self._locks = {}
+        self._tasks = set()
+        self.stats = {"received": 0, "processed": 0, "failed": 0}
+
+    def submit(self, update: Update):
+        self.stats["received"] += 1
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def _process(self, update: Update):
+        key = serialization_key(update, self.serialize)
+        if key is None:
+            await self._feed(update)
+            return
+
+        # asyncio.Lock отдаёт блокировку ожидающим в порядке очереди,
+        # поэтому обновления одного ключа идут в порядке поступления
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._feed(update)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def _feed(self, update: Update):
+        async with self._semaphore:
+            try:
+                await self.dp.feed_update(self.bot, update)
+                self.stats["processed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                print(f"[Обновления] Ошибка обработки update_id={update.update_id}: {e}")
+
+    async def drain(self, timeout: float = WEBHOOK_DRAIN_TIMEOUT):
+        """Дожидается начатых обработчиков, но не дольше timeout секунд."""
+        if not self._tasks:
+            return
+        print(f"[Обновления] Завершение: обработчиков в работе {len(self._tasks)}")
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            print(f"[Обновления] Прервано обработчиков по таймауту: {len(pending)}")
+
+
+class WebhookServer:
+    def __init__(
+        self,
+        dp,
+        bot,
+        path: str = WEBHOOK_PATH,
+        secret: str | None = WEBHOOK_SECRET,
+        serialize: str = WEBHOOK_SERIALIZE,
+        max_concurrency: int = WEBHOOK_MAX_CONCURRENCY,
+        drain_timeout: float = WEBHOOK_DRAIN_TIMEOUT,
+    ):
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.drain_timeout = drain_timeout
+        self.feeder = UpdateFeeder(dp, bot, serialize, max_concurrency)
+        self.stats = self.feeder.stats
+        self._accepting = False
+        self._runner = None
+        self._site = None
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    def check_secret(self, request: web.Request) -> bool:
+        return not self.secret or request.headers.get(
+            "X-Telegram-Bot-Api-Secret-Token"
+        ) == self.secret
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not self.check_secret(request):
+            return web.Response(status=401)
+        if not self._accepting:
+            # Telegram повторит доставку, когда бот снова запустится
+            return web.Response(status=503)
+
+        update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        self.feeder.submit(update)
+        return web.Response()
+
+    async def start(self, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT):
+        """Запускает HTTP-сервер и события запуска диспетчера."""
+        await self.dp.emit_startup(bot=self.bot, dispatcher=self.dp, bots=[self.bot])
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        self._site = web.TCPSite(self._runner, host, port)
+        await self._site.start()
+        self._accepting = True
+        print(f"[Вебхук] Слушаю {host}:{port}{self.path}")
+
+    async def stop(self):
+        """Перестаёт принимать обновления и дожидается начатых обработчиков."""
+        self._accepting = False
+        await self.feeder.drain(self.drain_timeout)
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        await self.dp.emit_shutdown(bot=self.bot, dispatcher=self.dp, bots=[self.bot])
+
+
+async def run_webhook(dp, bot, url: str | None = WEBHOOK_URL):
+    """Работает в режиме вебхука до SIGINT/SIGTERM."""
+    server = WebhookServer(dp, bot)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows: остановка по KeyboardInterrupt
+            pass
+
+    await server.start()
+    try:
+        if url:
+            await bot.set_webhook(
+                url,
+                secret_token=server.secret,
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+        await stop.wait()
+    finally:
+        await server.stop()